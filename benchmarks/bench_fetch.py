@@ -0,0 +1,44 @@
+"""
+Benchmark of fetching and caching against the local openligadb stand-in.
+Measures a cold backfill with different numbers of concurrent requests and
+a warm start, with configurable latency and error rate.
+
+Usage: python benchmarks/bench_fetch.py [seasons] [latency] [errorRate]
+"""
+import sys
+import tempfile
+import time
+from teamproject import crawler
+from teamproject.standin import StandInServer
+
+
+def main(seasons: int = 10, latency: float = 0.05, errorRate: float = 0.05):
+    seasonList = list(range(2020 - seasons + 1, 2021))
+    with StandInServer(seasonList, latency=latency, errorRate=errorRate,
+                       seed=0) as server:
+        crawler.g_api_url = server.url
+        for maxInFlight in [1, 4, 16]:
+            crawler.g_cache_path = tempfile.mkdtemp()
+            crawler.g_client = crawler.Client(maxInFlight=maxInFlight,
+                                              rate=1000, backoff=0.01)
+            server.hits.clear()
+            start = time.perf_counter()
+            crawler.refresh_ui_cache()
+            data = crawler.get_data(seasonList[0], 1, seasonList[-1], 38)
+            seconds = time.perf_counter() - start
+            print(f'cold, {maxInFlight:2} in flight: {seconds:6.2f} s, '
+                  f'{sum(server.hits.values()):4} requests, '
+                  f'{len(data)} matches')
+            server.hits.clear()
+            start = time.perf_counter()
+            crawler.refresh_ui_cache()
+            crawler.get_data(seasonList[0], 1, seasonList[-1], 38)
+            seconds = time.perf_counter() - start
+            print(f'warm, {maxInFlight:2} in flight: {seconds:6.2f} s, '
+                  f'{sum(server.hits.values()):4} requests')
+            crawler.g_client.close()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10,
+         *map(float, sys.argv[2:]))
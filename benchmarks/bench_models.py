@@ -0,0 +1,249 @@
+"""
+Benchmark of fitting the prediction models on synthetic leagues. Compares
+the fit time of DixonColes to previous implementations: team lookups via
+dictionaries and scipy.stats.poisson in every evaluation of the likelihood,
+and the vectorized likelihood minimized by SLSQP with numerical gradients.
+Also measures a weekly refit, i.e. DixonColes.update() with the last
+matchday after fitting all previous matches, and compares PoissonRegression
+to the previous implementation (statsmodels formula) on growing windows.
+Finally compares the outcome probabilities of many pairs of expected goals
+(pmf per goal count and outer product vs models.outcome_probabilities).
+
+Usage: python benchmarks/bench_models.py [seasons]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+from teamproject import crawler, models
+from teamproject.standin import make_league
+
+
+class DixonColesSLSQP(models.DixonColes):
+    """models.DixonColes minimized by SLSQP with numerical gradients and the
+    constraint on the attack values.
+    """
+
+    def solve_parameters(self, dataset, xi, initVals=None, **kwargs):
+        from scipy.optimize import minimize
+
+        teams = np.sort(dataset['homeTeamName'].unique())
+        nTeams = len(teams)
+        initVals = np.concatenate((np.random.uniform(0, 1, nTeams),
+                                   np.random.uniform(0, -1, nTeams),
+                                   np.array([0, 1.0])))
+        arrays = self.match_arrays(dataset, teams, xi)
+        constraints = [{'type': 'eq',
+                        'fun': lambda x: sum(x[:nTeams]) - nTeams}]
+        optOutput = minimize(
+            lambda p: self.estimate_paramters(p, nTeams, arrays), initVals,
+            options={'maxiter': 100}, constraints=constraints)
+        return dict(zip(['attack_' + team for team in teams]
+                        + ['defence_' + team for team in teams]
+                        + ['rho', 'home_adv'], optOutput.x))
+
+
+class DixonColesDicts(DixonColesSLSQP):
+    """Implementation of models.DixonColes before vectorizing the likelihood.
+    """
+
+    def dc_log_like_decay(self, x, y, alpha_x, beta_x, alpha_y, beta_y, rho,
+                          gamma, t, xi):
+        from scipy.stats import poisson
+
+        lambda_x = np.exp(alpha_x + beta_y + gamma)
+        mu_y = np.exp(alpha_y + beta_x)
+        return np.exp(-xi * t) * (
+            np.log(self.rho_correction(x, y, lambda_x, mu_y, rho))
+            + np.log(poisson.pmf(x, lambda_x)) + np.log(poisson.pmf(y, mu_y)))
+
+    def estimate_paramters(self, params, nTeams, arrays, gradient=False):
+        teams, dataset = arrays['teams'], arrays['dataset']
+        scoreCoefs = dict(zip(teams, params[:nTeams]))
+        defendCoefs = dict(zip(teams, params[nTeams:(2 * nTeams)]))
+        homeTeams = dataset.homeTeamName.values
+        awayTeams = dataset.guestTeamName.values
+        rho, gamma = params[-2:]
+        logLike = self.dc_log_like_decay(
+            dataset.homeScore.values, dataset.guestScore.values,
+            np.array([scoreCoefs[team] for team in homeTeams]),
+            np.array([defendCoefs[team] for team in homeTeams]),
+            np.array([scoreCoefs[team] for team in awayTeams]),
+            np.array([defendCoefs[team] for team in awayTeams]),
+            np.repeat(rho, len(dataset)), np.repeat(gamma, len(dataset)),
+            dataset.time_dif.values, arrays['xi'])
+        return -sum(logLike)
+
+    def match_arrays(self, dataset, teams, xi) -> dict:
+        return {'teams': teams, 'dataset': dataset, 'xi': xi}
+
+
+class PoissonRegressionFormula(models.PoissonRegression):
+    """Previous implementation of models.PoissonRegression (statsmodels
+    formula with a dense design and DataFrames for each prediction).
+    """
+
+    def __init__(self, df):
+        import statsmodels.api as sm
+        import statsmodels.formula.api as smf
+
+        self.df = df
+        self.teams = np.unique(self.df['guestTeamName'])
+        columns = ['team', 'opponent', 'goals', 'home']
+        self.goalModelData = pd.concat([
+            df[['homeTeamName', 'guestTeamName', 'homeScore']].assign(home=1)
+            .set_axis(columns, axis=1),
+            df[['guestTeamName', 'homeTeamName', 'guestScore']].assign(home=0)
+            .set_axis(columns, axis=1)])
+        self.poissonModel = smf.glm(
+            formula='goals ~ home + team + opponent', data=self.goalModelData,
+            family=sm.families.Poisson()).fit()
+
+    def predict(self, homeTeam, guestTeam, maxGoals=10):
+        from scipy.stats import poisson
+
+        model = self.poissonModel
+        homeGoalsAvg = model.predict(pd.DataFrame(
+            data={'team': homeTeam, 'opponent': guestTeam, 'home': 1},
+            index=[1])).values[0]
+        awayGoalsAvg = model.predict(pd.DataFrame(
+            data={'team': guestTeam, 'opponent': homeTeam, 'home': 0},
+            index=[1])).values[0]
+        teamPred = [[poisson.pmf(i, teamAvg) for i in range(0, maxGoals + 1)]
+                    for teamAvg in [homeGoalsAvg, awayGoalsAvg]]
+        resultMatrix = np.outer(np.array(teamPred[0]), np.array(teamPred[1]))
+        return [np.sum(np.tril(resultMatrix, -1)), np.sum(np.diag(resultMatrix)),
+                np.sum(np.triu(resultMatrix, 1))]
+
+
+def make_matches(seasons: int) -> pd.DataFrame:
+    """Generates finished matches of the first division.
+
+    Args:
+        seasons (int): Number of seasons.
+
+    Returns:
+        A pd.DataFrame containing match data in internal format.
+    """
+    data = [match for season in range(2020 - seasons + 1, 2021)
+            for match in make_league('bl1', season, nTeams=20)]
+    matches = crawler.parse_league(data)
+    matches[['homeScore', 'guestScore']] = \
+        matches[['homeScore', 'guestScore']].astype(int)
+    return matches
+
+
+def bench_poisson(seasons: int):
+    """Compares fit and prediction of PoissonRegression to the previous
+    implementation on growing windows.
+
+    Args:
+        seasons (int): Number of seasons of the largest window.
+    """
+    # import statsmodels and scipy before measuring
+    PoissonRegressionFormula(make_matches(1)).predict('bl1 Team 1', 'bl1 Team 2')
+    for window in [n for n in (1, 3, 10, 30) if n <= seasons]:
+        df = make_matches(window)
+        fits = {}
+        for name, model in [('formula (previous)', PoissonRegressionFormula),
+                            ('sparse IRLS', models.PoissonRegression)]:
+            start = time.perf_counter()
+            fits[name] = model(df)
+            fitSeconds = time.perf_counter() - start
+            start = time.perf_counter()
+            predictions = [fits[name].predict(home, guest)
+                           for home in fits[name].teams
+                           for guest in fits[name].teams]
+            predictSeconds = time.perf_counter() - start
+            print(f'PoissonRegression {window} seasons {name:18} '
+                  f'fit {fitSeconds:6.3f} s, {len(predictions)} predictions '
+                  f'{predictSeconds:6.3f} s')
+            fits[name] = predictions
+        previous, current = fits.values()
+        print(f'max difference of predictions '
+              f'{np.abs(np.subtract(previous, current)).max():.2g}')
+
+
+def outcome_probabilities_outer(homeGoalsAvg, awayGoalsAvg, maxGoals=10):
+    """Previous computation of the outcome probabilities, one pair at a time.
+
+    Args:
+        homeGoalsAvg (array of float): Expected goals of the home teams.
+        awayGoalsAvg (array of float): Expected goals of the guest teams.
+        maxGoals (int): Max amount of goals per team to consider.
+
+    Returns:
+        An array of the probabilities of home win, draw and guest win.
+    """
+    from scipy.stats import poisson
+
+    probabilities = []
+    for teamAvgs in zip(homeGoalsAvg, awayGoalsAvg):
+        teamPred = [[poisson.pmf(i, teamAvg) for i in range(0, maxGoals + 1)]
+                    for teamAvg in teamAvgs]
+        resultMatrix = np.outer(np.array(teamPred[0]), np.array(teamPred[1]))
+        probabilities.append([np.sum(np.tril(resultMatrix, -1)),
+                              np.sum(np.diag(resultMatrix)),
+                              np.sum(np.triu(resultMatrix, 1))])
+    return np.array(probabilities)
+
+
+def bench_outcomes(pairs: int = 1000):
+    """Compares the computations of outcome probabilities.
+
+    Args:
+        pairs (int): Number of pairs of expected goals.
+    """
+    rng = np.random.default_rng(0)
+    homeGoalsAvg = rng.uniform(0.2, 4, pairs)
+    awayGoalsAvg = rng.uniform(0.2, 4, pairs)
+    results = {}
+    for name, func in [
+            ('outer (previous)', outcome_probabilities_outer),
+            ('kernel', models.outcome_probabilities),
+            ('Skellam (exact)', lambda home, away: models.outcome_probabilities(
+                home, away, None))]:
+        func(homeGoalsAvg[:1], awayGoalsAvg[:1])
+        start = time.perf_counter()
+        results[name] = func(homeGoalsAvg, awayGoalsAvg)
+        seconds = time.perf_counter() - start
+        print(f'outcomes {name:18} {pairs / seconds:12,.0f} pairs/s')
+    previous, kernel, exact = results.values()
+    print(f'max difference kernel to previous '
+          f'{np.abs(kernel - previous).max():.2g}, to exact '
+          f'{np.abs(kernel - exact).max():.2g}')
+
+
+def main(seasons: int = 10):
+    bench_outcomes()
+    bench_poisson(seasons)
+    df = make_matches(seasons)
+    print(f'{len(df)} matches ({seasons} seasons)')
+    fits = {}
+    for name, model in [('dicts (previous)', DixonColesDicts),
+                        ('SLSQP (previous)', DixonColesSLSQP),
+                        ('gradient', models.DixonColes)]:
+        np.random.seed(0)
+        start = time.perf_counter()
+        fits[name] = model(df.copy())
+        seconds = time.perf_counter() - start
+        print(f'fit DixonColes {name:18} {seconds:8.3f} s')
+    current = fits.pop('gradient')
+    for name, previous in fits.items():
+        difference = max(
+            np.abs(np.subtract(previous.predict(home, guest),
+                               current.predict(home, guest))).max()
+            for home in current.teams for guest in current.teams)
+        print(f'max difference of predictions to {name:18} {difference:.2g}')
+
+    last = (df.season == df.season.max()) & (df.matchday == df.matchday.max())
+    np.random.seed(0)
+    model = models.DixonColes(df[~last].reset_index(drop=True))
+    start = time.perf_counter()
+    model.update(df[last])
+    seconds = time.perf_counter() - start
+    print(f'update DixonColes last matchday {seconds:8.3f} s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
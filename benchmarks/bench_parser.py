@@ -0,0 +1,106 @@
+"""
+Microbenchmark of the openligadb match parser. Compares parse_league() to
+the previous implementation (one dictionary per match, column-wise
+conversion) on synthetic leagues and reports parsed rows per second.
+
+Usage: python benchmarks/bench_parser.py [seasons]
+"""
+import json
+import sys
+import timeit
+import pandas as pd
+from teamproject import crawler
+from teamproject.standin import make_league
+
+
+def parse_match(match: dict) -> dict:
+    """Parses a single match into internal format (previous implementation,
+    one dictionary per match).
+
+    Args:
+        match (dict): A single match in the format of openligadb.
+
+    Returns:
+        A dictionary representing details of a single match in internal format.
+    """
+    score = list(filter(lambda d: d['resultName'] == 'Endergebnis',
+                        match['matchResults']))
+    if match['location']:
+        loc = {'ID': match['location']['locationID'],
+               'city': match['location']['locationCity'],
+               'stadium': match['location']['locationStadium']}
+    else:
+        loc = {'ID': None, 'city': None, 'stadium': None}
+    return {
+        'season': match['leagueSeason'],
+        'division': match['leagueShortcut'],
+        'datetime': match['matchDateTime'],
+        'datetimeUTC': match['matchDateTimeUTC'],
+        'matchday': match['group']['groupOrderID'],
+        'homeTeamID': match['team1']['teamId'],
+        'homeTeamName': match['team1']['teamName'],
+        'homeTeamIcon': match['team1']['teamIconUrl'],
+        'guestTeamID': match['team2']['teamId'],
+        'guestTeamName': match['team2']['teamName'],
+        'guestTeamIcon': match['team2']['teamIconUrl'],
+        'finished': match['matchIsFinished'],
+        'homeScore': score[0]['pointsTeam1'] if score else None,
+        'guestScore': score[0]['pointsTeam2'] if score else None,
+        'locID': loc['ID'],
+        'locCity': loc['city'],
+        'locStadium': loc['stadium']
+    }
+
+
+def parse_league_dicts(data: list) -> pd.DataFrame:
+    """Previous implementation of crawler.parse_league().
+
+    Args:
+        data (list): Detailed match data from openligadb.
+
+    Returns:
+        A pd.DataFrame containing match data in internal format.
+    """
+    matches = pd.DataFrame(map(parse_match, data))
+    cols = ['homeScore', 'guestScore', 'locID']
+    matches[cols] = matches[cols].astype('Int64')
+    cols = ['datetime', 'datetimeUTC']
+    matches[cols] = matches[cols].apply(pd.to_datetime)
+    return matches
+
+
+def rows_per_second(func, data: list, repeat: int = 5) -> float:
+    """Measures the throughput of a parser.
+
+    Args:
+        func: The parser.
+        data (list): Detailed match data from openligadb.
+        repeat (int): Number of measurements (the best one is reported).
+
+    Returns:
+        Parsed rows per second.
+    """
+    seconds = min(timeit.repeat(lambda: func(data), number=1, repeat=repeat))
+    return len(data) / seconds
+
+
+def main(seasons: int = 17):
+    data = [match for season in range(2005, 2005 + seasons)
+            for division in crawler.g_divisions
+            for match in make_league(division, season)]
+    pd.testing.assert_frame_equal(parse_league_dicts(data),
+                                  crawler.parse_league(data))
+    print(f'{len(data)} matches ({seasons} seasons, '
+          f'{len(crawler.g_divisions)} divisions)')
+    for name, func in [('dicts (previous)', parse_league_dicts),
+                       ('columns', crawler.parse_league)]:
+        print(f'parse {name:18} {rows_per_second(func, data):12,.0f} rows/s')
+    body = json.dumps(data).encode()
+    for name, loads in [('json', json.loads),
+                        (crawler.json_loads.__module__, crawler.json_loads)]:
+        print(f'decode {name:17} '
+              f'{rows_per_second(lambda _: loads(body), data):12,.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
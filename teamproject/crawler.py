@@ -3,21 +3,126 @@ This module contains code to fetch required data from the internet and convert
 it to our internal format.
 """
 import aiohttp
+import argparse
 import asyncio
+import atexit
+import gzip
+import hashlib
+import json
+import logging
+import numpy as np
 import os.path
 import pandas as pd
+import shutil
+import sqlite3
+import sys
+import threading
+import time
 from ast import literal_eval
+from collections import OrderedDict
+from contextlib import closing, contextmanager
 from datetime import datetime
 from itertools import groupby
+from teamproject.metrics import Registry
+try:
+    # optional, considerably faster for large responses
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+try:
+    from fcntl import flock, LOCK_EX, LOCK_UN
+except ImportError:
+    # not available on Windows, cache_lock() only locks within the process
+    flock = None
 
 
+g_api_url = 'https://api.openligadb.de'
 g_divisions = ['bl1', 'bl2', 'bl3']
 g_season_lower_limit = 2005
+g_avail_seasons_ttl = 24  # hours until available seasons are fetched again
+g_max_in_flight = 8  # concurrent requests (and pooled connections)
+g_rate_limit = 20  # requests per second
+g_request_timeout = 10  # seconds
+g_max_retries = 3
+g_retry_backoff = 0.5  # seconds, doubled with every retry
+g_client = None
+g_metrics = Registry()  # sink of crawler metrics (see teamproject.metrics)
+g_recording = None  # Recording used by query() (None: no record/replay)
+g_archive = False  # keep raw match data responses (see archive_response())
+g_logger = logging.getLogger(__name__)
+g_cache_lock = threading.RLock()
+g_cache_lock_file = None  # locked file while g_cache_lock is held
 g_cache_path = f'{os.path.dirname(os.path.abspath(__file__))}/cache'
+g_frame_cache_bytes = 256 * 2**20  # memory limit of get_data() results
+g_icon_retry = 24  # hours until icons that could not be fetched are retried
+g_icon_prefetch = None  # future of the last icon prefetch (see get_teams())
+g_index_columns = ['leagueId', 'availMatchdays', 'cached', 'cachedMatchdays',
+                   'cachedDatetime']
+# compact dtypes of match data in the cache (see to_facts())
+g_fact_dtypes = {'season': 'int16', 'division': 'category', 'matchday': 'int8',
+                 'homeTeamID': 'int32', 'guestTeamID': 'int32',
+                 'homeScore': 'Int8', 'guestScore': 'Int8', 'locID': 'Int32'}
+g_index_version = 1  # increment when changing g_index_schema
+g_index_schema = '''
+CREATE TABLE IF NOT EXISTS leagues (
+    season INTEGER NOT NULL,
+    division TEXT NOT NULL,
+    leagueId INTEGER,
+    availMatchdays INTEGER,
+    cached INTEGER NOT NULL DEFAULT 0,
+    cachedMatchdays INTEGER NOT NULL DEFAULT 0,
+    cachedDatetime TEXT,
+    PRIMARY KEY (season, division)
+);
+CREATE INDEX IF NOT EXISTS leagues_division ON leagues (division, season);
+CREATE TABLE IF NOT EXISTS matchdays (
+    season INTEGER NOT NULL,
+    division TEXT NOT NULL,
+    matchday INTEGER NOT NULL,
+    lastChange TEXT,
+    PRIMARY KEY (season, division, matchday)
+);
+CREATE TABLE IF NOT EXISTS teams (
+    teamId INTEGER PRIMARY KEY,
+    code INTEGER NOT NULL UNIQUE,
+    season INTEGER NOT NULL,
+    name TEXT,
+    icon TEXT
+);
+CREATE TABLE IF NOT EXISTS locations (
+    locId INTEGER PRIMARY KEY,
+    season INTEGER NOT NULL,
+    city TEXT,
+    stadium TEXT
+);
+CREATE TABLE IF NOT EXISTS icons (
+    teamId INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    hash TEXT,
+    ext TEXT,
+    failedDatetime TEXT,
+    PRIMARY KEY (teamId, url)
+);
+CREATE TABLE IF NOT EXISTS archive (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    season INTEGER NOT NULL,
+    division TEXT NOT NULL,
+    matchday INTEGER,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    fetchedDatetime TEXT
+);
+CREATE INDEX IF NOT EXISTS archive_season ON archive (season, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
 
 
 def get_data(fromSeason: int, fromMatchday: int, toSeason: int,
-             toMatchday: int, forceUpdate: bool = False) -> pd.DataFrame:
+             toMatchday: int, forceUpdate: bool = False, wide: bool = True,
+             divisions: list = None) -> pd.DataFrame:
     """Returns match data within a given interval.
 
     Args:
@@ -27,136 +132,691 @@ def get_data(fromSeason: int, fromMatchday: int, toSeason: int,
         toMatchday (int): Day of upper interval limit.
         forceUpdate (bool): Force re-caching of seasons in interval. Defaults
                             to False.
+        wide (bool): Return match data in internal format including team
+                     and location details. Otherwise, the compact fact table
+                     is returned (see to_facts()) with additional dense team
+                     codes ('homeTeamCode', 'guestTeamCode', see
+                     load_teams()). Defaults to True.
+        divisions (list): Only return (and fetch) matches of these divisions,
+                          e.g. ['bl1']. Defaults to None (all divisions).
+
+    Returns:
+        Match data as pd.DataFrame (can be empty)
+    """
+    return asyncio.run(get_data_async(fromSeason, fromMatchday, toSeason,
+                                      toMatchday, forceUpdate, wide,
+                                      divisions))
+
+
+async def get_data_async(fromSeason: int, fromMatchday: int, toSeason: int,
+                         toMatchday: int, forceUpdate: bool = False,
+                         wide: bool = True, divisions: list = None
+                         ) -> pd.DataFrame:
+    """Awaitable version of get_data().
+
+    Args:
+        fromSeason (int): Season of lower interval limit.
+        fromMatchday (int): Day of lower interval limit.
+        toSeason (int): Season of upper interval limit.
+        toMatchday (int): Day of upper interval limit.
+        forceUpdate (bool): Force re-caching of seasons in interval. Defaults
+                            to False.
+        wide (bool): Return match data in internal format (see get_data()).
+                     Defaults to True.
+        divisions (list): Only return (and fetch) matches of these divisions.
+                          Defaults to None (all divisions).
 
     Returns:
         Match data as pd.DataFrame (can be empty)
     """
     fetchIfEmpty = True
-    avail = load_cache_index(fetchIfEmpty)
-    # filter out unavailable and cached seasons
-    seasons = avail[avail['season'].isin(range(fromSeason, toSeason+1))].copy()
-    seasonList = seasons['season'].unique().tolist()
+    await load_cache_index_async(fetchIfEmpty)
+    # filter out unavailable and cached leagues
+    leagues = load_leagues()
+    leagues = leagues[leagues['season'].between(fromSeason, toSeason)]
+    if divisions is not None:
+        leagues = leagues[leagues['division'].isin(divisions)]
+    seasonList = leagues['season'].unique().tolist()
     if not forceUpdate:
-        seasons = seasons[~seasons['cached']]
+        leagues = leagues[~leagues['cached']]
     # fetch data if necessary
-    seasons['action'] = 'getmatchdata'
-    leagues = seasons.explode('division')[['action', 'division', 'season']]
-    responses = asyncio.run(fetch_queries(leagues.to_dict('records')))
-    for key, val in groupby(responses, key=lambda d: d['params']['season']):
-        frames = map(lambda d: parse_league(d['response']), val)
-        store_matchdata(str(key), pd.concat(frames))
-    # assemble interval from cache
-    if seasonList:
-        frames = [load_matchdata(str(season)) for season in seasonList]
+    await update_leagues(leagues, forceUpdate)
+    if not seasonList:
+        return pd.DataFrame()
+    # results are reused until the cache index of a season changes
+    versions = load_leagues()
+    versions = versions[versions['season'].isin(seasonList)]
+    key = (fromSeason, fromMatchday, toSeason, toMatchday, g_cache_path,
+           None if divisions is None else tuple(sorted(divisions)),
+           tuple(versions[['season', 'division', 'cachedDatetime']]
+                 .itertuples(index=False, name=None)))
+    data = g_frame_cache.get(key)
+    g_metrics.inc('crawler_frame_cache_total',
+                  result='miss' if data is None else 'hit')
+    if data is None:
+        # only matching rows of the interval are read from cache
+        frames = [load_facts(str(season), divisions,
+                             fromMatchday if season == fromSeason else None,
+                             toMatchday if season == toSeason else None)
+                  for season in seasonList]
         data = pd.concat(frames, ignore_index=True)
-        lt = (data['season'] == fromSeason) & (data['matchday'] < fromMatchday)
-        gt = (data['season'] == toSeason) & (data['matchday'] > toMatchday)
-        data.drop(data[lt | gt].index, axis=0, inplace=True)
-        data.reset_index(drop=True, inplace=True)
-    else:
-        data = pd.DataFrame()
+        data['division'] = data['division'].astype('category')
+        g_frame_cache.put(key, data)
+    if wide:
+        return to_wide(data)
+    codes = load_teams()['code']
+    for side in ['home', 'guest']:
+        data[f'{side}TeamCode'] = codes.reindex(data[f'{side}TeamID']) \
+            .to_numpy('int16')
     return data
 
 
-def get_teams(data: pd.DataFrame) -> pd.DataFrame:
-    """Computes all teams from given match data.
+def iter_matches(fromSeason: int, fromMatchday: int, toSeason: int,
+                 toMatchday: int, chunk: str = 'matchday', wide: bool = True,
+                 divisions: list = None):
+    """Yields match data within a given interval in chronological chunks, so
+    that long intervals can be processed without holding all matches in
+    memory. Each season is fetched when it is reached (if not cached) and
+    only its rows within the interval are read from cache, as fact table.
+    Must not be used from a running event loop (use get_data_async()
+    instead).
+
+    Args:
+        fromSeason (int): Season of lower interval limit.
+        fromMatchday (int): Day of lower interval limit.
+        toSeason (int): Season of upper interval limit.
+        toMatchday (int): Day of upper interval limit.
+        chunk (str): Either 'matchday' (the matches of a calendar week, i.e.
+                     usually one matchday of each division) or 'season'.
+                     Defaults to 'matchday'.
+        wide (bool): Yield match data in internal format. Otherwise, fact
+                     tables are yielded (see get_data()). Defaults to True.
+        divisions (list): Only yield (and fetch) matches of these divisions.
+                          Defaults to None (all divisions).
+
+    Yields:
+        pd.DataFrames of match data (without empty chunks), sorted by kickoff
+        within and across chunks. Midweek rounds and postponed matches are
+        yielded in the week they take place, matches without kickoff at the
+        end of their season.
+
+    Raises:
+        ValueError: If chunk is neither 'matchday' nor 'season'.
+    """
+    if chunk not in ['matchday', 'season']:
+        raise ValueError(f'Unknown chunk: {chunk}')
+    asyncio.run(load_cache_index_async(fetchIfEmpty=True))
+    leagues = load_leagues()
+    leagues = leagues[leagues['season'].between(fromSeason, toSeason)]
+    if divisions is not None:
+        leagues = leagues[leagues['division'].isin(divisions)]
+    for season in leagues['season'].unique().tolist():
+        uncached = leagues[(leagues['season'] == season) & ~leagues['cached']]
+        if not uncached.empty:
+            asyncio.run(update_leagues(uncached))
+        first = fromMatchday if season == fromSeason else 1
+        last = toMatchday if season == toSeason else None
+        data = load_facts(str(season), divisions, first, last)
+        if data.empty:
+            continue
+        data = data.sort_values('datetimeUTC', kind='stable',
+                                ignore_index=True)
+        if chunk == 'season':
+            chunks = [data]
+        else:
+            # matchdays of different divisions (and postponed matches) do not
+            # take place at the same time, so the chunks are calendar weeks
+            monday = pd.Timestamp('1970-01-05', tz='UTC')
+            weeks = (data['datetimeUTC'] - monday) // pd.Timedelta(days=7)
+            chunks = [group for _, group in
+                      data.groupby(weeks, sort=True, dropna=False)]
+        for group in chunks:
+            group = group.reset_index(drop=True)
+            yield to_wide(group) if wide else group
+
+
+def get_teams(data: pd.DataFrame, callback=None) -> pd.DataFrame:
+    """Computes all teams from given match data. Icons of the teams which
+    are not cached yet are fetched in the background (see load_teamicon()).
 
     Args:
-        data (pd.DataFrame): Match data of any time interval.
+        data (pd.DataFrame): Match data of any time interval (in internal
+                             format or as fact table).
+        callback: Function without arguments called when the icons have been
+                  fetched, e.g. to display them. It is called in the thread
+                  of the shared client. Defaults to None.
 
     Returns:
-        A pd.DataFrame representing teams including team details.
+        A pd.DataFrame representing teams including team details (as cached
+        in the teams table, see load_teams()).
     """
-    homeTeams = data[['homeTeamID', 'homeTeamName', 'homeTeamIcon']]
-    guestTeams = data[['guestTeamID', 'guestTeamName', 'guestTeamIcon']]
-    cols = ['ID', 'name', 'icon']
-    homeTeams.set_axis(cols, axis=1, inplace=True)
-    guestTeams.set_axis(cols, axis=1, inplace=True)
-    teams = pd.concat([homeTeams, guestTeams], ignore_index=True)
+    teamIds = np.unique(np.concatenate([data['homeTeamID'].to_numpy(),
+                                        data['guestTeamID'].to_numpy()]))
+    teams = load_teams()
+    teams = teams.loc[teams.index.intersection(teamIds), ['name', 'icon']]
+    teams = teams.rename_axis('ID').reset_index()
     teams.drop_duplicates(subset=['name'], inplace=True)
     teams = teams.sort_values('name').reset_index()
+    global g_icon_prefetch
+    g_icon_prefetch = asyncio.run_coroutine_threadsafe(
+        prefetch_teamicons_async(teams), get_client().loop)
+    if callback is not None:
+        g_icon_prefetch.add_done_callback(lambda future: callback())
     return teams
 
 
+def load_teamicon(teamId: int, url: str) -> str:
+    """Looks up the cached icon of a team. Never fetches the icon and never
+    waits for a running prefetch (see get_teams()).
+
+    Args:
+        teamId (int): ID of the team.
+        url (str): URL of the team icon.
+
+    Returns:
+        The path of the icon file or None if the icon is not available (yet).
+    """
+    icon = load_icon_entry(teamId, url)
+    if icon is None or icon[0] is None:
+        return None
+    path = f'{g_cache_path}/icons/{icon[0]}{icon[1]}'
+    return path if os.path.exists(path) else None
+
+
+def prefetch_teamicons(teams: pd.DataFrame):
+    """Fetches and caches the icons of given teams. See
+    prefetch_teamicons_async().
+
+    Args:
+        teams (pd.DataFrame): Teams as returned by get_teams().
+    """
+    asyncio.run(prefetch_teamicons_async(teams))
+
+
+async def prefetch_teamicons_async(teams: pd.DataFrame):
+    """Fetches and caches the icons of given teams concurrently. Icons are
+    stored once per content (named after their SHA-1 hash) and looked up by
+    team ID and URL. Icons that are cached are skipped, as are icons that
+    could not be fetched within the last g_icon_retry hours. The cache index
+    and files are accessed in the default executor, so the event loop keeps
+    serving other requests.
+
+    Args:
+        teams (pd.DataFrame): Teams as returned by get_teams().
+    """
+    loop = asyncio.get_running_loop()
+    missing = await loop.run_in_executor(None, missing_teamicons, teams)
+    responses = await get_client().fetch_async(list(missing), download)
+    await loop.run_in_executor(None, store_teamicons, missing, responses)
+
+
+def missing_teamicons(teams: pd.DataFrame) -> dict:
+    """Looks up the icons of given teams which need to be fetched.
+
+    Args:
+        teams (pd.DataFrame): Teams as returned by get_teams().
+
+    Returns:
+        A dictionary mapping icon URLs to the IDs of the teams using them.
+    """
+    with closing(connect_cache_index()) as conn:
+        known = {(teamId, url): (digest, failed)
+                 for teamId, url, digest, failed
+                 in conn.execute('SELECT teamId, url, hash, failedDatetime '
+                                 'FROM icons')}
+    now = datetime.now()
+    missing = {}
+    for team in teams[['ID', 'icon']].drop_duplicates().itertuples():
+        if pd.isna(team.icon):
+            continue
+        digest, failed = known.get((int(team.ID), team.icon), (None, None))
+        if digest is not None or failed is not None and \
+                (now - datetime.fromisoformat(failed)).total_seconds() \
+                < 3600 * g_icon_retry:
+            continue
+        missing.setdefault(team.icon, []).append(int(team.ID))
+    return missing
+
+
+def store_teamicons(missing: dict, responses: list):
+    """Stores fetched icons and records icons that could not be fetched.
+
+    Args:
+        missing (dict): Icon URLs and team IDs as by missing_teamicons().
+        responses (list): Responses of downloading the icons.
+    """
+    now = datetime.now()
+    os.makedirs(f'{g_cache_path}/icons', exist_ok=True)
+    rows = []
+    for res in responses:
+        url = res['params']
+        if res['error']:
+            rows += [(teamId, url, None, None, now.isoformat())
+                     for teamId in missing[url]]
+            continue
+        digest = hashlib.sha1(res['response']).hexdigest()
+        ext = os.path.splitext(url.split('?')[0])[1][:5]
+        path = f'{g_cache_path}/icons/{digest}{ext}'
+        if not os.path.exists(path):
+            replace_file(path, res['response'])
+        rows += [(teamId, url, digest, ext, None) for teamId in missing[url]]
+    with closing(connect_cache_index()) as conn, conn:
+        conn.executemany('INSERT INTO icons VALUES (?, ?, ?, ?, ?) '
+                         'ON CONFLICT (teamId, url) DO UPDATE SET '
+                         'hash = excluded.hash, ext = excluded.ext, '
+                         'failedDatetime = excluded.failedDatetime', rows)
+
+
+async def update_leagues(leagues: pd.DataFrame, forceUpdate: bool = False):
+    """Fetches match data of given leagues and merges it into the cache.
+    Leagues which are cached partially are updated matchday by matchday,
+    starting after the last completely cached matchday and ending at the
+    current matchday. All other leagues are fetched as a whole (while the
+    current matchdays are resolved).
+
+    Args:
+        leagues (pd.DataFrame): Leagues as returned by load_leagues().
+        forceUpdate (bool): Fetch given leagues as a whole. Defaults to False.
+    """
+    # the current season is the only one that might still change
+    currentSeason = load_leagues()['season'].max()
+    current = leagues['season'] == currentSeason
+    delta = leagues['availMatchdays'].notna() | current
+    delta &= leagues['cachedMatchdays'].gt(0)
+    delta &= not forceUpdate
+    full = asyncio.ensure_future(fetch_queries([
+        {'action': 'getmatchdata', 'division': league.division,
+         'season': league.season}
+        for league in leagues[~delta].itertuples()]))
+    queries = []
+    partial = leagues[delta]
+    if not partial.empty:
+        currentGroup = await fetch_current_groups(
+            partial.loc[current[delta], 'division'])
+        for league in partial.itertuples():
+            last = league.availMatchdays
+            if league.season == currentSeason:
+                group = currentGroup.get(league.division, last)
+                last = group if pd.isna(last) else min(last, group)
+            if pd.isna(last):
+                continue
+            queries += [{'action': 'getmatchdata', 'division': league.division,
+                         'season': league.season, 'matchday': matchday}
+                        for matchday in range(league.cachedMatchdays + 1,
+                                              last + 1)]
+    responses = await full + await fetch_queries(queries)
+    key = lambda d: d['params']['season']  # noqa: E731
+    for season, val in groupby(sorted(responses, key=key), key=key):
+        frames = [parse_league(d['response']) for d in val if d['response']]
+        if not frames:
+            continue
+        data = pd.concat(frames, ignore_index=True)
+        with cache_lock():
+            if os.path.exists(f'{g_cache_path}/matchdata_{season}'):
+                data = merge_matchdata(load_matchdata(str(season)), data)
+            store_matchdata(str(season), data)
+
+
+def merge_matchdata(stored: pd.DataFrame, fetched: pd.DataFrame) -> pd.DataFrame:
+    """Merges freshly fetched match data into cached match data. Matchdays
+    contained in the fetched data replace the corresponding cached matchdays.
+
+    Args:
+        stored (pd.DataFrame): Cached match data (see load_matchdata()).
+        fetched (pd.DataFrame): Match data as returned by parse_league().
+
+    Returns:
+        A pd.DataFrame containing the merged match data in internal format.
+    """
+    if stored.empty:
+        return fetched
+    keys = ['division', 'matchday']
+    replaced = pd.MultiIndex.from_frame(stored[keys]).isin(
+        pd.MultiIndex.from_frame(fetched[keys]))
+    data = pd.concat([stored[~replaced].assign(finished=True), fetched],
+                     ignore_index=True)
+    data = data.sort_values(keys + ['datetimeUTC'], kind='stable')
+    return data.reset_index(drop=True)
+
+
+def backfill(fromSeason: int = None, toSeason: int = None,
+             divisions: list = None, report=print) -> dict:
+    """Fetches all matchdays missing in the cache. See backfill_async().
+
+    Args:
+        fromSeason (int): First season to fetch. Defaults to None (all).
+        toSeason (int): Last season to fetch. Defaults to None (all).
+        divisions (list): Divisions to fetch. Defaults to None (all).
+        report: Function called with progress messages. Defaults to print.
+
+    Returns:
+        A dictionary of statistics (see backfill_async()).
+    """
+    return asyncio.run(backfill_async(fromSeason, toSeason, divisions,
+                                      report))
+
+
+async def backfill_async(fromSeason: int = None, toSeason: int = None,
+                         divisions: list = None, report=print) -> dict:
+    """Fetches all matchdays missing in the cache (see plan_backfill()) with
+    the concurrency of the shared client. Every fetched matchday is stored as
+    soon as possible (matchdays arriving while storing are stored together),
+    so an interrupted backfill resumes where it stopped. Progress is reported
+    at most once per second.
+
+    Args:
+        fromSeason (int): First season to fetch. Defaults to None (all).
+        toSeason (int): Last season to fetch. Defaults to None (all).
+        divisions (list): Divisions to fetch. Defaults to None (all).
+        report: Function called with progress messages. Defaults to print.
+
+    Returns:
+        A dictionary containing the number of planned, stored and failed
+        matchdays ('units', 'done', 'failed'), the number of requests
+        (including retries), fetched matches and bytes and the duration in
+        seconds.
+    """
+    await fetch_avail_seasons_async()
+    await fetch_avail_matchdays_async()
+    units = await plan_backfill(fromSeason, toSeason, divisions)
+    stats = {'units': len(units), 'done': 0, 'failed': 0, 'requests': 0,
+             'matches': 0, 'bytes': 0, 'seconds': 0}
+    report(f'{len(units)} matchdays to fetch')
+    client = get_client()
+    queue = asyncio.Queue()
+
+    async def fetch_unit(unit):
+        queue.put_nowait((await client.fetch_async([unit]))[0])
+
+    tasks = [asyncio.ensure_future(fetch_unit(unit)) for unit in units]
+    start = lastReport = time.monotonic()
+    processed = 0
+    while processed < len(units):
+        batch = [await queue.get()]
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        processed += len(batch)
+        for res in batch:
+            stats['requests'] += 1 + res['retries']
+            stats['bytes'] += res['bytes']
+            stats['failed'] += res['error'] is not None
+        key = lambda d: d['params']['season']  # noqa: E731
+        batch = sorted([res for res in batch if res['response']], key=key)
+        for season, val in groupby(batch, key=key):
+            data = pd.concat([parse_league(res['response']) for res in val],
+                             ignore_index=True)
+            stats['matches'] += len(data)
+            with cache_lock():
+                if os.path.exists(f'{g_cache_path}/matchdata_{season}'):
+                    data = merge_matchdata(load_matchdata(str(season)), data)
+                store_matchdata(str(season), data)
+        stats['done'] = processed - stats['failed']
+        now = time.monotonic()
+        if now - lastReport >= 1 or processed == len(units):
+            lastReport = now
+            report(progress_message(stats, processed, now - start))
+    await asyncio.gather(*tasks)
+    stats['seconds'] = time.monotonic() - start
+    return stats
+
+
+def progress_message(stats: dict, processed: int, seconds: float) -> str:
+    """Formats the progress of a backfill.
+
+    Args:
+        stats (dict): Statistics of the backfill (see backfill_async()).
+        processed (int): Number of stored or failed matchdays.
+        seconds (float): Seconds since the backfill started.
+
+    Returns:
+        A line containing progress, throughput and estimated time left.
+    """
+    seconds = max(seconds, 1e-9)
+    eta = (stats['units'] - processed) * seconds / processed
+    return (f"{processed}/{stats['units']} matchdays "
+            f"({stats['failed']} failed), "
+            f"{stats['requests'] / seconds:.1f} requests/s, "
+            f"{stats['matches'] / seconds:.0f} matches/s, "
+            f"{stats['bytes'] / 2**20:.1f} MiB, ETA {eta:.0f} s")
+
+
+async def plan_backfill(fromSeason: int = None, toSeason: int = None,
+                        divisions: list = None) -> list:
+    """Lists the matchdays of leagues in the cache index that are not cached
+    yet, up to the current matchday. The current matchday is always listed,
+    since it might have been stored with pending matches.
+
+    Args:
+        fromSeason (int): First season. Defaults to None (all).
+        toSeason (int): Last season. Defaults to None (all).
+        divisions (list): Divisions. Defaults to None (all).
+
+    Returns:
+        A list of getmatchdata queries, one per (division, season, matchday),
+        ordered by season and matchday.
+    """
+    leagues = load_leagues()
+    currentSeason = leagues['season'].max()
+    if fromSeason is not None:
+        leagues = leagues[leagues['season'] >= fromSeason]
+    if toSeason is not None:
+        leagues = leagues[leagues['season'] <= toSeason]
+    if divisions is not None:
+        leagues = leagues[leagues['division'].isin(divisions)]
+    leagues = leagues[~leagues['cached'] & leagues['availMatchdays'].notna()]
+    currentGroup = await fetch_current_groups(
+        leagues.loc[leagues['season'] == currentSeason, 'division'])
+    units = []
+    for season, group in leagues.groupby('season'):
+        stored = set()
+        if os.path.exists(f'{g_cache_path}/matchdata_{season}'):
+            facts = load_facts(str(season))
+            stored = set(zip(facts['division'].astype(str),
+                             facts['matchday'].astype(int)))
+        for league in group.itertuples():
+            last, current = int(league.availMatchdays), None
+            if season == currentSeason:
+                current = currentGroup.get(league.division, last)
+                last = min(last, current)
+            units += [{'action': 'getmatchdata', 'division': league.division,
+                       'season': int(season), 'matchday': day}
+                      for day in range(1, last + 1)
+                      if (league.division, day) not in stored
+                      or day == current]
+    return sorted(units, key=lambda u: (u['season'], u['matchday']))
+
+
 def refresh_ui_cache():
     """Collects and executes all functions refreshing cached data (which will
-    be displayed in the GUI). Using threading and calling the functions
-    separately accelerates startup time of the GUI.
+    be displayed in the GUI). See refresh_ui_cache_async().
+    """
+    asyncio.run(refresh_ui_cache_async())
+
+
+async def refresh_ui_cache_async():
+    """Refreshes all cached data displayed in the GUI. Available matchdays and
+    next matches are fetched concurrently once the available seasons are
+    known, which accelerates startup time of the GUI. Data that has not
+    changed on openligadb since the last start is not fetched again.
+    """
+    await fetch_avail_seasons_async()
+    await asyncio.gather(fetch_avail_matchdays_async(),
+                         fetch_next_matches_async())
+
+
+def fetch_avail_seasons(forceUpdate: bool = False):
+    """Fetches and caches all seasons available on openligadb. See
+    fetch_avail_seasons_async().
+
+    Args:
+        forceUpdate (bool): Fetch seasons in any case. Defaults to False.
     """
-    fetch_avail_seasons()
-    fetch_avail_matchdays()
-    fetch_next_matches()
+    asyncio.run(fetch_avail_seasons_async(forceUpdate))
 
 
-def fetch_avail_seasons():
-    """Fetches and caches all seasons available on openligadb.
+async def fetch_avail_seasons_async(forceUpdate: bool = False):
+    """Fetches and caches all seasons available on openligadb. Skipped if
+    seasons have been fetched within the last g_avail_seasons_ttl hours.
+
+    Args:
+        forceUpdate (bool): Fetch seasons in any case. Defaults to False.
+
+    Raises:
+        ConnectionError: If the seasons could not be fetched.
     """
-    responses = asyncio.run(fetch_queries([{'action': 'getavailableleagues'}]))
+    fetched = load_meta('availSeasonsFetched')
+    if not forceUpdate and fetched is not None and not load_leagues().empty:
+        age = datetime.now() - datetime.fromisoformat(fetched)
+        if age.total_seconds() < 3600 * g_avail_seasons_ttl:
+            return  # exit
+    responses = await fetch_queries([{'action': 'getavailableleagues'}])
+    if responses[0]['error']:
+        raise ConnectionError(f"Fetching seasons failed: {responses[0]['error']}")
     leagues = [{'IDs': resp['leagueId'], 'season': int(resp['leagueSeason']),
                 'division': resp['leagueShortcut']}
                for resp in responses[0]['response']
                if (resp['leagueShortcut'] in g_divisions)]
     leagues = filter(lambda l: l['season'] >= g_season_lower_limit, leagues)
     avail = pd.DataFrame(leagues).sort_values(['season', 'division'])
-    avail = avail.groupby('season').agg(list).reset_index()
-    cols = ['availMatchdays', 'cached', 'cachedMatchdays', 'cachedDatetime']
-    avail[cols] = [None, False, 0, None]
-    cache = load_cache_index()
-    if not cache.empty:
-        avail = pd.concat([avail[~avail.season.isin(cache.season)], cache])
+    # only league IDs are updated, cache state of known leagues is kept
     store_cache_index(avail)
+    store_meta('availSeasonsFetched', datetime.now().isoformat())
+
+
+def fetch_avail_matchdays(forceUpdate: bool = False):
+    """Fetches and caches number of available match days for each league.
+    See fetch_avail_matchdays_async().
+
+    Args:
+        forceUpdate (bool): Fetch matchdays of all leagues. Defaults to False.
+    """
+    asyncio.run(fetch_avail_matchdays_async(forceUpdate))
+
 
+async def fetch_avail_matchdays_async(forceUpdate: bool = False):
+    """Fetches and caches number of available match days for each league.
+    The matchdays of a league do not change, so only leagues with an unknown
+    number of matchdays are fetched.
 
-def fetch_avail_matchdays():
-    """Fetches and caches number of available match days for each season.
+    Args:
+        forceUpdate (bool): Fetch matchdays of all leagues. Defaults to False.
     """
     fetchIfEmpty = True
-    avail = load_cache_index(fetchIfEmpty)
-    leagues = avail.explode('division')
+    await load_cache_index_async(fetchIfEmpty)
+    leagues = load_leagues()
+    if not forceUpdate:
+        leagues = leagues[leagues['availMatchdays'].isna()]
     leagues = leagues[['division', 'season']]
     leagues.insert(0, 'action', 'getavailablegroups')
     queries = leagues.to_dict('records')
-    responses = asyncio.run(fetch_queries(queries))
-    # print(responses)
+    responses = await fetch_queries(queries)
     matchdays = [{
         'season': res['params']['season'],
+        'division': res['params']['division'],
         'availMatchdays':
         max(res['response'], key=lambda x: x['groupOrderID'])['groupOrderID']}
-        for res in responses]
-    data = pd.DataFrame(matchdays).groupby('season').agg(max)
-    data['availMatchdays'] = data['availMatchdays'].astype('Int64')
-    avail.set_index('season', inplace=True)
-    avail.update(data)
-    avail.reset_index(inplace=True)
-    store_cache_index(avail)
+        for res in responses if res['response']]
+    if matchdays:
+        store_cache_index(pd.DataFrame(matchdays))
 
 
 def fetch_next_matches():
+    """Fetches and caches next match(es) which have not taken place yet. See
+    fetch_next_matches_async().
+    """
+    asyncio.run(fetch_next_matches_async())
+
+
+async def fetch_next_matches_async():
     """Fetches and caches next match(es) which have not taken place yet.
-    If there are simultaneous matches, multiple matches will be cached.
+    If there are simultaneous matches, multiple matches will be cached. The
+    current matchday of a division is only fetched if it has changed on
+    openligadb (or if no upcoming match of the division is cached).
     """
     fetchIfEmpty = True
-    avail = load_cache_index(fetchIfEmpty)
-    current = avail.explode('division')
-    current = current[['division', 'season']]
-    currentSeason = current['season'].max()
-    current = current[current['season'] == currentSeason]
-    current.insert(0, 'action', 'getmatchdata')
-    queries = current.to_dict('records')
-    responses = asyncio.run(fetch_queries(queries))
-    data = pd.concat(map(lambda d: parse_league(d['response']), responses))
-    store_matchdata(str(currentSeason), data.copy())
+    avail = await load_cache_index_async(fetchIfEmpty)
+    currentSeason = int(avail['season'].max())
+    divisions = avail.loc[avail['season'] == currentSeason, 'division'].iloc[0]
+    currentGroup = await fetch_current_groups(divisions)
+    # divisions whose current matchday is unknown keep their cached matches
+    divisions = list(currentGroup)
+    responses = await fetch_queries([
+        {'action': 'getlastchangedate', 'division': division,
+         'season': currentSeason, 'matchday': currentGroup[division]}
+        for division in divisions])
+    lastChange = {res['params']['division']: res['response']
+                  for res in responses if not res['error']}
+    knownChange = load_last_changes(currentSeason)
     utcnow = pd.Timestamp.utcnow()
+    cached = None
+    if os.path.exists(f'{g_cache_path}/matchdata_next'):
+        cached = load_matchdata('next').drop('index', axis=1)
+        cached = cached[cached['datetimeUTC'] + pd.offsets.Minute(90) >= utcnow]
+    changed = [division for division in divisions
+               if cached is None
+               or division not in cached['division'].values
+               or division not in lastChange
+               or knownChange.get((division, currentGroup[division]))
+               != lastChange[division]]
+    # upcoming matches are part of the current or the following matchday
+    queries = [{'action': 'getmatchdata', 'division': division,
+                'season': currentSeason, 'matchday': matchday}
+               for division in changed
+               for matchday in (currentGroup[division],
+                                currentGroup[division] + 1)]
+    responses = await fetch_queries(queries)
+    frames = [parse_league(res['response'])
+              for res in responses if res['response']]
+    if cached is not None:
+        frames.append(cached[~cached['division'].isin(changed)])
+    if not frames:
+        return  # exit
+    data = pd.concat(frames, ignore_index=True)
     data = data[data['datetimeUTC'] + pd.offsets.Minute(90) >= utcnow]
     minMatchDays = data.groupby('division')['matchday'].transform('min')
     data = data[data['matchday'] == minMatchDays]
     data = data.sort_values(['datetimeUTC', 'division']).reset_index()
     data['finished'] = True
     store_matchdata('next', data)
+    failed = {res['params']['division'] for res in responses if res['error']}
+    for division in set(changed).intersection(lastChange).difference(failed):
+        store_last_change(currentSeason, division, currentGroup[division],
+                          lastChange[division])
+
+
+async def fetch_current_groups(divisions: list) -> dict:
+    """Fetches the current matchday of given divisions.
+
+    Args:
+        divisions (list): Division shortcuts, e.g. ['bl1', 'bl2'].
+
+    Returns:
+        A dictionary mapping each division to its current matchday (divisions
+        whose query failed are missing).
+    """
+    responses = await fetch_queries([
+        {'action': 'getcurrentgroup', 'division': division}
+        for division in divisions])
+    return {res['params']['division']: res['response']['groupOrderID']
+            for res in responses if not res['error']}
+
+
+def fetch(queries: list) -> list:
+    """Sends queries using the shared client and waits for the responses.
+    See Client.gather().
+
+    Args:
+        queries (list): List of queries.
+
+    Returns:
+        A List of responses.
+    """
+    return get_client().fetch(queries)
 
 
 async def fetch_queries(queries: list) -> list:
-    """Gathers multiple queries and sends requests asynchronously. See query().
+    """Gathers multiple queries and sends requests asynchronously using the
+    shared client. Can be awaited from any event loop. See Client.gather().
 
     Args:
         queries (list): List of queries.
@@ -164,12 +824,11 @@ async def fetch_queries(queries: list) -> list:
     Returns:
         A List of responses.
     """
-    async with aiohttp.ClientSession() as session:
-        tasks = map(
-            lambda params: asyncio.ensure_future(query(session, params)),
-            queries)
-        responses = await asyncio.gather(*tasks)
-        return responses
+    start = time.perf_counter()
+    responses = await get_client().fetch_async(queries)
+    g_metrics.observe('crawler_fetch_seconds', time.perf_counter() - start)
+    g_metrics.inc('crawler_fetch_queries_total', len(queries))
+    return responses
 
 
 async def query(session: aiohttp.client.ClientSession, params: dict) -> dict:
@@ -181,19 +840,511 @@ async def query(session: aiohttp.client.ClientSession, params: dict) -> dict:
                        order required.
 
     Returns:
-        A dictionary containing the request parameters and the corresponding
-        response.
+        A dictionary containing the request parameters, the corresponding
+        response, its HTTP status and its size in bytes.
+
+    Raises:
+        ClientResponseError: If the response has an error status (or, when
+                             replaying, the query has not been recorded).
     """
     paramStr = '/'.join(map(str, params.values()))
-    url = f'https://api.openligadb.de/{paramStr}'
+    if g_recording is not None and g_recording.mode == 'replay':
+        body = g_recording.load(paramStr)
+        if body is None:
+            raise aiohttp.ClientResponseError(
+                None, (), status=404, message=f'Not recorded: {paramStr}')
+        return {'params': params, 'response': json_loads(body),
+                'status': 200, 'bytes': len(body)}
+    url = f'{g_api_url}/{paramStr}'
     async with session.get(url) as resp:
-        # print(f'Fetching {url}')
-        response = await resp.json()
-        return {'params': params, 'response': response}
+        resp.raise_for_status()
+        body = await resp.read()
+        if g_recording is not None:
+            g_recording.save(paramStr, body)
+        if g_archive and params.get('action') == 'getmatchdata':
+            # in a thread, the cache lock may be held by another process
+            await asyncio.get_running_loop().run_in_executor(
+                None, archive_response, params, body)
+        return {'params': params, 'response': json_loads(body),
+                'status': resp.status, 'bytes': len(body)}
+
+
+async def download(session: aiohttp.client.ClientSession, url: str) -> dict:
+    """Downloads a file (e.g. a team icon) without parsing it.
+
+    Args:
+        session: aiohttp client session for asynchronous requests.
+        url (str): URL of the file.
+
+    Returns:
+        A dictionary containing the URL, the raw content, its HTTP status and
+        its size in bytes.
+    """
+    async with session.get(url, headers={'User-agent': 'Mozilla/5.0'}) as resp:
+        resp.raise_for_status()
+        body = await resp.read()
+        return {'params': url, 'response': body, 'status': resp.status,
+                'bytes': len(body)}
+
+
+def archive_response(params: dict, body: bytes):
+    """Appends a raw getmatchdata response to the archive of its season, a
+    file of concatenated gzip members (cache/archive/<season>.gz), and
+    records its position in the cache index. See reparse().
+
+    The archive is optional: failures are logged and counted
+    (crawler_archive_errors_total) instead of raised, so that the response
+    is used anyway.
+
+    Args:
+        params (dict): The query of the response.
+        body (bytes): The raw response.
+    """
+    path = f'{g_cache_path}/archive'
+    member = gzip.compress(body)
+    try:
+        with cache_lock():
+            os.makedirs(path, exist_ok=True)
+            with open(f"{path}/{params['season']}.gz", 'ab') as file:
+                offset = file.tell()
+                file.write(member)
+            with closing(connect_cache_index()) as conn, conn:
+                conn.execute(
+                    'INSERT INTO archive (season, division, matchday, offset, '
+                    'length, fetchedDatetime) VALUES (?, ?, ?, ?, ?, ?)',
+                    [params['season'], params['division'],
+                     params.get('matchday'), offset, len(member),
+                     datetime.now().isoformat()])
+    except (OSError, sqlite3.Error) as e:
+        g_logger.warning('Could not archive response to %s: %r', params, e)
+        g_metrics.inc('crawler_archive_errors_total')
+
+
+def reparse(seasons: list = None) -> list:
+    """Rebuilds cached match data from the archive of raw responses (see
+    archive_response()) without network access, e.g. after parse_league()
+    has changed. Each matchday is taken from the latest archived response
+    containing it. Cached matchdays that were not archived (e.g. fetched
+    before archiving was turned on) are kept.
+
+    Args:
+        seasons (list): Seasons to rebuild. Defaults to None (all archived
+                        seasons).
+
+    Returns:
+        A list of the rebuilt seasons.
+    """
+    with closing(connect_cache_index()) as conn:
+        entries = pd.read_sql_query(
+            'SELECT season, offset, length FROM archive ORDER BY season, id',
+            conn)
+    if seasons is not None:
+        entries = entries[entries['season'].isin(seasons)]
+    for season, group in entries.groupby('season'):
+        with open(f'{g_cache_path}/archive/{season}.gz', 'rb') as file:
+            archive = file.read()
+        frames = [parse_league(json_loads(gzip.decompress(
+            archive[entry.offset:entry.offset + entry.length])))
+            .assign(entry=i) for i, entry in enumerate(group.itertuples())]
+        data = pd.concat(frames, ignore_index=True)
+        latest = data.groupby(['division', 'matchday'])['entry'] \
+            .transform('max')
+        data = data[data['entry'] == latest].drop('entry', axis=1)
+        with cache_lock():
+            if os.path.exists(f'{g_cache_path}/matchdata_{season}'):
+                data = merge_matchdata(load_matchdata(str(season)), data)
+            store_matchdata(str(season), data)
+    return entries['season'].unique().tolist()
+
+
+class Recording:
+    """Raw openligadb responses stored in a directory, one file per query.
+    Files are named after the query path, e.g. getmatchdata_bl1_2020.json.
+    In 'record' mode, query() stores every successful response; in 'replay'
+    mode, query() answers from the recording without network access.
+
+    To use:
+    >>> crawler.g_recording = Recording('tests/recording', 'replay')
+
+    Attributes:
+        path: Directory of the recorded responses.
+        mode: Either 'record' or 'replay'.
+    """
+
+    def __init__(self, path: str, mode: str = 'replay'):
+        """Inits Recording (creating its directory if necessary).
+
+        Args:
+            path (str): Directory of the recorded responses.
+            mode (str): Either 'record' or 'replay'. Defaults to 'replay'.
+
+        Raises:
+            ValueError: If mode is unknown.
+        """
+        if mode not in ('record', 'replay'):
+            raise ValueError(f'Unknown mode: {mode}')
+        self.path = path
+        self.mode = mode
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, paramStr: str) -> str:
+        """Returns the file of a recorded response.
+
+        Args:
+            paramStr (str): Query path, e.g. 'getmatchdata/bl1/2020'.
+
+        Returns:
+            The path of the file.
+        """
+        return f"{self.path}/{paramStr.strip('/').replace('/', '_')}.json"
+
+    def load(self, paramStr: str) -> bytes:
+        """Reads a recorded response.
+
+        Args:
+            paramStr (str): Query path, e.g. 'getmatchdata/bl1/2020'.
+
+        Returns:
+            The raw response or None if it has not been recorded.
+        """
+        try:
+            with open(self.file(paramStr), 'rb') as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def save(self, paramStr: str, body: bytes):
+        """Records a response (replacing a previous recording).
+
+        Args:
+            paramStr (str): Query path, e.g. 'getmatchdata/bl1/2020'.
+            body (bytes): The raw response.
+        """
+        replace_file(self.file(paramStr), body)
+
+
+def record_request(action: str, status: int, start: float, size: int,
+                   retries: int):
+    """Reports a request (i.e. a single attempt) to g_metrics.
+
+    Args:
+        action (str): Queried endpoint, e.g. 'getmatchdata'.
+        status (int): HTTP status (None on connection errors and timeouts).
+        start (float): Start of the request (time.perf_counter()).
+        size (int): Size of the response in bytes.
+        retries (int): Retries of the query, if this was its last attempt.
+    """
+    seconds = time.perf_counter() - start
+    g_metrics.observe('crawler_request_seconds', seconds, action=action)
+    g_metrics.inc('crawler_requests_total', action=action,
+                  status=status or 'error')
+    if size:
+        g_metrics.inc('crawler_response_bytes_total', size, action=action)
+    if retries:
+        g_metrics.inc('crawler_retries_total', retries, action=action)
+
+
+def get_client() -> 'Client':
+    """Returns the shared client of this process (created on first use).
+
+    Returns:
+        The shared Client.
+    """
+    global g_client
+    if g_client is None or g_client.pid != os.getpid():
+        g_client = Client()
+        atexit.register(g_client.close)
+    return g_client
+
+
+class TokenBucket:
+    """A token bucket limiting the rate of requests. Must only be used from a
+    single event loop.
+
+    Attributes:
+        rate: Tokens added per second.
+        capacity: Maximum number of tokens (i.e. burst size).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        """Inits TokenBucket filled to capacity.
+
+        Args:
+            rate (float): Tokens added per second.
+            capacity (float): Maximum number of tokens.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        """Waits until a token is available and takes it.
+        """
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return  # exit
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Client:
+    """A long-lived HTTP client for openligadb. It runs its own event loop in
+    a background thread and keeps a pool of keep-alive connections. Requests
+    are limited in concurrency and rate, time out and are retried with
+    exponential backoff.
+
+    Attributes:
+        maxInFlight: Maximum number of concurrent requests.
+        timeout: Timeout of a single request in seconds.
+        retries: Maximum number of retries of a failed request.
+        backoff: Delay before the first retry in seconds.
+    """
+
+    def __init__(self, maxInFlight: int = None, rate: float = None,
+                 timeout: float = None, retries: int = None,
+                 backoff: float = None):
+        """Inits Client and starts its event loop. Arguments default to the
+        corresponding g_ settings of this module.
+
+        Args:
+            maxInFlight (int): Maximum number of concurrent requests.
+            rate (float): Maximum number of requests per second.
+            timeout (float): Timeout of a single request in seconds.
+            retries (int): Maximum number of retries of a failed request.
+            backoff (float): Delay before the first retry in seconds.
+        """
+        self.maxInFlight = maxInFlight or g_max_in_flight
+        self.rate = rate or g_rate_limit
+        self.timeout = timeout or g_request_timeout
+        self.retries = g_max_retries if retries is None else retries
+        self.backoff = g_retry_backoff if backoff is None else backoff
+        self.pid = os.getpid()
+        self.session = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def fetch(self, queries: list) -> list:
+        """Sends queries and blocks until all responses are available. Must
+        not be called from the client's event loop.
+
+        Args:
+            queries (list): List of queries.
+
+        Returns:
+            A List of responses (see gather()).
+        """
+        future = asyncio.run_coroutine_threadsafe(self.gather(queries),
+                                                  self.loop)
+        return future.result()
+
+    async def fetch_async(self, queries: list, send=None) -> list:
+        """Sends queries from any event loop. See gather().
+
+        Args:
+            queries (list): List of queries.
+            send: Coroutine function sending a single query. Defaults to
+                  query().
+
+        Returns:
+            A List of responses (see gather()).
+        """
+        if asyncio.get_running_loop() is self.loop:
+            return await self.gather(queries, send)
+        future = asyncio.run_coroutine_threadsafe(self.gather(queries, send),
+                                                  self.loop)
+        return await asyncio.wrap_future(future)
+
+    async def gather(self, queries: list, send=None) -> list:
+        """Sends queries concurrently. Runs in the client's event loop.
+
+        Args:
+            queries (list): List of queries.
+            send: Coroutine function sending a single query, e.g. query() or
+                  download(). Defaults to query().
+
+        Returns:
+            A List of responses in the order of the queries. Each response is
+            a dictionary containing the query ('params'), the parsed response
+            ('response', None on failure), an error message ('error', None on
+            success), the HTTP status, the size in bytes and the number of
+            retries.
+        """
+        if self.session is None:
+            self.semaphore = asyncio.Semaphore(self.maxInFlight)
+            self.bucket = TokenBucket(self.rate, self.maxInFlight)
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.maxInFlight),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return await asyncio.gather(*[self.request(params, send or query)
+                                      for params in queries])
+
+    async def request(self, params: dict, send=None) -> dict:
+        """Sends a single query and retries on connection errors, timeouts
+        and server errors. Malformed responses and failures to record them
+        are returned as errors without retry.
+
+        Args:
+            params (dict): A dictionary containg request parameters in the
+                           order required.
+            send: Coroutine function sending the query. Defaults to query().
+
+        Returns:
+            A response as described in gather().
+        """
+        action = params.get('action') if isinstance(params, dict) \
+            else 'download'
+        retries = 0
+        while True:
+            async with self.semaphore:
+                await self.bucket.acquire()
+                start = time.perf_counter()
+                try:
+                    result = await (send or query)(self.session, params)
+                    result.update(error=None, retries=retries)
+                    record_request(action, result['status'], start,
+                                   result['bytes'], retries)
+                    return result
+                except aiohttp.ClientResponseError as e:
+                    error, status = f'HTTP {e.status}: {e.message}', e.status
+                    retry = e.status >= 500 or e.status == 429
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error, status = repr(e), None
+                    retry = True
+                except (ValueError, OSError) as e:
+                    # malformed response or failure to record it
+                    error, status = repr(e), None
+                    retry = False
+            final = not retry or retries >= self.retries
+            record_request(action, status, start, 0, retries if final else 0)
+            if final:
+                return {'params': params, 'response': None, 'error': error,
+                        'status': status, 'bytes': 0, 'retries': retries}
+            await asyncio.sleep(self.backoff * 2 ** retries)
+            retries += 1
+
+    async def shutdown(self):
+        """Cancels all other tasks of the client's event loop and closes the
+        session. Runs in the client's event loop.
+        """
+        tasks = asyncio.all_tasks() - {asyncio.current_task()}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.session is not None:
+            await self.session.close()
+
+    def close(self):
+        """Cancels pending requests (e.g. icon prefetches), closes all
+        connections and stops the event loop.
+        """
+        if not self.thread.is_alive():
+            return  # exit
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+
+class FrameCache:
+    """A bounded LRU cache of pd.DataFrames (results of get_data()). Entries
+    are evicted when their total memory usage exceeds the limit. Cached
+    frames are copied when returned, so callers may modify them.
+
+    Attributes:
+        maxBytes: Memory limit of all entries in bytes.
+        hits: Number of lookups answered from the cache.
+        misses: Number of lookups not answered from the cache.
+    """
+
+    def __init__(self, maxBytes: int = None):
+        """Inits an empty FrameCache.
+
+        Args:
+            maxBytes (int): Memory limit in bytes. Defaults to
+                            g_frame_cache_bytes.
+        """
+        self.maxBytes = g_frame_cache_bytes if maxBytes is None else maxBytes
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> pd.DataFrame:
+        """Looks up a cached frame and marks it as recently used.
+
+        Args:
+            key (tuple): Key of the frame, starting with the first matchday
+                         (season and day) and the last matchday it contains.
+
+        Returns:
+            A copy of the cached pd.DataFrame or None.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key][0].copy()
+
+    def put(self, key: tuple, data: pd.DataFrame):
+        """Caches a copy of a frame and evicts the least recently used frames
+        exceeding the memory limit. Frames larger than the limit are not
+        cached.
+
+        Args:
+            key (tuple): Key of the frame (see get()).
+            data (pd.DataFrame): The frame.
+        """
+        size = int(data.memory_usage(deep=True).sum())
+        if size > self.maxBytes:
+            return  # exit
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (data.copy(), size)
+            self.bytes += size
+            while self.bytes > self.maxBytes:
+                self.bytes -= self.entries.popitem(last=False)[1][1]
+
+    def invalidate(self, season: int):
+        """Drops all frames containing a season.
+
+        Args:
+            season (int): The season whose match data has changed.
+        """
+        with self.lock:
+            for key in [key for key in self.entries
+                        if key[0] <= season <= key[2]]:
+                self.bytes -= self.entries.pop(key)[1]
+
+    def stats(self) -> dict:
+        """Reports the usage of the cache.
+
+        Returns:
+            A dictionary containing the number of hits, misses and entries and
+            the memory usage in bytes.
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'entries': len(self.entries), 'bytes': self.bytes}
+
+
+g_frame_cache = FrameCache()
 
 
 def parse_league(data: list) -> pd.DataFrame:
-    """Converts match data (of a league) into internal format.
+    """Converts match data (of a league) into internal format. The matches
+    are written into preallocated column arrays, timestamps are converted
+    once per column.
 
     Args:
         data (list): Detailed match data from openligadb.
@@ -201,54 +1352,99 @@ def parse_league(data: list) -> pd.DataFrame:
     Returns:
         A pd.DataFrame containing match data in internal format.
     """
-    matches = pd.DataFrame(map(parse_match, data))
-    cols = ['homeScore', 'guestScore', 'locID']
-    matches[cols] = matches[cols].astype('Int64')
-    cols = ['datetime', 'datetimeUTC']
-    matches[cols] = matches[cols].apply(pd.to_datetime)
+    start = time.perf_counter()
+    n = len(data)
+    ints = {col: np.zeros(n, dtype='int64') for col in
+            ['season', 'matchday', 'homeTeamID', 'guestTeamID', 'homeScore',
+             'guestScore', 'locID']}
+    objs = {col: np.empty(n, dtype=object) for col in
+            ['division', 'datetime', 'datetimeUTC', 'homeTeamName',
+             'homeTeamIcon', 'guestTeamName', 'guestTeamIcon', 'locCity',
+             'locStadium']}
+    finished = np.zeros(n, dtype=bool)
+    scored = np.zeros(n, dtype=bool)
+    located = np.zeros(n, dtype=bool)
+    for i, match in enumerate(data):
+        ints['season'][i] = match['leagueSeason']
+        objs['division'][i] = match['leagueShortcut']
+        objs['datetime'][i] = match['matchDateTime']
+        objs['datetimeUTC'][i] = match['matchDateTimeUTC']
+        ints['matchday'][i] = match['group']['groupOrderID']
+        home, guest = match['team1'], match['team2']
+        ints['homeTeamID'][i] = home['teamId']
+        objs['homeTeamName'][i] = home['teamName']
+        objs['homeTeamIcon'][i] = home['teamIconUrl']
+        ints['guestTeamID'][i] = guest['teamId']
+        objs['guestTeamName'][i] = guest['teamName']
+        objs['guestTeamIcon'][i] = guest['teamIconUrl']
+        finished[i] = match['matchIsFinished']
+        for result in match['matchResults']:
+            if result['resultName'] == 'Endergebnis':
+                ints['homeScore'][i] = result['pointsTeam1']
+                ints['guestScore'][i] = result['pointsTeam2']
+                scored[i] = True
+                break
+        loc = match['location']
+        if loc:
+            ints['locID'][i] = loc['locationID']
+            objs['locCity'][i] = loc['locationCity']
+            objs['locStadium'][i] = loc['locationStadium']
+            located[i] = True
+    matches = pd.DataFrame({
+        'season': ints['season'],
+        'division': objs['division'],
+        'datetime': pd.to_datetime(objs['datetime']),
+        'datetimeUTC': pd.to_datetime(objs['datetimeUTC'], utc=True),
+        'matchday': ints['matchday'],
+        'homeTeamID': ints['homeTeamID'],
+        'homeTeamName': objs['homeTeamName'],
+        'homeTeamIcon': objs['homeTeamIcon'],
+        'guestTeamID': ints['guestTeamID'],
+        'guestTeamName': objs['guestTeamName'],
+        'guestTeamIcon': objs['guestTeamIcon'],
+        'finished': finished,
+        'homeScore': pd.arrays.IntegerArray(ints['homeScore'], ~scored),
+        'guestScore': pd.arrays.IntegerArray(ints['guestScore'], ~scored),
+        'locID': pd.arrays.IntegerArray(ints['locID'], ~located),
+        'locCity': objs['locCity'],
+        'locStadium': objs['locStadium']})
+    g_metrics.observe('crawler_parse_seconds', time.perf_counter() - start)
+    g_metrics.inc('crawler_parsed_matches_total', n)
     return matches
 
 
-def parse_match(match: dict) -> dict:
-    """Parses a single match into internal format.
-
-    Args:
-        match (dict): A single match in the format of openligadb.
+def connect_cache_index() -> sqlite3.Connection:
+    """Opens the cache index, an SQLite database in WAL mode holding one row
+    per league (i.e. division and season). Readers never block on writers and
+    every write is a transaction, so several processes can share the cache.
+    An index.csv written by older versions is imported when the database is
+    created.
 
     Returns:
-        A dictionary representing details of a single match in internal format.
+        An open sqlite3.Connection (to be closed by the caller).
     """
-    score = list(filter(lambda d: d['resultName'] == 'Endergebnis',
-                        match['matchResults']))
-    if match['location']:
-        loc = {'ID': match['location']['locationID'],
-               'city': match['location']['locationCity'],
-               'stadium': match['location']['locationStadium']}
-    else:
-        loc = {'ID': None, 'city': None, 'stadium': None}
-    return {
-        'season': match['leagueSeason'],
-        'division': match['leagueShortcut'],
-        'datetime': match['matchDateTime'],
-        'datetimeUTC': match['matchDateTimeUTC'],
-        'matchday': match['group']['groupOrderID'],
-        'homeTeamID': match['team1']['teamId'],
-        'homeTeamName': match['team1']['teamName'],
-        'homeTeamIcon': match['team1']['teamIconUrl'],
-        'guestTeamID': match['team2']['teamId'],
-        'guestTeamName': match['team2']['teamName'],
-        'guestTeamIcon': match['team2']['teamIconUrl'],
-        'finished': match['matchIsFinished'],
-        'homeScore': score[0]['pointsTeam1'] if score else None,
-        'guestScore': score[0]['pointsTeam2'] if score else None,
-        'locID': loc['ID'],
-        'locCity': loc['city'],
-        'locStadium': loc['stadium']
-    }
+    os.makedirs(g_cache_path, exist_ok=True)
+    path = f'{g_cache_path}/index.sqlite'
+    created = not os.path.exists(path)
+    conn = sqlite3.connect(path, timeout=30)
+    # readers must not write, so the schema is only created or upgraded once
+    if conn.execute('PRAGMA user_version').fetchone()[0] != g_index_version:
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(g_index_schema)
+        conn.execute(f'PRAGMA user_version = {g_index_version}')
+    legacyPath = f'{g_cache_path}/index.csv'
+    if created and os.path.exists(legacyPath):
+        data = pd.read_csv(legacyPath)
+        for col in data.columns.intersection(['division', 'IDs']):
+            data[col] = data[col].apply(literal_eval)
+        with conn:
+            upsert_leagues(conn, data)
+    return conn
 
 
 def load_cache_index(fetchIfEmpty: bool = False) -> pd.DataFrame:
-    """Reads cache index and returns its content as pd.DataFrame.
+    """Reads cache index and returns its content as pd.DataFrame with one row
+    per season.
 
     Args:
         fetchIfEmpty (bool): Determines if available seasons should be fetched
@@ -258,11 +1454,16 @@ def load_cache_index(fetchIfEmpty: bool = False) -> pd.DataFrame:
         A pd.DataFrame representing the content of the cache index (might be
         an empty pd.DataFrame).
     """
-    path = f'{g_cache_path}/index.csv'
-    if os.path.exists(path):
-        data = pd.read_csv(path, parse_dates=['cachedDatetime'])
+    leagues = load_leagues()
+    if not leagues.empty:
+        data = leagues.groupby('season').agg(
+            division=('division', list),
+            IDs=('leagueId', list),
+            availMatchdays=('availMatchdays', 'max'),
+            cached=('cached', 'all'),
+            cachedMatchdays=('cachedMatchdays', 'max'),
+            cachedDatetime=('cachedDatetime', 'max')).reset_index()
         data['availMatchdays'] = data['availMatchdays'].astype('Int64')
-        data['division'] = data['division'].apply(literal_eval)
     elif fetchIfEmpty:
         fetch_avail_seasons()
         data = load_cache_index()
@@ -271,8 +1472,48 @@ def load_cache_index(fetchIfEmpty: bool = False) -> pd.DataFrame:
     return data
 
 
+async def load_cache_index_async(fetchIfEmpty: bool = False) -> pd.DataFrame:
+    """Awaitable version of load_cache_index().
+
+    Args:
+        fetchIfEmpty (bool): Determines if available seasons should be fetched
+                             if the local cache is empty. Defaults to False.
+
+    Returns:
+        A pd.DataFrame representing the content of the cache index (might be
+        an empty pd.DataFrame).
+    """
+    if fetchIfEmpty and load_leagues().empty:
+        await fetch_avail_seasons_async()
+    return load_cache_index()
+
+
+def load_leagues(season: int = None, division: str = None) -> pd.DataFrame:
+    """Looks up leagues in the cache index.
+
+    Args:
+        season (int): Only return leagues of this season. Defaults to None
+                      (all seasons).
+        division (str): Only return leagues of this division. Defaults to
+                        None (all divisions).
+
+    Returns:
+        A pd.DataFrame with one row per league (might be empty).
+    """
+    query = 'SELECT * FROM leagues WHERE (? IS NULL OR season = ?) ' \
+            'AND (? IS NULL OR division = ?) ORDER BY season, division'
+    with closing(connect_cache_index()) as conn:
+        leagues = pd.read_sql_query(
+            query, conn, params=[season, season, division, division])
+    leagues['cached'] = leagues['cached'].astype(bool)
+    leagues['availMatchdays'] = leagues['availMatchdays'].astype('Int64')
+    leagues['cachedDatetime'] = pd.to_datetime(leagues['cachedDatetime'])
+    return leagues
+
+
 def load_matchdata(suffix: str) -> pd.DataFrame:
-    """Reads matches from cache and returns its content as pd.DataFrame.
+    """Reads matches from cache and returns its content as pd.DataFrame in
+    internal format (see to_wide()).
 
     Args:
         suffix (str): File suffix (identifier) of the matchdata.
@@ -280,47 +1521,648 @@ def load_matchdata(suffix: str) -> pd.DataFrame:
     Returns:
         A pd.DataFrame representing match data in internal format.
     """
-    path = f'{g_cache_path}/matchdata_{suffix}.csv'
-    if os.path.exists(path):
-        matches = pd.read_csv(path, parse_dates=['datetime', 'datetimeUTC'])
-        matches['locID'] = matches['locID'].astype('Int64')
+    return to_wide(load_facts(suffix))
+
+
+def load_facts(suffix: str, divisions: list = None, fromMatchday: int = None,
+               toMatchday: int = None) -> pd.DataFrame:
+    """Reads matches from cache and returns them as compact fact table (see
+    to_facts()). Only the rows of the selected divisions and matchdays are
+    read (see load_columns()). Match data cached as CSV or in internal format
+    by older versions is converted on first access.
+
+    Args:
+        suffix (str): File suffix (identifier) of the matchdata.
+        divisions (list): Only read these divisions. Defaults to None (all
+                          divisions).
+        fromMatchday (int): Only read this and later matchdays. Defaults to
+                            None (from the first matchday).
+        toMatchday (int): Only read this and earlier matchdays. Defaults to
+                          None (up to the last matchday).
+
+    Returns:
+        A pd.DataFrame representing match data as fact table.
+    """
+    start = time.perf_counter()
+    path = f'{g_cache_path}/matchdata_{suffix}'
+    where = {}
+    if divisions is not None:
+        where['division'] = lambda col: col.isin(divisions)
+    if fromMatchday is not None or toMatchday is not None:
+        lower = -np.inf if fromMatchday is None else fromMatchday
+        upper = np.inf if toMatchday is None else toMatchday
+        where['matchday'] = lambda col: (col >= lower) & (col <= upper)
+    if os.path.exists(f'{current_generation(path)}/columns.json'):
+        matches = load_columns(path, where)
+        if 'homeTeamID' in matches and 'homeTeamName' in matches:
+            store_facts(suffix, load_columns(path))
+            matches = load_columns(path, where)
+    elif os.path.exists(f'{path}.csv'):
+        import_matchdata(suffix, f'{path}.csv')
+        matches = load_columns(path, where)
     else:
         matches = pd.DataFrame()
         print(f'File not found: {path}')
+    g_metrics.observe('crawler_load_seconds', time.perf_counter() - start)
+    g_metrics.inc('crawler_rows_loaded_total', len(matches))
     return matches
 
 
+def load_teams() -> pd.DataFrame:
+    """Reads the teams table of the cache index. Each team has a dense code
+    (0, 1, ...) which never changes, so it can be used to index arrays. Name
+    and icon are taken from the latest season the team was stored with.
+
+    Returns:
+        A pd.DataFrame indexed by team ID with the columns 'code', 'name' and
+        'icon'.
+    """
+    with closing(connect_cache_index()) as conn:
+        return pd.read_sql_query('SELECT teamId, code, name, icon FROM teams',
+                                 conn, index_col='teamId')
+
+
+def load_locations() -> pd.DataFrame:
+    """Reads the locations table of the cache index.
+
+    Returns:
+        A pd.DataFrame indexed by location ID with the columns 'city' and
+        'stadium'.
+    """
+    with closing(connect_cache_index()) as conn:
+        return pd.read_sql_query('SELECT locId, city, stadium FROM locations',
+                                 conn, index_col='locId')
+
+
+def to_wide(facts: pd.DataFrame) -> pd.DataFrame:
+    """Converts a fact table into internal format: team names and icons and
+    location details are looked up by ID and compact dtypes are widened.
+
+    Args:
+        facts (pd.DataFrame): Match data as fact table (see to_facts()).
+
+    Returns:
+        A new pd.DataFrame representing the match data in internal format.
+    """
+    data = facts.drop(columns=['homeTeamCode', 'guestTeamCode'],
+                      errors='ignore')
+    for col, dtype in g_fact_dtypes.items():
+        if col not in data:
+            continue
+        elif dtype == 'category':
+            data[col] = data[col].astype(object)
+        else:
+            data[col] = data[col].astype(dtype[0] + 'nt64')
+    for side in ['home', 'guest']:
+        if f'{side}TeamID' in data and f'{side}TeamName' not in data:
+            teams = load_teams().reindex(data[f'{side}TeamID'])
+            pos = data.columns.get_loc(f'{side}TeamID') + 1
+            data.insert(pos, f'{side}TeamName', teams['name'].to_numpy())
+            data.insert(pos + 1, f'{side}TeamIcon', teams['icon'].to_numpy())
+    if 'locID' in data and 'locCity' not in data:
+        locations = load_locations().reindex(data['locID'].astype(float))
+        pos = data.columns.get_loc('locID') + 1
+        data.insert(pos, 'locCity', locations['city'].to_numpy())
+        data.insert(pos + 1, 'locStadium', locations['stadium'].to_numpy())
+    return data
+
+
+def to_facts(data: pd.DataFrame) -> pd.DataFrame:
+    """Converts match data in internal format into a compact fact table.
+    Team names and icons and location details are dropped if their ID is
+    available (they are kept in the teams and locations tables, see
+    store_dimensions()), all other columns get the smallest suitable dtype
+    (see g_fact_dtypes).
+
+    Args:
+        data (pd.DataFrame): Match data in internal format.
+
+    Returns:
+        A new pd.DataFrame representing the match data as fact table.
+    """
+    drop = []
+    for side in ['home', 'guest']:
+        if f'{side}TeamID' in data:
+            drop += [f'{side}TeamName', f'{side}TeamIcon']
+    if 'locID' in data:
+        drop += ['locCity', 'locStadium']
+    facts = data.drop(columns=drop, errors='ignore')
+    dtypes = {col: dtype for col, dtype in g_fact_dtypes.items()
+              if col in facts}
+    return facts.astype(dtypes)
+
+
+def load_columns(path: str, where: dict = None) -> pd.DataFrame:
+    """Reads a pd.DataFrame stored by store_columns(). Numeric and timestamp
+    columns are memory-mapped and wrapped without conversion, only string
+    columns are copied into Python objects. If rows are selected, the
+    predicates are evaluated on their columns first and only the selected
+    rows of the other columns are read.
+
+    Args:
+        path (str): Directory containing the column files.
+        where (dict): Maps column names to functions, which return a boolean
+                      mask of the rows to read given the column. Columns that
+                      are not stored are ignored. Defaults to None (all rows).
+
+    Returns:
+        The stored pd.DataFrame (with the dtypes it was stored with).
+
+    Raises:
+        FileNotFoundError: If no columns are stored.
+    """
+    for attempt in range(3):
+        generation = current_generation(path)
+        try:
+            with open(f'{generation}/columns.json') as file:
+                schema = json.load(file)
+            rows = None
+            for col in schema:
+                if where and col['name'] in where:
+                    mask = where[col['name']](load_column(generation, col))
+                    mask = np.asarray(mask)
+                    rows = mask if rows is None else rows & mask
+            if rows is not None:
+                rows = np.flatnonzero(rows)
+            columns = {col['name']: load_column(generation, col, rows)
+                       for col in schema}
+        except FileNotFoundError:
+            # generation removed by concurrent writers, read the new one
+            if attempt == 2 or generation == current_generation(path):
+                raise
+            continue
+        return pd.DataFrame(columns, columns=[col['name'] for col in schema])
+
+
+def current_generation(path: str) -> str:
+    """Resolves the directory holding the current column files of a column
+    store (see store_columns()).
+
+    Args:
+        path (str): Directory of the column store.
+
+    Returns:
+        The directory of the current generation (or the given directory if
+        it was written by older versions without generations).
+    """
+    try:
+        with open(f'{path}/CURRENT') as file:
+            return f'{path}/{file.read()}'
+    except FileNotFoundError:
+        return path
+
+
+def load_column(path: str, col: dict, rows: np.ndarray = None):
+    """Reads a single column stored by store_columns(). See load_columns().
+
+    Args:
+        path (str): Directory containing the column files.
+        col (dict): Schema entry of the column (see store_columns()).
+        rows (np.ndarray): Positions of the rows to read. Defaults to None
+                           (all rows, memory-mapped).
+
+    Returns:
+        The column as np.ndarray or pandas extension array.
+    """
+    name, kind = col['name'], col['kind']
+    values = np.load(f'{path}/{name}.npy', mmap_mode='r')
+    mask = None
+    if kind in ['nullable', 'object']:
+        mask = np.load(f'{path}/{name}.mask.npy', mmap_mode='r')
+    if rows is not None:
+        values = values[rows]
+        mask = None if mask is None else mask[rows]
+    if kind == 'nullable':
+        return pd.arrays.IntegerArray(values, mask)
+    elif kind == 'category':
+        return pd.Categorical.from_codes(values, col['categories'])
+    elif kind == 'datetimetz':
+        dtype = pd.DatetimeTZDtype(tz=col['tz'])
+        return pd.arrays.DatetimeArray(values, dtype=dtype)
+    elif kind == 'object':
+        values = values.astype(object)
+        values[mask] = np.nan
+    return values
+
+
+def import_matchdata(suffix: str, path: str) -> pd.DataFrame:
+    """Imports match data from a CSV file (as written by export_matchdata())
+    into the local cache.
+
+    Args:
+        suffix (str): File suffix (identifier) of the matchdata.
+        path (str): Path of the CSV file.
+
+    Returns:
+        A pd.DataFrame representing the imported match data.
+    """
+    matches = pd.read_csv(path, parse_dates=['datetime', 'datetimeUTC'])
+    cols = matches.columns.intersection(['homeScore', 'guestScore', 'locID'])
+    matches[cols] = matches[cols].astype('Int64')
+    store_facts(suffix, matches)
+    return matches
+
+
+def export_matchdata(suffix: str, path: str):
+    """Exports cached match data to a CSV file.
+
+    Args:
+        suffix (str): File suffix (identifier) of the matchdata.
+        path (str): Path of the CSV file.
+    """
+    load_matchdata(suffix).to_csv(path, index=False)
+
+
 def store_cache_index(data: pd.DataFrame):
-    """Stores given pd.DataFrame as cache index in CSV file format.
+    """Inserts or updates leagues in the cache index. Only the columns present
+    in the given pd.DataFrame are updated, other columns of existing leagues
+    are kept.
+
+    Args:
+        data (pd.DataFrame): A pd.DataFrame in the format of the cache index,
+                             i.e. one row per season with a list of divisions
+                             (or one row per league with a single division).
+    """
+    with closing(connect_cache_index()) as conn, conn:
+        upsert_leagues(conn, data)
+
+
+def upsert_leagues(conn: sqlite3.Connection, data: pd.DataFrame):
+    """Inserts or updates rows of the leagues table. See store_cache_index().
+
+    Args:
+        conn (sqlite3.Connection): Connection to the cache index.
+        data (pd.DataFrame): A pd.DataFrame in the format of the cache index.
+    """
+    if 'IDs' in data:
+        data = data.explode(['division', 'IDs'])
+        data = data.rename(columns={'IDs': 'leagueId'})
+    else:
+        data = data.explode('division')
+    cols = [col for col in g_index_columns if col in data]
+    values = data[['season', 'division'] + cols].astype(object)
+    values = values.where(values.notna(), None).values.tolist()
+    update = ', '.join([f'{col} = excluded.{col}' for col in cols])
+    conflict = f'DO UPDATE SET {update}' if cols else 'DO NOTHING'
+    conn.executemany(
+        f'INSERT INTO leagues (season, division, {", ".join(cols)}) '
+        f'VALUES ({", ".join("?" * (len(cols) + 2))}) '
+        f'ON CONFLICT (season, division) {conflict}', values)
+
+
+def update_cache_index(season: int, division: str, **values):
+    """Updates the cache index entry of a single league.
+
+    Args:
+        season (int): Season of the league.
+        division (str): Division of the league.
+        **values: Columns of the cache index and their new values.
+    """
+    assignments = ', '.join([f'{col} = ?' for col in values])
+    with closing(connect_cache_index()) as conn, conn:
+        conn.execute(
+            f'UPDATE leagues SET {assignments} '
+            'WHERE season = ? AND division = ?',
+            [*values.values(), season, division])
+
+
+def load_last_changes(season: int) -> dict:
+    """Reads the last change dates of matchdays (as reported by openligadb
+    when the matchday was fetched) from the cache index.
+
+    Args:
+        season (int): Season of the matchdays.
+
+    Returns:
+        A dictionary mapping (division, matchday) to the last change date.
+    """
+    with closing(connect_cache_index()) as conn:
+        rows = conn.execute('SELECT division, matchday, lastChange '
+                            'FROM matchdays WHERE season = ?', [season])
+        return {(division, matchday): lastChange
+                for division, matchday, lastChange in rows}
+
+
+def store_last_change(season: int, division: str, matchday: int,
+                      lastChange: str):
+    """Stores the last change date of a matchday in the cache index.
+
+    Args:
+        season (int): Season of the matchday.
+        division (str): Division of the matchday.
+        matchday (int): The matchday.
+        lastChange (str): Last change date as reported by openligadb.
+    """
+    with closing(connect_cache_index()) as conn, conn:
+        conn.execute('INSERT INTO matchdays VALUES (?, ?, ?, ?) '
+                     'ON CONFLICT (season, division, matchday) '
+                     'DO UPDATE SET lastChange = excluded.lastChange',
+                     [season, division, matchday, lastChange])
+
+
+def load_icon_entry(teamId: int, url: str) -> tuple:
+    """Reads the cache index entry of a team icon.
+
+    Args:
+        teamId (int): ID of the team.
+        url (str): URL of the team icon.
+
+    Returns:
+        A tuple of content hash and file extension (both None if the icon
+        could not be fetched) or None if the icon has not been fetched yet.
+    """
+    with closing(connect_cache_index()) as conn:
+        return conn.execute('SELECT hash, ext FROM icons '
+                            'WHERE teamId = ? AND url = ?',
+                            [int(teamId), url]).fetchone()
+
+
+def load_meta(key: str) -> str:
+    """Reads a value from the meta table of the cache index.
 
     Args:
-        data (pd.DataFrame): A pd.DataFrame representing the cache index.
+        key (str): Key of the value.
+
+    Returns:
+        The stored value or None.
+    """
+    with closing(connect_cache_index()) as conn:
+        row = conn.execute('SELECT value FROM meta WHERE key = ?',
+                           [key]).fetchone()
+    return row[0] if row else None
+
+
+def store_meta(key: str, value: str):
+    """Stores a value in the meta table of the cache index.
+
+    Args:
+        key (str): Key of the value.
+        value (str): The value.
     """
-    if not os.path.exists(g_cache_path):
-        os.mkdir(g_cache_path)
-    data.to_csv(f'{g_cache_path}/index.csv', index=False)
+    with closing(connect_cache_index()) as conn, conn:
+        conn.execute('INSERT INTO meta VALUES (?, ?) ON CONFLICT (key) '
+                     'DO UPDATE SET value = excluded.value', [key, value])
 
 
 def store_matchdata(suffix: str, data: pd.DataFrame):
-    """Stores match data to local cache in CSV file format.
+    """Stores match data to local cache as fact table (see store_facts()) and
+    updates the cache index. Holds cache_lock(), so callers merging with
+    cached data should hold it as well while loading.
+
+    Args:
+        suffix (str): File suffix (identifier) of given match data.
+        data (pd.DataFrame): Match data in internal format.
+    """
+    with cache_lock():
+        store_matchdata_locked(suffix, data)
+
+
+def store_matchdata_locked(suffix: str, data: pd.DataFrame):
+    """Implementation of store_matchdata(), to be called with cache_lock()
+    held.
 
     Args:
         suffix (str): File suffix (identifier) of given match data.
         data (pd.DataFrame): Match data in internal format.
     """
-    if not os.path.exists(g_cache_path):
-        os.mkdir(g_cache_path)
+    os.makedirs(g_cache_path, exist_ok=True)
     data.reset_index(drop=True, inplace=True)
+    pending = data.loc[~data['finished'], ['division', 'matchday']]
     data.drop(data[~data['finished']].index, axis=0, inplace=True)
     data.drop('finished', axis=1, inplace=True)
-    data.to_csv(f'{g_cache_path}/matchdata_{suffix}.csv', index=False)
     if suffix != 'next':
-        fetchIfEmpty = True
-        avail = load_cache_index(fetchIfEmpty)
+        # contiguous rows per division and matchday (see load_facts())
+        data.sort_values(['division', 'matchday', 'datetimeUTC'],
+                         kind='stable', inplace=True, ignore_index=True)
+    store_facts(suffix, data)
+    if suffix != 'next':
         season = int(suffix)
-        cols = ['availMatchdays', 'cachedMatchdays', 'cached',
-                'cachedDatetime']
-        days = data['matchday'].max()
+        g_frame_cache.invalidate(season)
         now = str(datetime.now())
-        avail.loc[avail['season'] == season, cols] = [days, days, True, now]
-        store_cache_index(avail)
+        for league in load_leagues(season).itertuples():
+            # matchdays are cached up to the first one which is missing or
+            # has pending matches
+            stored = set(data.loc[data['division'] == league.division,
+                                  'matchday'])
+            days = 0
+            while days + 1 in stored:
+                days += 1
+            pendingDays = pending.loc[pending['division'] == league.division,
+                                      'matchday']
+            if pendingDays.empty:
+                cached = days > 0 and (pd.isna(league.availMatchdays)
+                                       or days >= league.availMatchdays)
+            else:
+                days = min(days, int(pendingDays.min()) - 1)
+                cached = False
+            update_cache_index(season, league.division, cachedMatchdays=days,
+                               cached=bool(cached), cachedDatetime=now)
+
+
+def store_facts(suffix: str, data: pd.DataFrame) -> pd.DataFrame:
+    """Stores match data in columnar format (see store_columns()) as fact
+    table and its teams and locations in the cache index.
+
+    Args:
+        suffix (str): File suffix (identifier) of given match data.
+        data (pd.DataFrame): Match data in internal format.
+
+    Returns:
+        The stored fact table.
+    """
+    with cache_lock():
+        store_dimensions(data)
+        facts = to_facts(data)
+        store_columns(f'{g_cache_path}/matchdata_{suffix}', facts)
+    return facts
+
+
+def store_dimensions(data: pd.DataFrame):
+    """Inserts or updates the teams and locations of match data in the cache
+    index. New teams get the next free code, existing teams and locations
+    are only updated with data of the same or a later season.
+
+    Args:
+        data (pd.DataFrame): Match data in internal format.
+    """
+    data = data.assign(season=data['season'] if 'season' in data else 0)
+    teams = [data[['season', f'{side}TeamID', f'{side}TeamName',
+                   f'{side}TeamIcon']].set_axis(
+                       ['season', 'id', 'name', 'icon'], axis=1)
+             for side in ['home', 'guest']
+             if f'{side}TeamID' in data and f'{side}TeamName' in data]
+    locations = []
+    if {'locID', 'locCity', 'locStadium'}.issubset(data.columns):
+        locations = data.loc[data['locID'].notna(),
+                             ['locID', 'season', 'locCity', 'locStadium']]
+        locations = locations.sort_values('season', kind='stable') \
+            .drop_duplicates('locID', keep='last')
+        locations = locations.astype(object).values.tolist()
+    if teams:
+        teams = pd.concat(teams).sort_values('season', kind='stable') \
+            .drop_duplicates('id', keep='last')
+        teams = teams[['id', 'season', 'name', 'icon']] \
+            .astype(object).values.tolist()
+    with closing(connect_cache_index()) as conn, conn:
+        conn.executemany(
+            'INSERT INTO teams VALUES (?, (SELECT COUNT(*) FROM teams), ?, ?, ?) '
+            'ON CONFLICT (teamId) DO UPDATE SET season = excluded.season, '
+            'name = excluded.name, icon = excluded.icon '
+            'WHERE excluded.season >= teams.season', teams)
+        conn.executemany(
+            'INSERT INTO locations VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (locId) DO UPDATE SET season = excluded.season, '
+            'city = excluded.city, stadium = excluded.stadium '
+            'WHERE excluded.season >= locations.season', locations)
+
+
+def store_columns(path: str, data: pd.DataFrame):
+    """Stores a pd.DataFrame as one .npy file per column, which can be memory
+    mapped by load_columns(). Nullable integer and string columns get an
+    additional mask file, tz-aware timestamps are stored as UTC. All files
+    are written to a new generation directory, which then replaces the
+    current one atomically (by replacing the CURRENT file naming it), so
+    readers never see a partially written frame. The previous generation is
+    kept for readers still opening it, older ones are removed. Must be called
+    with cache_lock() held.
+
+    Args:
+        path (str): Directory the column files are written to.
+        data (pd.DataFrame): The pd.DataFrame to store.
+    """
+    previous = os.path.basename(current_generation(path))
+    generation = f'{time.time_ns()}-{os.getpid()}'
+    os.makedirs(f'{path}/{generation}')
+    schema = []
+    for name in data.columns:
+        col = data[name]
+        files = {}
+        if pd.api.types.is_extension_array_dtype(col.dtype) and \
+                pd.api.types.is_integer_dtype(col.dtype):
+            kind = 'nullable'
+            files['npy'] = col.fillna(0).to_numpy(col.dtype.numpy_dtype)
+            files['mask.npy'] = col.isna().to_numpy()
+        elif isinstance(col.dtype, pd.CategoricalDtype):
+            kind = 'category'
+            files['npy'] = col.cat.codes.to_numpy()
+        elif isinstance(col.dtype, pd.DatetimeTZDtype):
+            kind = 'datetimetz'
+            files['npy'] = col.dt.tz_convert('UTC').dt.tz_localize(None) \
+                .to_numpy('datetime64[ns]')
+        elif col.dtype == 'object':
+            kind = 'object'
+            files['npy'] = col.fillna('').to_numpy(str)
+            files['mask.npy'] = col.isna().to_numpy()
+        else:
+            kind = str(col.dtype)
+            files['npy'] = col.to_numpy()
+        for ext, values in files.items():
+            np.save(f'{path}/{generation}/{name}.{ext}', values)
+        tz = str(col.dt.tz) if kind == 'datetimetz' else None
+        schema.append({'name': name, 'kind': kind, 'tz': tz})
+        if kind == 'category':
+            schema[-1]['categories'] = col.cat.categories.tolist()
+    with open(f'{path}/{generation}/columns.json', 'w') as file:
+        json.dump(schema, file)
+    replace_file(f'{path}/CURRENT', generation.encode())
+    for entry in os.listdir(path):
+        if entry in [generation, previous, 'CURRENT']:
+            continue
+        elif os.path.isdir(f'{path}/{entry}'):
+            shutil.rmtree(f'{path}/{entry}', ignore_errors=True)
+        else:
+            # files written by older versions without generations
+            os.remove(f'{path}/{entry}')
+
+
+def replace_file(path: str, content: bytes):
+    """Writes a file atomically: the content is written to a temporary file
+    (unique per process and thread), which then replaces the file.
+
+    Args:
+        path (str): Path of the file.
+        content (bytes): New content of the file.
+    """
+    tmpPath = f'{path}.{os.getpid()}-{threading.get_ident()}.tmp'
+    with open(tmpPath, 'wb') as file:
+        file.write(content)
+    os.replace(tmpPath, path)
+
+
+@contextmanager
+def cache_lock():
+    """Holds the cache-wide advisory lock, an exclusive lock of cache/lock
+    (and a lock of the process for its threads). Must be held for every
+    read-modify-write of cached data, it is reentrant within a thread.
+    Readers do not need it.
+
+    Yields:
+        None
+    """
+    global g_cache_lock_file
+    with g_cache_lock:
+        outermost = g_cache_lock_file is None
+        if outermost:
+            os.makedirs(g_cache_path, exist_ok=True)
+            g_cache_lock_file = open(f'{g_cache_path}/lock', 'a')
+            if flock is not None:
+                flock(g_cache_lock_file, LOCK_EX)
+        try:
+            yield
+        finally:
+            if outermost:
+                if flock is not None:
+                    flock(g_cache_lock_file, LOCK_UN)
+                g_cache_lock_file.close()
+                g_cache_lock_file = None
+
+
+def main(argv: list = None):
+    """Command line interface of the crawler, e.g.
+    python -m teamproject.crawler backfill --from-season 2010 --archive
+    python -m teamproject.crawler reparse
+
+    Args:
+        argv (list): Command line arguments. Defaults to None (sys.argv).
+    """
+    global g_api_url, g_archive, g_client
+    parser = argparse.ArgumentParser(
+        description='Fetch openligadb data into the local cache.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    backfillParser = commands.add_parser(
+        'backfill', help='fetch all missing matchdays (resumable)')
+    backfillParser.add_argument('--from-season', type=int)
+    backfillParser.add_argument('--to-season', type=int)
+    backfillParser.add_argument('--divisions', nargs='+')
+    backfillParser.add_argument('--max-in-flight', type=int,
+                                help='concurrent requests')
+    backfillParser.add_argument('--rate', type=float,
+                                help='maximum number of requests per second')
+    backfillParser.add_argument('--api-url', help='e.g. a local stand-in')
+    backfillParser.add_argument('--archive', action='store_true',
+                                help='keep raw responses for reparse')
+    backfillParser.add_argument('--metrics',
+                                help='file to write Prometheus metrics to')
+    reparseParser = commands.add_parser(
+        'reparse', help='rebuild match data from archived responses')
+    reparseParser.add_argument('--seasons', type=int, nargs='+')
+    args = parser.parse_args(argv)
+    if args.command == 'reparse':
+        print(f'Rebuilt seasons: {reparse(args.seasons)}')
+        return  # exit
+    g_archive = g_archive or args.archive
+    if args.api_url:
+        g_api_url = args.api_url
+    if args.max_in_flight or args.rate:
+        g_client = Client(maxInFlight=args.max_in_flight, rate=args.rate)
+        atexit.register(g_client.close)
+    stats = backfill(args.from_season, args.to_season, args.divisions)
+    print(f"Stored {stats['done']} matchdays in {stats['seconds']:.1f} s")
+    if args.metrics:
+        g_metrics.dump(args.metrics)
+    if stats['failed']:
+        sys.exit(f"{stats['failed']} matchdays failed, run again to resume")
+
+
+if __name__ == '__main__':
+    main()
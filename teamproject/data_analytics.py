@@ -1,9 +1,11 @@
 # from crawler import get_data
-import matplotlib.pyplot as pp
 import numpy as n
 
 
 def main(data, homeClub, guestClub):
+    # imported on first use, since importing matplotlib takes long
+    import matplotlib.pyplot as pp
+
     # filePath = fetch_data(2009,180, 2021,140,'C:/Users/Philipp Wagner/Desktop/Python_Projekte/BundesligaML/teamproject/crawled_data/matches-2009-180-2021-140.json')
     fetchedMatches = data
     # fetchedMatches = get_data(2009, 180, 2021, 140)
@@ -1,7 +1,7 @@
 from teamproject.crawler import get_data
 from teamproject.models import BaselineAlgo
 from teamproject.models import PoissonRegression
-import pandas as pd
+import numpy as np
 
 
 def outcome2int(match) -> int:
@@ -13,10 +13,6 @@ def outcome2int(match) -> int:
         return 2
 
 
-def prediction2int(pred: list) -> int:
-    return pred.index(max(pred))
-
-
 train_data = get_data(2015, 1, 2015, 100)
 test_data = get_data(2016, 1, 2016, 10)
 
@@ -32,19 +28,13 @@ print(model_baseline.predict("a", "b"))
 
 model = model_poisson
 
-num_correct = 0
-num_incorrect = 0
-num_total = len(test_data)
-
-for index, row in test_data.iterrows():
-    # outcome2int(row)
+predictions = model.predict_many(test_data.homeTeamName.values,
+                                 test_data.guestTeamName.values)
+outcomes = [outcome2int(row) for row in test_data.itertuples()]
 
-    prediction = model.predict(row.homeClub, row.guestClub)
-
-    if outcome2int(row) == prediction2int(prediction):
-        num_correct += 1
-    else:
-        num_incorrect += 1
+num_total = len(test_data)
+num_correct = sum(np.argmax(predictions, axis=1) == outcomes)
+num_incorrect = num_total - num_correct
 
 # basline: 0.426, 0.573
 # poisson: 0.423, 0.576
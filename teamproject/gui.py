@@ -1,9 +1,8 @@
 import os
 import sys
-import requests.exceptions
-from teamproject import crawler, data_analytics, models
+from teamproject import crawler
 # from PyQt5 import QtCore, QtGui, QtWidgets
-from PyQt5.QtCore import Qt
+from PyQt5.QtCore import Qt, pyqtSignal
 from PyQt5.QtGui import QFont, QIcon, QKeySequence, QPixmap
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QMessageBox, QStyleFactory, QShortcut,
@@ -13,6 +12,9 @@ from PyQt5.QtWidgets import (
 
 
 class FuBaKI(QWidget):
+    # emitted by the crawler's thread when team icons have been fetched
+    iconsFetched = pyqtSignal()
+
     def __init__(self, parent=None):
         super(FuBaKI, self).__init__(parent)
         self.setWindowTitle('FuBaKI')
@@ -26,6 +28,7 @@ class FuBaKI(QWidget):
     def init_elements(self):
         self.shortcutCloseWindow = QShortcut(QKeySequence('Ctrl+W'), self)
         self.shortcutCloseWindow.activated.connect(self.close)
+        self.iconsFetched.connect(self.refresh_teamicons)
 
         self.selectAlgoLabel = QLabel('Select the desired algorithm:')
         self.selectAlgo = QComboBox()
@@ -353,7 +356,7 @@ class FuBaKI(QWidget):
             QMessageBox.warning(self, 'Invalid interval', message)
         else:
             self.matchdata = crawler.get_data(fromSeason, fromDay, toSeason, toDay, forceUpdate)
-            self.teamdata = crawler.get_teams(self.matchdata)
+            self.teamdata = crawler.get_teams(self.matchdata, self.iconsFetched.emit)
             teamList = self.teamdata.to_dict('records')
             for team in teamList:
                 self.selectHomeTeam.addItem(team['name'], team['ID'])
@@ -365,6 +368,9 @@ class FuBaKI(QWidget):
     def trainingcall(self):
         """Train chosen algorithm on the basis of selected time interval.
         """
+        # imported on first use, which accelerates startup time of the GUI
+        from teamproject import models
+
         algo = self.selectAlgo.currentData()
         if algo is None:
             message = 'Please select an algorithm.'
@@ -426,6 +432,16 @@ class FuBaKI(QWidget):
             self.predictLabel.setText('')
             self.predict_result()
 
+    def refresh_teamicons(self):
+        """Display the icons of the selected teams again, once they have been fetched.
+        """
+        homeTeamID = self.selectHomeTeam.currentData()
+        guestTeamID = self.selectGuestTeam.currentData()
+        if homeTeamID is not None:
+            self.homeIcon.setPixmap(self.display_teamicon(homeTeamID))
+        if guestTeamID is not None:
+            self.guestIcon.setPixmap(self.display_teamicon(guestTeamID))
+
     def display_teamicon(self, team: int) -> QPixmap:
         """Display the icon of the home team selected for prediction.
 
@@ -438,18 +454,12 @@ class FuBaKI(QWidget):
         """
         self.colon.setText(':')
         iconURL = self.teamdata.loc[self.teamdata['ID'] == team, 'icon'].values[0]
-        iconExtension = iconURL.split('.')[-1]
-        iconPath = f'{crawler.g_cache_path}/teamicon.{iconExtension}'
-        try:
-            response = requests.get(iconURL, stream=True, headers={'User-agent': 'Mozilla/5.0'})
-            response.raise_for_status()
-        except (requests.exceptions.HTTPError, requests.exceptions.Timeout,
-                requests.exceptions.ConnectionError):
+        # icons are prefetched by crawler.get_teams(), until then the dummy icon is shown
+        iconPath = crawler.load_teamicon(team, iconURL)
+        if iconPath is None:
             absPath = os.path.dirname(os.path.abspath(__file__))
             pixmap = QPixmap(f'{absPath}/none.svg')
         else:
-            with open(iconPath, 'wb') as imageFile:
-                imageFile.writelines(response.iter_content(1024))
             pixmap = QPixmap(iconPath)
         pixmap = pixmap.scaled(150, 150, Qt.KeepAspectRatio, transformMode=Qt.SmoothTransformation)
         pixmap.setDevicePixelRatio(2.0)
@@ -466,6 +476,8 @@ class FuBaKI(QWidget):
         elif homeTeamID == guestTeamID:
             QMessageBox.warning(self, 'Invalid Teams', 'Please select different home and guest teams.')
             return  # exit
+        from teamproject import data_analytics
+
         homeTeamName = self.selectHomeTeam.currentText()
         guestTeamName = self.selectGuestTeam.currentText()
         data_analytics.main(self.matchdata, homeTeamName, guestTeamName)
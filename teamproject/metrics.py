@@ -0,0 +1,209 @@
+"""
+This module contains an in-memory registry of counters and histograms, which
+the crawler reports to (see crawler.g_metrics). The registry can be rendered
+in the Prometheus text format, e.g. to a file read by the node exporter.
+
+To use:
+>>> registry = Registry()
+>>> registry.inc('crawler_requests_total', action='getmatchdata')
+>>> registry.observe('crawler_request_seconds', 0.12, action='getmatchdata')
+>>> registry.dump('crawler.prom')
+
+Any object with the methods inc() and observe() can be used as sink instead.
+"""
+import bisect
+import os
+import threading
+
+
+g_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Registry:
+    """A thread-safe registry of counters and histograms, each identified by
+    a metric name and labels.
+
+    Attributes:
+        buckets: Upper bounds of histogram buckets (in ascending order).
+        counters: A dictionary mapping (name, labels) to the counter value.
+        histograms: A dictionary mapping (name, labels) to a list of bucket
+                    counts, sum and count of observed values.
+    """
+
+    def __init__(self, buckets: tuple = g_buckets):
+        """Inits an empty Registry.
+
+        Args:
+            buckets (tuple): Upper bounds of histogram buckets. Defaults to
+                             g_buckets (suitable for seconds).
+        """
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Increases a counter.
+
+        Args:
+            name (str): Name of the counter, e.g. 'crawler_requests_total'.
+            value (float): Increment. Defaults to 1.
+            **labels: Labels of the counter, e.g. action='getmatchdata'.
+        """
+        key = make_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Adds a value to a histogram.
+
+        Args:
+            name (str): Name of the histogram, e.g. 'crawler_request_seconds'.
+            value (float): Observed value.
+            **labels: Labels of the histogram.
+        """
+        key = make_key(name, labels)
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * len(self.buckets), 0, 0]
+            histogram = self.histograms[key]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def get(self, name: str, **labels) -> float:
+        """Looks up a counter or the number of values of a histogram.
+
+        Args:
+            name (str): Name of the metric.
+            **labels: Labels of the metric.
+
+        Returns:
+            The counter value or number of observed values (0 if unknown).
+        """
+        key = make_key(name, labels)
+        with self.lock:
+            if key in self.histograms:
+                return self.histograms[key][2]
+            return self.counters.get(key, 0)
+
+    def quantile(self, name: str, q: float, **labels) -> float:
+        """Estimates a quantile of a histogram (as upper bound of the bucket
+        containing it).
+
+        Args:
+            name (str): Name of the histogram.
+            q (float): The quantile, e.g. 0.99.
+            **labels: Labels of the histogram.
+
+        Returns:
+            The upper bound of the bucket (inf if beyond the last bucket) or
+            None if no values have been observed.
+        """
+        key = make_key(name, labels)
+        with self.lock:
+            if key not in self.histograms or not self.histograms[key][2]:
+                return None
+            counts, _, count = self.histograms[key]
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets, counts):
+                cumulative += bucketCount
+                if cumulative >= q * count:
+                    return bound
+        return float('inf')
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text format.
+
+        Returns:
+            The metrics, one sample per line.
+        """
+        lines = []
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, [list(val[0]), val[1], val[2]])
+                                for key, val in self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f'# TYPE {name} counter')
+                typed.add(name)
+            lines.append(f'{name}{format_labels(labels)} {value:g}')
+        for (name, labels), (counts, total, count) in histograms:
+            if name not in typed:
+                lines.append(f'# TYPE {name} histogram')
+                typed.add(name)
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets, counts):
+                cumulative += bucketCount
+                le = format_labels(labels + (('le', f'{bound:g}'),))
+                lines.append(f'{name}_bucket{le} {cumulative}')
+            le = format_labels(labels + (('le', '+Inf'),))
+            lines.append(f'{name}_bucket{le} {count}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total:g}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, path: str):
+        """Writes all metrics in the Prometheus text format to a file. The
+        file is replaced atomically, so it can be scraped at any time.
+
+        Args:
+            path (str): Path of the file, e.g. 'crawler.prom'.
+        """
+        tmpPath = f'{path}.{os.getpid()}.tmp'
+        with open(tmpPath, 'w') as file:
+            file.write(self.render())
+        os.replace(tmpPath, path)
+
+    def clear(self):
+        """Removes all metrics.
+        """
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+def make_key(name: str, labels: dict) -> tuple:
+    """Identifies a metric. Label values are converted to strings, so that
+    e.g. status=200 and status='error' can be sorted together.
+
+    Args:
+        name (str): Name of the metric.
+        labels (dict): Labels of the metric.
+
+    Returns:
+        A tuple of the name and the sorted pairs of label name and value.
+    """
+    return name, tuple(sorted((label, str(value))
+                              for label, value in labels.items()))
+
+
+def format_labels(labels: tuple) -> str:
+    """Formats labels of a sample in the Prometheus text format.
+
+    Args:
+        labels (tuple): Pairs of label name and value.
+
+    Returns:
+        The labels in braces (or an empty string if there are no labels).
+    """
+    if not labels:
+        return ''
+    values = [f'{name}="{escape(str(value))}"' for name, value in labels]
+    return '{' + ','.join(values) + '}'
+
+
+def escape(value: str) -> str:
+    """Escapes a label value for the Prometheus text format.
+
+    Args:
+        value (str): The label value.
+
+    Returns:
+        The escaped value.
+    """
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
@@ -1,201 +1,342 @@
 """
-This module contains code for prediction models.
+This module contains code for prediction models. scipy is imported by the
+models using it, since importing it takes long.
 """
-from scipy.stats import poisson
+import functools
 import pandas as pd
 import numpy as np
-import statsmodels.api as sm
-import statsmodels.formula.api as smf
-from scipy.optimize import minimize
 
 
 class BaselineAlgo:
     """A model that predicts the winner based on the outcome of past games between
        the 2 teams.
+
     To use:
     >>> model = BaselineAlgo(df)
     >>> model.predict("Team1", "Team2")
     [0.6, 0.2, 0.2]
+    >>> model.predict_many(["Team1", "Team2"], ["Team2", "Team1"])
+    array([[0.6, 0.2, 0.2],
+           [0.2, 0.2, 0.6]])
+
     Attributes:
         df: A pandas Dataframe containig the matches to consider for predictions
+        teams: The sorted names of all teams in df
+        wins: A matrix containing the number of wins of a team (row) against another team (column)
+        draws: A symmetric matrix containing the number of draws between two teams
     """
 
     def __init__(self, df):
         """Inits BaselineAlgo with the given Dataframe
+
         Args:
             df: A pandas Dataframe containig the matches to consider for predictions
         """
         self.df = df
 
+        # count the results between each pair of teams
+        self.teams = np.unique(np.concatenate((df.homeTeamName.values, df.guestTeamName.values)))
+        home = np.searchsorted(self.teams, df.homeTeamName.values)
+        guest = np.searchsorted(self.teams, df.guestTeamName.values)
+        homeScore = df.homeScore.to_numpy(dtype=float, na_value=np.nan)
+        guestScore = df.guestScore.to_numpy(dtype=float, na_value=np.nan)
+        # leave out matches that are not finished
+        finished = ~np.isnan(homeScore) & ~np.isnan(guestScore)
+        home, guest = home[finished], guest[finished]
+        homeScore, guestScore = homeScore[finished], guestScore[finished]
+
+        nTeams = len(self.teams)
+        self.wins = np.zeros((nTeams, nTeams))
+        np.add.at(self.wins, (home, guest), homeScore > guestScore)
+        np.add.at(self.wins, (guest, home), homeScore < guestScore)
+        self.draws = np.zeros((nTeams, nTeams))
+        np.add.at(self.draws, (home, guest), homeScore == guestScore)
+        np.add.at(self.draws, (guest, home), homeScore == guestScore)
+
+        # average home winrate, draw probability and average guest winrate
+        self.averages = np.array([np.sum(homeScore > guestScore), np.sum(homeScore == guestScore),
+                                  np.sum(homeScore < guestScore)]) / max(len(homeScore), 1)
+
     def predict(self, homeTeam: str, guestTeam: str) -> list:
         """Predicts the winner between homeTeam and guestTeam based on
            past matches between them
+
         Args:
             homeTeam (str): Name of the home team
             guestTeam (str): Name of the guest team
+
         Returns:
             A list containig the probabilties for the homeTeam winning, a draw
             and the guestTeam winning in that order
         """
-        df = self.df
-
-        # get matches between the two given teams
-        team1 = df.homeTeamName.values
-        team2 = df.guestTeamName.values
-
-        matches = df[((team1 == homeTeam) & (team2 == guestTeam)) |
-                     ((team1 == guestTeam) & (team2 == homeTeam))]
-
-        # if no matches exist: return average home winrate, average guest winrate and draw probability
-        if len(matches) == 0:
-            homeScore = df.homeScore.values
-            guestScore = df.guestScore.values
-
-            winsHomeTeamTotal = np.sum(homeScore > guestScore)
-            winsGuestTeamTotal = np.sum(homeScore < guestScore)
-            drawsTotal = np.sum(homeScore == guestScore)
-
-            # returns probability for each of the 3 events in a list
-            return [winsHomeTeamTotal / len(df), drawsTotal / len(df), winsGuestTeamTotal / len(df)]
-
-        # if matches exist: collect results in matches between them
-        homeClub = matches.homeTeamName.values
-        guestClub = matches.guestTeamName.values
-
-        homeScore = matches.homeScore.values
-        guestScore = matches.guestScore.values
-
-        winsHomeTeam = np.sum((homeScore > guestScore) & (homeClub == homeTeam) |
-                              (homeScore < guestScore) & (guestClub == homeTeam))
-
-        winsGuestTeam = np.sum((homeScore > guestScore) & (homeClub == guestTeam) |
-                               (homeScore < guestScore) & (guestClub == guestTeam))
-
-        draws = np.sum(matches['homeScore'] == matches['guestScore'])
-
-        # returns probability for each of the 3 events in a list
-        return [winsHomeTeam / len(matches), draws / len(matches), winsGuestTeam / len(matches)]
-
-
-
+        return self.predict_many([homeTeam], [guestTeam])[0].tolist()
 
+    def predict_many(self, homeTeams, guestTeams) -> np.ndarray:
+        """Predicts the winners of many matches based on past matches between the teams
 
+        Args:
+            homeTeams (array of str or int): Names of the home teams (or their indices in self.teams)
+            guestTeams (array of str or int): Names of the guest teams (or their indices in self.teams)
 
+        Returns:
+            An array containing a row per match with the probabilties for the homeTeam winning,
+            a draw and the guestTeam winning in that order
+        """
+        home = team_codes(self.teams, homeTeams)
+        guest = team_codes(self.teams, guestTeams)
+        known = (home >= 0) & (guest >= 0)
+        home, guest = np.where(known, home, 0), np.where(known, guest, 0)
 
+        wins = self.wins[home, guest]
+        losses = self.wins[guest, home]
+        draws = self.draws[home, guest]
+        games = np.where(known, wins + losses + draws, 0)
 
+        # if no matches exist: return average home winrate, draw probability and average guest winrate
+        probabilities = np.tile(self.averages, (len(home), 1))
+        played = games > 0
+        probabilities[played] = np.stack((wins, draws, losses), axis=1)[played] / games[played, None]
+        return probabilities
 
 
 class PoissonRegression:
     """A model that predicts the winner based on fitting a poisson distribution
        for both playing teams to estimate the probabilty for each possible outcome
        score.
+
     To use:
     >> model = PoissonRegression(df)
     >> model.predict("Team1", "Team2")
     [0.6, 0.2, 0.2]
+
     Attributes:
-        goalModelData: A pandas dataframe containig the matches to consider for predictions
-        poissonModel: The model for predicting the probability for x goals in a mach
-        between the team and an opponent
+        teamIndex: A dictionary mapping the names of the teams to their index in attack and defence
+        intercept, homeAdv: The coefficients of the poisson regression of the goals of a team
+        (log expected goals of the guest team and the additional log goals of the home team)
+        attack, defence: Arrays containing the coefficients of each team as team and as
+        opponent (0 for the first team)
+        probabilities: A dictionary mapping maxGoals to the probabilities of the outcomes between
+        all teams and if a team is unknown (computed on first use, see pair_probabilities)
     """
 
     def __init__(self, df):
         """Inits PoissonRegression with the given Dataframe
+
         Args:
             df: A pandas Dataframe containig the matches to consider for predictions
         """
         self.df = df
         self.teams = np.unique(self.df['guestTeamName'])
 
-        self.goalModelData = pd.concat([df[['homeTeamName', 'guestTeamName', 'homeScore']].assign(home=1).rename(
-            columns={'homeTeamName': 'team', 'guestTeamName': 'opponent', 'homeScore': 'goals'}),
-            df[['guestTeamName', 'homeTeamName', 'guestScore']].assign(home=0).rename(
-                columns={'guestTeamName': 'team', 'homeTeamName': 'opponent', 'guestScore': 'goals'})])
+        # one row per team and match: goals ~ home + team + opponent
+        codes, teams = pd.factorize(np.concatenate((df.homeTeamName.values, df.guestTeamName.values)),
+                                    sort=True)
+        homeCodes, guestCodes = np.split(codes, 2)
+        goals = np.concatenate((df.homeScore.to_numpy(dtype=float, na_value=np.nan),
+                                df.guestScore.to_numpy(dtype=float, na_value=np.nan)))
+        team = np.concatenate((homeCodes, guestCodes))
+        opponent = np.concatenate((guestCodes, homeCodes))
+        home = np.repeat([1.0, 0.0], len(df))
+        # leave out matches that are not finished
+        finished = ~np.isnan(goals)
+
+        design = design_matrix(team[finished], opponent[finished], home[finished], len(teams))
+        coefs = fit_poisson_glm(design, goals[finished])
 
-        self.poissonModel = smf.glm(formula="goals ~ home + team + opponent", data=self.goalModelData,
-                                    family=sm.families.Poisson()).fit()
+        nTeams = len(teams)
+        self.teamIndex = dict(zip(teams, range(nTeams)))
+        self.intercept, self.homeAdv = coefs[:2]
+        self.attack = np.concatenate(([0], coefs[2:nTeams + 1]))
+        self.defence = np.concatenate(([0], coefs[nTeams + 1:]))
+        # index of the coefficients of each team in self.teams
+        self.teamCodes = np.array([self.teamIndex[team] for team in self.teams], dtype=int)
+        self.probabilities = {}
 
     def predict(self, homeTeam: str, guestTeam: str, maxGoals=10) -> list:
         """Predicts the winner between homeTeam and guestTeam based on
            the poisson distributions over their expected goal amount
+
         Args:
             homeTeam (str): Name of the home team
             guestTeam (str): Name of the guest team
-            maxGoals (int): max amount of goals per team to consider
+            maxGoals (int): max amount of goals per team to consider (None: exact probabilities)
+
         Returns:
             A list containig the probabilties for the homeTeam winning, a draw
             and the guestTeam winning in that order
         """
-        model = self.poissonModel
-
-        if homeTeam in self.teams and guestTeam in self.teams:
-            homeGoalsAvg = model.predict(pd.DataFrame(data={'team': homeTeam,
-                                                            'opponent': guestTeam, 'home': 1},
-                                                      index=[1])).values[0]
-            awayGoalsAvg = model.predict(pd.DataFrame(data={'team': guestTeam,
-                                                            'opponent': homeTeam, 'home': 0},
-                                                      index=[1])).values[0]
-        else:
-            # if one team is unknown, assume avg home and away goals
-            homeGoalsAvg = sum(self.df['homeScore']) / len(self.df['homeScore'])
-            awayGoalsAvg = sum(self.df['guestScore']) / len(self.df['guestScore'])
-
-        teamPred = [[poisson.pmf(i, teamAvg) for i in range(0, maxGoals + 1)] for teamAvg in
-                    [homeGoalsAvg, awayGoalsAvg]]
-        resultMatrix = np.outer(np.array(teamPred[0]), np.array(teamPred[1]))
-
-        homeTeamWin = np.sum(np.tril(resultMatrix, -1))
-        guestTeamWin = np.sum(np.triu(resultMatrix, 1))
-        draw = np.sum(np.diag(resultMatrix))
-        print([homeTeamWin, draw, guestTeamWin])
-        return [homeTeamWin, draw, guestTeamWin]
+        return self.predict_many([homeTeam], [guestTeam], maxGoals)[0].tolist()
 
+    def predict_many(self, homeTeams, guestTeams, maxGoals=10) -> np.ndarray:
+        """Predicts the winners of many matches based on the poisson distributions over the
+           expected goal amounts of the teams
 
+        Args:
+            homeTeams (array of str or int): Names of the home teams (or their indices in self.teams)
+            guestTeams (array of str or int): Names of the guest teams (or their indices in self.teams)
+            maxGoals (int): max amount of goals per team to consider (None: exact probabilities)
 
+        Returns:
+            An array containing a row per match with the probabilties for the homeTeam winning,
+            a draw and the guestTeam winning in that order
+        """
+        pairs = self.pair_probabilities(maxGoals)
+        return pair_lookup(pairs, team_codes(self.teams, homeTeams), team_codes(self.teams, guestTeams),
+                           self.probabilities[maxGoals][1])
 
+    def expected_goals(self) -> tuple:
+        """Computes the expected goals of all matches between the teams
 
+        Returns:
+            A tuple of two matrices containing the expected goals of the home team (row) and the
+            guest team (column) for each pair of teams in self.teams
+        """
+        attack = self.attack[self.teamCodes]
+        defence = self.defence[self.teamCodes]
+        return (np.exp(self.intercept + self.homeAdv + attack[:, None] + defence[None, :]),
+                np.exp(self.intercept + defence[:, None] + attack[None, :]))
 
+    def pair_probabilities(self, maxGoals=10) -> np.ndarray:
+        """Computes the probabilities of the outcomes of all matches between the teams once, later
+           calls look them up
 
+        Args:
+            maxGoals (int): max amount of goals per team to consider (None: exact probabilities)
 
+        Returns:
+            An array of shape (nTeams, nTeams, 3) containing the probabilties for the home team (row)
+            winning, a draw and the guest team (column) winning for each pair of teams in self.teams
+        """
+        if maxGoals not in self.probabilities:
+            homeGoalsAvg, awayGoalsAvg = self.expected_goals()
+            pairs = outcome_probabilities(homeGoalsAvg.ravel(), awayGoalsAvg.ravel(), maxGoals)
+            # if one team is unknown, assume avg home and away goals
+            homeAvg, guestAvg = average_goals(self.df)
+            averages = outcome_probabilities([homeAvg], [guestAvg], maxGoals)[0]
+            self.probabilities[maxGoals] = (pairs.reshape(len(self.teams), len(self.teams), 3), averages)
+        return self.probabilities[maxGoals][0]
 
 
 class DixonColes:
     """Basicly Poisson Regression but with fixing for misscalculating the draw propbability
        and weighing games closer to present higher.
+
     To use:
     >>> model = DixonColes(df)
     >>> model.predict_winner("Team1", "Team2")
     [0.6, 0.2, 0.2]
+    >>> model.update(nextMatchday)  # refit starting from the current parameters
 
     Attributes:
     df: A pandas Dataframe containig the matches to consider for predictions and their dates
+    arrays: A dictionary containing the arrays the likelihood is evaluated on (see match_arrays)
+    params: A dictionary containing the fitted parameters
+    probabilities: A dictionary mapping maxGoals to the probabilities of the outcomes between all
+    teams and if a team is unknown (computed on first use and discarded by a refit, see
+    pair_probabilities)
 
     """
 
     def __init__(self, df, xi=0.0018):
         """Inits DixonColes with the given Dataframe
+
         Args:
             df: A pandas Dataframe containig the matches to consider for predictions
+            xi (float): factor for the timedecay in the weighing
         """
         self.xi = xi
         # TODO: how to set xi?
-        self.df = df
-        self.teams = np.unique(self.df['guestTeamName'])
+        self.fit(df)
+
+    def fit(self, df, initVals=None):
+        """Fits the parameters to the given Dataframe
+
+        Args:
+            df: A pandas Dataframe containig the matches to consider for predictions
+            initVals (array of float): initial attack and defend values for each team as well as
+                                       rho and gamma. Defaults to None (random values)
+        """
+        teams = np.unique(df['guestTeamName'])
 
         # add column containing the time difference to the newest game
-        maxTime = max(pd.to_datetime(self.df.datetime.values))
-        self.df['time_dif'] = (maxTime - pd.to_datetime(self.df.datetime.values)).days
+        maxTime = max(pd.to_datetime(df.datetime.values))
+        df['time_dif'] = (maxTime - pd.to_datetime(df.datetime.values)).days
 
-        self.params = self.solve_parameters(self.df, self.xi)
+        arrays = self.match_arrays(df, teams, self.xi)
+        params = self.solve_parameters(df, self.xi, initVals, arrays=arrays)
+        # the model only changes if the parameters could be fitted
+        self.df, self.teams, self.maxTime, self.arrays, self.params = df, teams, maxTime, arrays, params
+        self.probabilities = {}
+
+    def refit(self, df):
+        """Fits the parameters to another window of matches, starting from the current parameters.
+           Teams that are new in the window start with average values
+
+        Args:
+            df: A pandas Dataframe containig the matches to consider for predictions
+        """
+        self.fit(df, self.initial_values(np.unique(df['guestTeamName'])))
+
+    def update(self, newMatches):
+        """Adds matches (e.g. of the last matchday) and refits the parameters, starting from the
+           current parameters. The time differences of the previous matches are shifted instead of
+           being recomputed
+
+        Args:
+            newMatches: A pandas Dataframe containig the matches to add
+        """
+        newMatches = newMatches.copy()
+        datetimes = pd.to_datetime(newMatches.datetime.values)
+        maxTime = max(self.maxTime, max(datetimes))
+        shift = (maxTime - self.maxTime).days
+        newMatches['time_dif'] = (maxTime - datetimes).days
+
+        teams = np.union1d(self.teams, newMatches['guestTeamName'])
+        newArrays = self.match_arrays(newMatches, teams, self.xi)
+        arrays = dict(self.arrays)
+        # the weights of all previous matches decay by the same factor
+        arrays['weights'] = arrays['weights'] * np.exp(-self.xi * shift)
+        if len(teams) != len(self.teams):
+            arrays['home'] = np.searchsorted(teams, self.teams[arrays['home']])
+            arrays['away'] = np.searchsorted(teams, self.teams[arrays['away']])
+        for key in newArrays:
+            offset = len(self.arrays['home']) if key.startswith('low') else 0
+            arrays[key] = np.concatenate((arrays[key], newArrays[key] + offset))
+
+        df = pd.concat([self.df.assign(time_dif=self.df['time_dif'] + shift), newMatches],
+                       ignore_index=True)
+        params = self.solve_parameters(df, self.xi, self.initial_values(teams), arrays=arrays)
+        # the model only changes if the parameters could be fitted
+        self.df, self.teams, self.maxTime, self.arrays, self.params = df, teams, maxTime, arrays, params
+        self.probabilities = {}
+
+    def initial_values(self, teams):
+        """maps the current parameters onto the given teams, e.g. to start a refit from them
+
+        Args:
+            teams (array of string): sorted names of teams
+
+        Returns:
+            an array of the attack and defend values for each team as well as rho and gamma,
+            teams without parameters get the average values
+        """
+        attack = [self.params['attack_' + team] for team in self.teams]
+        defence = [self.params['defence_' + team] for team in self.teams]
+        return np.concatenate((
+            [self.params.get('attack_' + team, np.mean(attack)) for team in teams],
+            [self.params.get('defence_' + team, np.mean(defence)) for team in teams],
+            [self.params['rho'], self.params['home_adv']]))
 
     def rho_correction(self, x, y, lambda_x, mu_y, rho):
         """function to reweigh the probability for the low score outcome games
+
         Args:
             x (array of int): #goals homeTeam
             y (array of int): #goals guestTeam
             lambda_x (float): term from calculating the nomal PR model
             mu_y (float): term from calculating the nomal PR model
             rho (float): term to determine magnitude of correction
+
         Returns:
             an array of floats representing the factors with which to multipiply the old propability
             in the PR model
@@ -217,66 +358,165 @@ class DixonColes:
                 1
             ])
 
-    def dc_log_like_decay(self, x, y, alpha_x, beta_x, alpha_y, beta_y, rho, gamma, t, xi):
-        """helper function for fitting the Poisson distrubituion manually
-        Args:
-            x (int): #goals homeTeam
-            y (int): #goals guestTeam
-            alpha_x, beta_x, alpha_y, beta_y, (float): terms from calculating the nomal PR model
-            rho, gamma (float) : values from the minimize function
-            t (array of int): days between latest timestamp in data and current
-            xi : factor for the timedecay in the weighing
-        Returns:
-            an array of floats representing the log likelihoods of observing the score under the
-            distribution described by the given parameters
-        """
-        lambda_x, mu_y = np.exp(alpha_x + beta_y + gamma), np.exp(alpha_y + beta_x)
-        return np.exp(-xi*t) * (np.log(self.rho_correction(x, y, lambda_x, mu_y, rho)) +
-                                np.log(poisson.pmf(x, lambda_x)) + np.log(poisson.pmf(y, mu_y)))
+    def match_arrays(self, dataset, teams, xi) -> dict:
+        """precomputes the arrays the likelihood is evaluated on, so that every
+           evaluation only consists of vectorized operations
 
-    def estimate_paramters(self, params, teams, dataset, nTeams, homeGoals, awayGoals, xi):
-        """function to estimate how good the current parameters describe the df
         Args:
-            params (dict): contains attack and defend values for each team as well as rho and gamma
-            teams (list of string): name of teams
             dataset (pd.dataFrame): the current df
-            n_teams : #teams
-            home_goals, away_goals (int): #goals for both teams
+            teams (array of string): sorted names of teams
             xi : factor for the timedecay in the weighing
+
         Returns:
+            a dictionary with the team indices and goals of both teams, the weights of the
+            matches, the constant log factorial terms and the indices of the low score matches
+            (unfinished matches are left out)
         """
-        scoreCoefs = dict(zip(teams, params[:nTeams]))
-        defendCoefs = dict(zip(teams, params[nTeams:(2 * nTeams)]))
+        homeGoals = dataset.homeScore.to_numpy(dtype=float, na_value=np.nan)
+        awayGoals = dataset.guestScore.to_numpy(dtype=float, na_value=np.nan)
+        finished = ~np.isnan(homeGoals) & ~np.isnan(awayGoals)
+        homeGoals = homeGoals[finished].astype(int)
+        awayGoals = awayGoals[finished].astype(int)
+        logFactorials = log_factorials(int(max(homeGoals.max(initial=0), awayGoals.max(initial=0))))
+        arrays = {'home': np.searchsorted(teams, dataset.homeTeamName.values[finished]),
+                  'away': np.searchsorted(teams, dataset.guestTeamName.values[finished]),
+                  'homeGoals': homeGoals,
+                  'awayGoals': awayGoals,
+                  'weights': np.exp(-xi * dataset.time_dif.to_numpy(dtype=float)[finished]),
+                  'logFactorials': logFactorials[homeGoals] + logFactorials[awayGoals]}
+        # the rho correction only applies to the scores 0:0, 0:1, 1:0 and 1:1
+        for x in range(2):
+            for y in range(2):
+                arrays[f'low{x}{y}'] = np.flatnonzero((homeGoals == x) & (awayGoals == y))
+        return arrays
+
+    def estimate_paramters(self, params, nTeams, arrays, gradient=False):
+        """function to estimate how good the current parameters describe the df
 
-        scoreCoefsHomeTeam = np.array([scoreCoefs[team] for team in dataset.homeTeamName.values])
-        defendCoefsHomeTeam = np.array([defendCoefs[team] for team in dataset.homeTeamName.values])
-        scoreCoefsAwayTeam = np.array([scoreCoefs[team] for team in dataset.guestTeamName.values])
-        defendCoefsAwayTeam = np.array([defendCoefs[team] for team in dataset.guestTeamName.values])
+        Args:
+            params (array of float): attack and defend values for each team as well as rho and gamma
+            nTeams : #teams
+            arrays (dict): the arrays computed by match_arrays
+            gradient (bool): whether to return the gradient as well
 
+        Returns:
+            the negative weighted log likelihood of the matches (and its gradient with respect to
+            params if gradient is True)
+        """
+        attack = params[:nTeams]
+        defence = params[nTeams:(2 * nTeams)]
         rho, gamma = params[-2:]
-        rho = np.repeat(rho, len(homeGoals))
-        gamma = np.repeat(gamma, len(homeGoals))
+        home, away = arrays['home'], arrays['away']
+
+        logLambda = attack[home] + defence[away] + gamma
+        logMu = attack[away] + defence[home]
+        lambdaX, muY = np.exp(logLambda), np.exp(logMu)
+
+        # closed form of the log pmf of both poisson distributions
+        logLike = (arrays['homeGoals'] * logLambda - lambdaX + arrays['awayGoals'] * logMu - muY
+                   - arrays['logFactorials'])
+
+        weights = arrays['weights']
+        low00, low01, low10, low11 = (arrays['low00'], arrays['low01'],
+                                      arrays['low10'], arrays['low11'])
+        factor00 = 1 - lambdaX[low00] * muY[low00] * rho
+        factor01 = 1 + lambdaX[low01] * rho
+        factor10 = 1 + muY[low10] * rho
+        factor11 = 1 - rho
+        if min(factor00.min(initial=1), factor01.min(initial=1), factor10.min(initial=1)) <= 0 or \
+                (len(low11) and factor11 <= 0):
+            # rho is out of range (see rho_bounds), the corrected probabilities would be negative
+            return (np.inf, np.zeros_like(params)) if gradient else np.inf
+        correction = (weights[low00] @ np.log(factor00)
+                      + weights[low01] @ np.log(factor01)
+                      + weights[low10] @ np.log(factor10)
+                      + weights[low11].sum() * np.log(factor11))
+        value = -(weights @ logLike + correction)
+        if not gradient:
+            return value
+
+        # derivatives of the weighted log likelihood of each match with respect to the
+        # logarithms of the expected goals
+        dLambda = arrays['homeGoals'] - lambdaX
+        dMu = arrays['awayGoals'] - muY
+        dLambda[low00] -= lambdaX[low00] * muY[low00] * rho / factor00
+        dMu[low00] -= lambdaX[low00] * muY[low00] * rho / factor00
+        dLambda[low01] += lambdaX[low01] * rho / factor01
+        dMu[low10] += muY[low10] * rho / factor10
+        dLambda *= weights
+        dMu *= weights
+        dRho = (-weights[low00] @ (lambdaX[low00] * muY[low00] / factor00)
+                + weights[low01] @ (lambdaX[low01] / factor01)
+                + weights[low10] @ (muY[low10] / factor10)
+                - weights[low11].sum() / factor11)
+
+        grad = np.concatenate((
+            np.bincount(home, dLambda, nTeams) + np.bincount(away, dMu, nTeams),  # attack
+            np.bincount(away, dLambda, nTeams) + np.bincount(home, dMu, nTeams),  # defence
+            [dRho, dLambda.sum()]))
+        return value, -grad
+
+    def rho_bounds(self, params, nTeams, arrays):
+        """computes the interval of rho for which the corrected probabilities of the low scores
+           are positive, given the other parameters
 
-        timeDifs = dataset.time_dif.values
+        Args:
+            params (array of float): attack and defend values for each team as well as rho and gamma
+            nTeams : #teams
+            arrays (dict): the arrays computed by match_arrays
+
+        Returns:
+            a tuple of the lower bound (< 0) and the upper bound (> 0) of rho
+        """
+        attack = params[:nTeams]
+        defence = params[nTeams:(2 * nTeams)]
+        gamma = params[-1]
+        home, away = arrays['home'], arrays['away']
+        lambdaX = np.exp(attack[home] + defence[away] + gamma)
+        muY = np.exp(attack[away] + defence[home])
+        low00, low01, low10 = arrays['low00'], arrays['low01'], arrays['low10']
+        lower = -1 / max(lambdaX[low01].max(initial=0), muY[low10].max(initial=0), 1e-300)
+        upper = 1 / max((lambdaX[low00] * muY[low00]).max(initial=0), 1 if len(arrays['low11']) else 0, 1e-300)
+        return lower, upper
+
+    def expand_parameters(self, free, nTeams):
+        """computes all parameters from the parameters that are optimized. The attack value
+           of the last team is determined by the others, so that the attack values sum up to
+           nTeams (otherwise the parameters would not be identifiable)
 
-        logLike = self.dc_log_like_decay(homeGoals, awayGoals, scoreCoefsHomeTeam, defendCoefsHomeTeam,
-                                         scoreCoefsAwayTeam, defendCoefsAwayTeam, rho, gamma, timeDifs, xi)
+        Args:
+            free (array of float): attack values of all teams but the last, defend values of all
+                                   teams as well as rho and gamma
+            nTeams : #teams
 
-        return -sum(logLike)
+        Returns:
+            an array of the attack and defend values for each team as well as rho and gamma
+        """
+        return np.insert(free, nTeams - 1, nTeams - free[:nTeams - 1].sum())
 
-    def solve_parameters(self, dataset, xi, initVals=None, options={'disp': True, 'maxiter': 100},
-                         constraints=[{'type': 'eq', 'fun': lambda x: sum(x[:20])-20}], **kwargs):
+    def solve_parameters(self, dataset, xi, initVals=None, options={'maxiter': 1000}, arrays=None,
+                         **kwargs):
         """tries to approximate the best parameters to fit the function
            basicly like PR but with the two fixes
+
         Args:
-            init_vals (dict): contains attack and defend values for each team as well as rho and gamma
-            options (dict): contains max interations the minize algo should perform and whether info should be printed
             dataset (pd.dataFrame): the current df
-            constraints (dict): contrains for running the minimize
-            **kwargs (): no clue what this is lol
+            xi (float): factor for the timedecay in the weighing
+            initVals (array of float): attack and defend values for each team as well as rho and
+                                       gamma to start from (random values if None)
+            options (dict): contains max interations the minize algo should perform
+            arrays (dict): the arrays computed by match_arrays (computed if None)
+            **kwargs: further arguments of scipy.optimize.minimize, e.g. method
+
         Returns:
             a dictionary with the best estimate for the paramters
+
+        Raises:
+            ValueError: if not all teams play at home and away
+            RuntimeError: if the optimizer fails
         """
+        from scipy.optimize import minimize
+
         teams = np.sort(dataset['homeTeamName'].unique())
         # check for no weirdness in dataset
         awayTeams = np.sort(dataset['guestTeamName'].unique())
@@ -293,47 +533,293 @@ class DixonColes:
                                        np.random.uniform(0, -1, (nTeams)),  # defence strength
                                        np.array([0, 1.0])  # rho (score correction), gamma (home advantage)
                                        ))
-        x = dataset.homeScore.values
-        y = dataset.guestScore.values
-        opt_output = minimize(lambda p: self.estimate_paramters(p, teams, dataset, nTeams, x, y, xi), initVals, options=options, constraints=constraints, **kwargs)
-
-        return dict(zip(["attack_" + team for team in teams] +
-                        ["defence_" + team for team in teams] +
-                        ['rho', 'home_adv'],
-                        opt_output.x))
+        # shift the attack values to fulfill the constraint, then drop the last one
+        initVals = np.array(initVals, dtype=float)
+        initVals[:nTeams] += 1 - initVals[:nTeams].mean()
+
+        if arrays is None:
+            arrays = self.match_arrays(dataset, teams, xi)
+
+        outOfRange = [0]
+
+        def objective(free):
+            value, grad = self.estimate_paramters(self.expand_parameters(free, nTeams), nTeams, arrays,
+                                                  gradient=True)
+            outOfRange[0] += not np.isfinite(value)
+            # chain rule: the last attack value decreases with every other attack value
+            freeGrad = np.delete(grad, nTeams - 1)
+            freeGrad[:nTeams - 1] -= grad[nTeams - 1]
+            return value, freeGrad
+
+        kwargs.setdefault('method', 'L-BFGS-B')
+        params = initVals
+        value = np.inf
+        for _ in range(10):
+            # rho is bounded to the interval that is feasible for the current expected goals, e.g.
+            # a refit may start from the parameters of other matches. If the fit ends on a bound or
+            # steps out of range since the expected goals changed, it continues with a new interval
+            lower, upper = self.rho_bounds(params, nTeams, arrays)
+            rhoBounds = (0.9 * lower, 0.9 * upper)
+            params[-2] = np.clip(params[-2], *rhoBounds)
+            bounds = [(None, None)] * (2 * nTeams - 1) + [rhoBounds, (None, None)]
+            outOfRange[0] = 0
+            opt_output = minimize(objective, np.delete(params, nTeams - 1), jac=True, bounds=bounds,
+                                  options=options, **kwargs)
+            if not opt_output.success:
+                raise RuntimeError(f'Fitting DixonColes failed: {opt_output.message}')
+            params = self.expand_parameters(opt_output.x, nTeams)
+            onBound = np.isclose(params[-2], rhoBounds, rtol=1e-6, atol=0).any()
+            if not (onBound or outOfRange[0]) or opt_output.fun >= value:
+                break
+            value = opt_output.fun
+
+        return dict(zip(["attack_" + team for team in teams]
+                        + ["defence_" + team for team in teams]
+                        + ['rho', 'home_adv'],
+                        params))
 
     def predict(self, homeClub: str, guestClub: str, maxGoals=10):
         """Predicts the winner between homeTeam and guestTeam based on
            the poisson distributions over their expected goal amount
+
         Args:
             homeClub (str): Name of the home team
             guestClub (str): Name of the guest team
-            maxGoals (int): max amount of goals per team to consider
+            maxGoals (int): max amount of goals per team to consider (None: exact probabilities)
+
         Returns:
             A list containig the probabilties for the homeTeam winning, a draw
             and the guestTeam winning in that order
         """
+        return self.predict_many([homeClub], [guestClub], maxGoals)[0].tolist()
+
+    def predict_many(self, homeClubs, guestClubs, maxGoals=10) -> np.ndarray:
+        """Predicts the winners of many matches based on the poisson distributions over the
+           expected goal amounts of the teams, with the correction of low scores
+
+        Args:
+            homeClubs (array of str or int): Names of the home teams (or their indices in self.teams)
+            guestClubs (array of str or int): Names of the guest teams (or their indices in self.teams)
+            maxGoals (int): max amount of goals per team to consider (None: exact probabilities)
+
+        Returns:
+            An array containing a row per match with the probabilties for the homeTeam winning,
+            a draw and the guestTeam winning in that order
+        """
+        pairs = self.pair_probabilities(maxGoals)
+        return pair_lookup(pairs, team_codes(self.teams, homeClubs), team_codes(self.teams, guestClubs),
+                           self.probabilities[maxGoals][1])
+
+    def expected_goals(self) -> tuple:
+        """Computes the expected goals of all matches between the teams
+
+        Returns:
+            A tuple of two matrices containing the expected goals of the home team (row) and the
+            guest team (column) for each pair of teams in self.teams
+        """
         paramsDict = self.params
+        attack = np.array([paramsDict['attack_' + team] for team in self.teams])
+        defence = np.array([paramsDict['defence_' + team] for team in self.teams])
+        return (np.exp(attack[:, None] + defence[None, :] + paramsDict['home_adv']),
+                np.exp(defence[:, None] + attack[None, :]))
+
+    def pair_probabilities(self, maxGoals=10) -> np.ndarray:
+        """Computes the probabilities of the outcomes of all matches between the teams once, later
+           calls look them up (until the model is refit)
+
+        Args:
+            maxGoals (int): max amount of goals per team to consider (None: exact probabilities)
+
+        Returns:
+            An array of shape (nTeams, nTeams, 3) containing the probabilties for the home team (row)
+            winning, a draw and the guest team (column) winning for each pair of teams in self.teams
+        """
+        if maxGoals not in self.probabilities:
+            homeGoalsAvg, awayGoalsAvg = self.expected_goals()
+            pairs = outcome_probabilities(homeGoalsAvg.ravel(), awayGoalsAvg.ravel(), maxGoals,
+                                          self.params['rho'])
+            # if one team is unknown, assume avg home and away goals
+            homeAvg, guestAvg = average_goals(self.df)
+            averages = outcome_probabilities([homeAvg], [guestAvg], maxGoals,
+                                             self.params['rho'])[0]
+            self.probabilities[maxGoals] = (pairs.reshape(len(self.teams), len(self.teams), 3), averages)
+        return self.probabilities[maxGoals][0]
+
+
+def average_goals(df) -> tuple:
+    """Computes the average goals of the home and the guest teams in the finished matches.
+
+    Args:
+        df: A pandas Dataframe containig matches (unfinished matches have no scores)
+
+    Returns:
+        A tuple of the average goals of the home teams and of the guest teams
+    """
+    homeScore = df.homeScore.to_numpy(dtype=float, na_value=np.nan)
+    guestScore = df.guestScore.to_numpy(dtype=float, na_value=np.nan)
+    finished = ~np.isnan(homeScore) & ~np.isnan(guestScore)
+    return homeScore[finished].mean(), guestScore[finished].mean()
 
-        if homeClub in self.teams and guestClub in self.teams:
-            teamAvgs = [
-                np.exp(paramsDict['attack_' + homeClub] + paramsDict['defence_' + guestClub] + paramsDict['home_adv']),
-                np.exp(paramsDict['defence_' + homeClub] + paramsDict['attack_' + guestClub])]
 
-        else:
-            teamAvgs = [sum(self.df['homeScore']) / len(self.df['homeScore']),
-                        sum(self.df['guestScore']) / len(self.df['guestScore'])]
+@functools.lru_cache()
+def log_factorials(n: int) -> np.ndarray:
+    """Computes the logarithms of the factorials up to n (once per n, the array must not be
+       modified).
 
-        teamPred = [[poisson.pmf(i, teamAvg) for i in range(0, maxGoals + 1)] for teamAvg in teamAvgs]
+    Args:
+        n (int): the largest number
+
+    Returns:
+        An array containing log(k!) at index k for k = 0, ..., n
+    """
+    return np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, n + 1)))))
 
-        outputMatrix = np.outer(np.array(teamPred[0]), np.array(teamPred[1]))
 
-        correctionMatrix = np.array([[self.rho_correction(
-            homeGoals, awayGoals, teamAvgs[0], teamAvgs[1], paramsDict['rho'])
-            for awayGoals in range(2)] for homeGoals in range(2)])
-        outputMatrix[:2, :2] = outputMatrix[:2, :2] * correctionMatrix
+def team_codes(teams, names) -> np.ndarray:
+    """Looks up the indices of teams.
 
-        homeTeamWin = np.sum(np.tril(outputMatrix, -1))
-        guestTeamWin = np.sum(np.triu(outputMatrix, 1))
-        draw = np.sum(np.diag(outputMatrix))
-        return [homeTeamWin, draw, guestTeamWin]
+    Args:
+        teams (array of str): sorted names of all teams
+        names (array of str or int): names of the teams to look up, or their indices in teams
+                                     (returned as is). These are not the team codes of the crawler
+
+    Returns:
+        An array containing the index of each team in teams (-1 if unknown)
+
+    Raises:
+        ValueError: if an index is out of range
+    """
+    names = np.asarray(names)
+    if np.issubdtype(names.dtype, np.integer):
+        if np.any((names < 0) | (names >= len(teams))):
+            raise ValueError(f'Team indices must be in range(0, {len(teams)})')
+        return names
+    codes = np.minimum(np.searchsorted(teams, names), len(teams) - 1)
+    return np.where(teams[codes] == names, codes, -1)
+
+
+def pair_lookup(pairs, home, guest, averages) -> np.ndarray:
+    """Looks up the probabilities of the outcomes of matches.
+
+    Args:
+        pairs (array of float): the probabilities for all pairs of teams (see pair_probabilities)
+        home (array of int): indices of the home teams (-1 if unknown)
+        guest (array of int): indices of the guest teams (-1 if unknown)
+        averages (array of float): the probabilities if one team is unknown
+
+    Returns:
+        An array containing a row per match with the probabilties for the homeTeam winning,
+        a draw and the guestTeam winning in that order
+    """
+    known = (home >= 0) & (guest >= 0)
+    probabilities = np.tile(averages, (len(home), 1))
+    probabilities[known] = pairs[home[known], guest[known]]
+    return probabilities
+
+
+def outcome_probabilities(homeGoalsAvg, awayGoalsAvg, maxGoals: int = 10, rho: float = 0) -> np.ndarray:
+    """Computes the probabilities of the outcomes of matches from the expected goals, assuming
+       independent poisson distributions of the goals (with the correction of low scores by
+       Dixon and Coles if rho is given).
+
+    Args:
+        homeGoalsAvg (array of float): expected goals of the home teams
+        awayGoalsAvg (array of float): expected goals of the guest teams
+        maxGoals (int): max amount of goals per team to consider. If None, the exact probabilities
+                        are computed from the Skellam distribution of the goal difference
+        rho (float): the correction of low scores. Defaults to 0 (no correction)
+
+    Returns:
+        An array containing a row per match with the probabilties for the homeTeam winning,
+        a draw and the guestTeam winning in that order
+    """
+    # no goals are expected if the teams never scored, avoid log(0)
+    homeGoalsAvg = np.maximum(np.asarray(homeGoalsAvg, dtype=float), np.finfo(float).tiny)
+    awayGoalsAvg = np.maximum(np.asarray(awayGoalsAvg, dtype=float), np.finfo(float).tiny)
+
+    if maxGoals is None:
+        from scipy.stats import skellam
+
+        homeTeamWin = skellam.sf(0, homeGoalsAvg, awayGoalsAvg)
+        draw = skellam.pmf(0, homeGoalsAvg, awayGoalsAvg)
+        guestTeamWin = skellam.cdf(-1, homeGoalsAvg, awayGoalsAvg)
+        # probabilities of 0 and 1 goals for the correction of low scores
+        goals = np.arange(2)
+    else:
+        goals = np.arange(maxGoals + 1)
+    # closed form of the poisson pmf of all goal counts
+    logFactorials = log_factorials(int(goals[-1]))
+    homeGoals, awayGoals = (
+        np.exp(goals * np.log(avg)[:, None] - avg[:, None] - logFactorials)
+        for avg in (homeGoalsAvg, awayGoalsAvg))
+
+    if maxGoals is not None:
+        # sum over the scores with more home goals, equal goals and more away goals without
+        # computing the probabilities of all scores
+        homeTeamWin = np.sum(homeGoals[:, 1:] * np.cumsum(awayGoals, axis=1)[:, :-1], axis=1)
+        draw = np.sum(homeGoals * awayGoals, axis=1)
+        guestTeamWin = np.sum(awayGoals[:, 1:] * np.cumsum(homeGoals, axis=1)[:, :-1], axis=1)
+
+    if rho:
+        # the corrected probabilities of 0:0, 0:1, 1:0 and 1:1 differ by these terms
+        draw = draw - homeGoals[:, 0] * awayGoals[:, 0] * homeGoalsAvg * awayGoalsAvg * rho
+        guestTeamWin = guestTeamWin + homeGoals[:, 0] * awayGoals[:, 1] * homeGoalsAvg * rho
+        homeTeamWin = homeTeamWin + homeGoals[:, 1] * awayGoals[:, 0] * awayGoalsAvg * rho
+        draw = draw - homeGoals[:, 1] * awayGoals[:, 1] * rho
+    return np.stack((homeTeamWin, draw, guestTeamWin), axis=1)
+
+
+def design_matrix(team, opponent, home, nTeams: int):
+    """Builds the sparse design matrix of the poisson regression goals ~ home + team + opponent,
+       with the first team as reference (like the formula in statsmodels).
+
+    Args:
+        team (array of int): index of the team scoring the goals in each row
+        opponent (array of int): index of the opponent in each row
+        home (array of float): 1 if the team plays at home, otherwise 0
+        nTeams (int): number of teams
+
+    Returns:
+        A scipy.sparse.csr_matrix with the columns intercept, home, team 1, ..., team nTeams - 1,
+        opponent 1, ..., opponent nTeams - 1
+    """
+    from scipy.sparse import csr_matrix
+
+    rows = np.arange(len(team))
+    isTeam, isOpponent = team > 0, opponent > 0
+    return csr_matrix(
+        (np.concatenate((np.ones(len(team)), home, np.ones(isTeam.sum()), np.ones(isOpponent.sum()))),
+         (np.concatenate((rows, rows, rows[isTeam], rows[isOpponent])),
+          np.concatenate((np.zeros(len(team), dtype=int), np.ones(len(team), dtype=int),
+                          team[isTeam] + 1, opponent[isOpponent] + nTeams)))),
+        shape=(len(team), 2 * nTeams))
+
+
+def fit_poisson_glm(design, y, maxiter: int = 100, tol: float = 1e-8) -> np.ndarray:
+    """Fits a poisson regression with log link by iteratively reweighted least squares
+       (the same algorithm and convergence criterion as statsmodels' GLM).
+
+    Args:
+        design (scipy.sparse matrix): the design matrix, one row per observation
+        y (array of float): the observed counts
+        maxiter (int): max amount of iterations
+        tol (float): the fit converged if the deviance changes less than this
+
+    Returns:
+        An array containing the coefficients, one per column of the design matrix
+    """
+    mu = (y + y.mean()) / 2
+    eta = np.log(mu)
+    deviance = np.inf
+    for _ in range(maxiter):
+        # weighted least squares with the working response z and weights mu
+        z = eta + (y - mu) / mu
+        weighted = design.T.multiply(mu).tocsr()
+        coefs = np.linalg.lstsq((weighted @ design).toarray(), weighted @ z, rcond=None)[0]
+        eta = design @ coefs
+        mu = np.exp(eta)
+        lastDeviance = deviance
+        deviance = 2 * np.sum(np.where(y > 0, y * np.log(np.where(y > 0, y, 1) / mu), 0) - (y - mu))
+        if abs(deviance - lastDeviance) <= tol:
+            break
+    return coefs
@@ -0,0 +1,331 @@
+"""
+This module contains a local stand-in for the openligadb API. It serves
+synthetic leagues (or responses recorded by crawler.Recording) in the format
+of openligadb, optionally with latency and server errors, so that the crawler
+can be tested and benchmarked without network access. Team icons are served
+under /icons/.
+
+To use:
+>>> with StandInServer() as server:
+...     crawler.g_api_url = server.url
+...     crawler.refresh_ui_cache()
+
+Or from the command line:
+    python -m teamproject.standin --port 8080 --latency 0.05 --error-rate 0.1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_league(division: str, season: int, nTeams: int = 18,
+                finishedMatchdays: int = None, start: datetime = None) -> list:
+    """Generates a double round robin league in the format of openligadb.
+
+    Args:
+        division (str): Division shortcut, e.g. 'bl1'.
+        season (int): Season of the league.
+        nTeams (int): Number of teams (must be even). Defaults to 18.
+        finishedMatchdays (int): Number of matchdays that are finished.
+                                 Defaults to None (all matchdays).
+        start (datetime): Kickoff (UTC) of the first matchday. Defaults to
+                          None (August 1st of the season).
+
+    Returns:
+        A list of matches as returned by getmatchdata.
+    """
+    rng = random.Random(f'{division}{season}')
+    teamOffset = 100 * (int(division[-1]) if division[-1].isdigit() else 0)
+    teams = [{'teamId': teamOffset + i, 'teamName': f'{division} Team {i}',
+              'shortName': f'T{i}',
+              'teamIconUrl': f'https://example.org/{division}/{i}.png'}
+             for i in range(1, nTeams + 1)]
+    nMatchdays = 2 * (nTeams - 1)
+    if finishedMatchdays is None:
+        finishedMatchdays = nMatchdays
+    if start is None:
+        start = datetime(season, 8, 1, 18, 30, tzinfo=timezone.utc)
+    # circle method: first team is fixed, all others rotate
+    order = list(range(nTeams))
+    matches = []
+    for day in range(1, nMatchdays + 1):
+        if day == nTeams:
+            order = list(range(nTeams))
+        pairs = [(order[i], order[-i - 1]) for i in range(nTeams // 2)]
+        order = [order[0]] + [order[-1]] + order[1:-1]
+        if day >= nTeams:
+            pairs = [(guest, home) for home, guest in pairs]
+        kickoff = start + timedelta(days=7 * (day - 1))
+        for home, guest in pairs:
+            finished = day <= finishedMatchdays
+            results = [{'resultName': 'Endergebnis', 'resultOrderID': 2,
+                        'pointsTeam1': rng.randint(0, 4),
+                        'pointsTeam2': rng.randint(0, 3)}] if finished else []
+            matches.append({
+                'matchID': len(matches) + 1,
+                'matchDateTime': (kickoff + timedelta(hours=2))
+                .strftime('%Y-%m-%dT%H:%M:%S'),
+                'matchDateTimeUTC': kickoff.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'leagueSeason': season,
+                'leagueShortcut': division,
+                'group': {'groupName': f'{day}. Spieltag',
+                          'groupOrderID': day, 'groupID': day},
+                'team1': teams[home],
+                'team2': teams[guest],
+                'matchIsFinished': finished,
+                'matchResults': results,
+                'location': {'locationID': teams[home]['teamId'],
+                             'locationCity': f'City {home + 1}',
+                             'locationStadium': f'Stadium {home + 1}'}
+                if home % 4 else None,
+                'goals': []})
+    return matches
+
+
+class StandInServer:
+    """A local HTTP server answering openligadb queries with synthetic data.
+    The last season is in progress, all previous seasons are finished.
+
+    Attributes:
+        leagues: A dictionary mapping (division, season) to a list of matches.
+        changes: A dictionary mapping (division, season, matchday) to the
+                 last change of this matchday.
+        recording: A crawler.Recording whose responses are served instead of
+                   synthetic data (if recorded).
+        latency: Delay of every response in seconds.
+        errorRate: Probability of answering with HTTP 503.
+        hits: A Counter of the queried actions (e.g. 'getmatchdata').
+        failures: A dictionary mapping paths to a list of HTTP status codes
+                  and bodies returned (in that order) before the path is
+                  answered.
+    """
+
+    def __init__(self, seasons: list = (2019, 2020),
+                 divisions: list = ('bl1', 'bl2', 'bl3'), nTeams: int = 18,
+                 finishedMatchdays: int = 10, recording=None,
+                 latency: float = 0, errorRate: float = 0, seed: int = None):
+        """Inits StandInServer with synthetic leagues.
+
+        Args:
+            seasons (list): Available seasons. Defaults to (2019, 2020).
+            divisions (list): Available divisions. Defaults to all.
+            nTeams (int): Number of teams per league. Defaults to 18.
+            finishedMatchdays (int): Number of finished matchdays of the last
+                                     season. Defaults to 10.
+            recording: A crawler.Recording to serve responses from. Defaults
+                       to None (synthetic data only).
+            latency (float): Delay of every response in seconds. Defaults
+                             to 0.
+            errorRate (float): Probability of answering with HTTP 503.
+                               Defaults to 0.
+            seed (int): Seed of the error injection. Defaults to None.
+        """
+        self.seasons = list(seasons)
+        self.divisions = list(divisions)
+        self.leagues = {}
+        self.changes = {}
+        self.recording = recording
+        self.latency = latency
+        self.errorRate = errorRate
+        self.rng = random.Random(seed)
+        self.hits = Counter()
+        self.failures = {}
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        # next matchday of the current season takes place in three days
+        start = now - timedelta(days=7 * finishedMatchdays - 3)
+        for season in self.seasons:
+            current = season == self.seasons[-1]
+            for division in self.divisions:
+                self.leagues[division, season] = make_league(
+                    division, season, nTeams,
+                    finishedMatchdays if current else None,
+                    start if current else None)
+        for (division, season), matches in self.leagues.items():
+            for match in matches:
+                day = match['group']['groupOrderID']
+                self.changes[division, season, day] = match['matchDateTime']
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server.
+
+        Returns:
+            The URL (to be used as crawler.g_api_url).
+        """
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self, port: int = 0):
+        """Starts serving in a background thread.
+
+        Args:
+            port (int): Local port. Defaults to 0 (any free port).
+        """
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                status, body = server.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stops the server.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def respond(self, path: str) -> tuple:
+        """Computes the response to a query.
+
+        Args:
+            path (str): Requested path, e.g. '/getmatchdata/bl1/2020/3'.
+
+        Returns:
+            A tuple of HTTP status code and JSON encoded body.
+        """
+        action, *params = path.strip('/').split('/')
+        self.hits[action] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failures.get(path):
+            return self.failures[path].pop(0)
+        if self.errorRate and self.rng.random() < self.errorRate:
+            return 503, b'{}'
+        if action == 'icons':
+            # fake image, distinct per icon name
+            return 200, f'icon {params[-1]}'.encode()
+        if self.recording is not None:
+            body = self.recording.load(path)
+            if body is not None:
+                return 200, body
+        try:
+            data = self.resolve(action, params)
+        except (KeyError, ValueError, IndexError):
+            return 404, b'{}'
+        return 200, json.dumps(data).encode()
+
+    def resolve(self, action: str, params: list):
+        """Looks up the data answering a query.
+
+        Args:
+            action (str): Queried endpoint, e.g. 'getmatchdata'.
+            params (list): Path parameters following the endpoint.
+
+        Returns:
+            The JSON serializable response data.
+
+        Raises:
+            KeyError: If the endpoint or league does not exist.
+        """
+        if action == 'getavailableleagues':
+            return [{'leagueId': 4000 + i, 'leagueName': f'{div} {season}',
+                     'leagueShortcut': div, 'leagueSeason': str(season)}
+                    for i, (div, season) in enumerate(self.leagues)]
+        elif action == 'getcurrentgroup':
+            matches = self.leagues[params[0], self.seasons[-1]]
+            pending = [m['group'] for m in matches if not m['matchIsFinished']]
+            return pending[0] if pending else matches[-1]['group']
+        division, season = params[0], int(params[1])
+        matches = self.leagues[division, season]
+        if action == 'getavailablegroups':
+            groups = {m['group']['groupOrderID']: m['group'] for m in matches}
+            return list(groups.values())
+        elif action == 'getmatchdata':
+            if len(params) > 2:
+                day = int(params[2])
+                matches = [m for m in matches
+                           if m['group']['groupOrderID'] == day]
+            return matches
+        elif action == 'getlastchangedate':
+            return self.changes[division, season, int(params[2])]
+        raise KeyError(action)
+
+    def finish_matchday(self, division: str, matchday: int):
+        """Finishes all matches of a matchday in the current season and
+        updates its last change date.
+
+        Args:
+            division (str): Division of the matchday.
+            matchday (int): The matchday that is finished.
+        """
+        season = self.seasons[-1]
+        for match in self.leagues[division, season]:
+            if match['group']['groupOrderID'] == matchday:
+                match['matchIsFinished'] = True
+                match['matchResults'] = [{
+                    'resultName': 'Endergebnis', 'resultOrderID': 2,
+                    'pointsTeam1': 1, 'pointsTeam2': 1}]
+        now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')
+        self.changes[division, season, matchday] = now
+
+    def fail(self, path: str, status: int = 503, times: int = 1,
+             body: bytes = b'{}'):
+        """Lets the next requests of a path fail.
+
+        Args:
+            path (str): Path of the failing requests, e.g. '/getcurrentgroup/bl1'.
+            status (int): HTTP status code of the failures. Defaults to 503.
+            times (int): Number of failing requests. Defaults to 1.
+            body (bytes): Body of the failures, e.g. malformed JSON with
+                          status 200. Defaults to b'{}'.
+        """
+        self.failures.setdefault(path, []).extend([(status, body)] * times)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve a local stand-in for the openligadb API.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--seasons', type=int, nargs='+', default=[2019, 2020])
+    parser.add_argument('--latency', type=float, default=0,
+                        help='delay of every response in seconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='probability of answering with HTTP 503')
+    parser.add_argument('--recording',
+                        help='directory of responses recorded by the crawler')
+    args = parser.parse_args()
+    recording = None
+    if args.recording:
+        from teamproject.crawler import Recording
+        recording = Recording(args.recording, 'replay')
+    server = StandInServer(args.seasons, recording=recording,
+                           latency=args.latency, errorRate=args.error_rate)
+    server.start(args.port)
+    print(f'Serving openligadb stand-in on {server.url}')
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
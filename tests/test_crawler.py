@@ -1,5 +1,14 @@
+import asyncio
+import importlib.util
+import multiprocessing
+import os.path
 import pandas as pd
+import pytest
+import shutil
+import threading
 from teamproject import crawler
+from teamproject.metrics import Registry
+from teamproject.standin import StandInServer, make_league
 
 
 # test fetching and caching of available data
@@ -103,3 +112,468 @@ def test_get_teams():
     assert (teams['name'] != '').all()
     assert (teams['icon'] != '').all()
     assert not teams.duplicated().any()
+
+
+# test columnar storage of match data (offline)
+def test_store_columns(tmp_path, monkeypatch):
+    monkeypatch.setattr(crawler, 'g_cache_path', str(tmp_path))
+    data = pd.DataFrame({
+        'season': [2020, 2020],
+        'division': ['bl1', 'bl1'],
+        'datetime': pd.to_datetime(['2020-09-18 20:30', '2020-09-19 15:30']),
+        'datetimeUTC': pd.to_datetime(['2020-09-18 18:30', '2020-09-19 13:30'],
+                                      utc=True),
+        'matchday': [1, 1],
+        'homeTeamName': ['FC Bayern', 'Hertha BSC'],
+        'finished': [True, True],
+        'homeScore': pd.array([8, None], dtype='Int64'),
+        'locCity': ['München', None]})
+    crawler.store_matchdata('next', data.copy())
+    loaded = crawler.load_matchdata('next')
+    expected = data.drop('finished', axis=1)
+    pd.testing.assert_frame_equal(loaded, expected)
+    # CSV stays available as exchange format
+    crawler.export_matchdata('next', f'{tmp_path}/next.csv')
+    imported = crawler.import_matchdata('next', f'{tmp_path}/next.csv')
+    assert imported['homeScore'].dtype == 'Int64'
+    assert pd.api.types.is_datetime64_any_dtype(imported['datetimeUTC'])
+    assert imported['datetimeUTC'].dt.tz is not None
+
+
+# test row-level updates of the cache index (offline)
+def test_store_cache_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(crawler, 'g_cache_path', str(tmp_path))
+    avail = pd.DataFrame({'season': [2019, 2020],
+                          'division': [['bl1', 'bl2'], ['bl1', 'bl2']],
+                          'IDs': [[4362, 4363], [4441, 4442]]})
+    crawler.store_cache_index(avail)
+    crawler.update_cache_index(2019, 'bl1', cached=True, cachedMatchdays=34,
+                               cachedDatetime='2020-07-01 12:00:00')
+    # storing known leagues again must not reset their cache state
+    crawler.store_cache_index(avail)
+    data = crawler.load_cache_index()
+    assert data['season'].tolist() == [2019, 2020]
+    assert data['division'].tolist() == [['bl1', 'bl2'], ['bl1', 'bl2']]
+    assert data['cached'].dtype == 'bool'
+    assert not data['cached'].any()
+    assert data['cachedMatchdays'].tolist() == [34, 0]
+    assert pd.api.types.is_datetime64_any_dtype(data['cachedDatetime'])
+    leagues = crawler.load_leagues(season=2019, division='bl1')
+    assert len(leagues) == 1
+    assert leagues['cached'].all()
+
+
+# test merging of fetched matchdays into cached match data (offline)
+def test_merge_matchdata(tmp_path, monkeypatch):
+    monkeypatch.setattr(crawler, 'g_cache_path', str(tmp_path))
+    crawler.store_cache_index(pd.DataFrame({
+        'season': [2020], 'division': ['bl1'], 'availMatchdays': [3]}))
+    kickoff = pd.to_datetime(['2020-09-18', '2020-09-25', '2020-10-02',
+                              '2020-10-02'], utc=True)
+    fetched = pd.DataFrame({
+        'season': 2020, 'division': 'bl1', 'datetimeUTC': kickoff,
+        'matchday': [1, 2, 3, 3], 'finished': [True, True, True, False],
+        'homeScore': pd.array([1, 0, 2, None], dtype='Int64')})
+    crawler.store_matchdata('2020', fetched.copy())
+    league = crawler.load_leagues(2020, 'bl1').iloc[0]
+    # matchday 3 is not finished completely
+    assert league['cachedMatchdays'] == 2
+    assert not league['cached']
+    stored = crawler.load_matchdata('2020')
+    assert len(stored) == 3
+    delta = fetched[fetched['matchday'] == 3].assign(finished=True)
+    delta['homeScore'] = pd.array([3, 1], dtype='Int64')
+    merged = crawler.merge_matchdata(stored, delta)
+    assert merged['matchday'].tolist() == [1, 2, 3, 3]
+    assert merged['homeScore'].tolist() == [1, 0, 3, 1]
+    crawler.store_matchdata('2020', merged)
+    league = crawler.load_leagues(2020, 'bl1').iloc[0]
+    assert league['cachedMatchdays'] == 3
+    assert league['cached']
+
+
+# local openligadb stand-in and empty cache for offline tests
+@pytest.fixture
+def standin(tmp_path, monkeypatch):
+    with StandInServer(seasons=[2019, 2020]) as server:
+        monkeypatch.setattr(crawler, 'g_api_url', server.url)
+        monkeypatch.setattr(crawler, 'g_cache_path', str(tmp_path))
+        yield server
+
+
+def load_benchmark(name: str):
+    path = os.path.join(os.path.dirname(__file__), '..', 'benchmarks',
+                        f'{name}.py')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# test that the columnar parser equals the previous implementation (offline)
+def test_parse_league():
+    bench = load_benchmark('bench_parser')
+    data = make_league('bl1', 2019) + make_league('bl3', 2020,
+                                                  finishedMatchdays=10)
+    matches = crawler.parse_league(data)
+    pd.testing.assert_frame_equal(matches, bench.parse_league_dicts(data))
+    # pending matches and matches without location are included
+    assert matches['homeScore'].isna().sum() == 24 * 9
+    assert not matches['finished'].all()
+    assert matches['locID'].isna().any() and matches['locCity'].isna().any()
+
+
+# test that a warm start only checks for changes (offline)
+def test_refresh_ui_cache(standin):
+    crawler.refresh_ui_cache()
+    assert standin.hits['getavailableleagues'] == 1
+    assert standin.hits['getavailablegroups'] == 6
+    data = crawler.load_matchdata('next')
+    assert set(data['division']) == {'bl1', 'bl2', 'bl3'}
+    assert (data['matchday'] == 11).all()
+    # nothing changed, only current matchdays and change dates are queried
+    standin.hits.clear()
+    crawler.refresh_ui_cache()
+    assert set(standin.hits) == {'getcurrentgroup', 'getlastchangedate'}
+    pd.testing.assert_frame_equal(crawler.load_matchdata('next').iloc[:, 1:],
+                                  data.iloc[:, 1:])
+    # a finished matchday is fetched again for its division only
+    standin.finish_matchday('bl2', 11)
+    standin.hits.clear()
+    crawler.refresh_ui_cache()
+    assert standin.hits['getmatchdata'] == 2
+    data = crawler.load_matchdata('next')
+    assert data.loc[data['division'] == 'bl2', 'matchday'].eq(12).all()
+    assert data.loc[data['division'] == 'bl1', 'matchday'].eq(11).all()
+
+
+# test that get_data only fetches new matchdays of cached seasons (offline)
+def test_get_data_delta(standin):
+    data = crawler.get_data(2019, 1, 2020, 34)
+    assert len(data) == 3 * 34 * 9 + 3 * 10 * 9
+    assert standin.hits['getmatchdata'] == 6
+    standin.finish_matchday('bl1', 11)
+    standin.hits.clear()
+    data = crawler.get_data(2020, 1, 2020, 34)
+    assert len(data) == 3 * 10 * 9 + 9
+    # matchday 11 of each division and the new current matchday of bl1
+    assert standin.hits['getcurrentgroup'] == 3
+    assert standin.hits['getmatchdata'] == 4
+
+
+# test retries and per-query failures of the shared client (offline)
+def test_client(standin, monkeypatch):
+    client = crawler.Client(retries=2, backoff=0.01)
+    monkeypatch.setattr(crawler, 'g_client', client)
+    standin.fail('/getcurrentgroup/bl1', status=503, times=2)
+    standin.fail('/getcurrentgroup/bl2', status=503, times=3)
+    standin.fail('/getcurrentgroup/bl3', status=404)
+    queries = [{'action': 'getcurrentgroup', 'division': division}
+               for division in ['bl1', 'bl2', 'bl3']]
+    responses = crawler.fetch(queries)
+    client.close()
+    assert [res['params'] for res in responses] == queries
+    # server errors are retried, client errors are not
+    assert responses[0]['response']['groupOrderID'] == 11
+    assert responses[0]['retries'] == 2
+    assert responses[1]['response'] is None
+    assert responses[1]['status'] == 503
+    assert responses[1]['retries'] == 2
+    assert responses[2]['status'] == 404
+    assert responses[2]['retries'] == 0
+    assert standin.hits['getcurrentgroup'] == 7
+
+
+# test that a malformed response fails only its own query (offline)
+def test_client_malformed(standin, monkeypatch):
+    client = crawler.Client(retries=2, backoff=0.01)
+    monkeypatch.setattr(crawler, 'g_client', client)
+    standin.fail('/getcurrentgroup/bl2', status=200, body=b'<html>')
+    queries = [{'action': 'getcurrentgroup', 'division': division}
+               for division in ['bl1', 'bl2', 'bl3']]
+    responses = crawler.fetch(queries)
+    client.close()
+    assert responses[0]['response']['groupOrderID'] == 11
+    assert responses[1]['response'] is None
+    assert 'Error' in responses[1]['error']
+    assert responses[1]['retries'] == 0
+    assert responses[2]['response']['groupOrderID'] == 11
+    assert standin.hits['getcurrentgroup'] == 3
+
+
+# test awaiting several crawler functions from one event loop (offline)
+def test_async_api(standin):
+    async def refresh():
+        await crawler.fetch_avail_seasons_async()
+        return await asyncio.gather(crawler.get_data_async(2019, 1, 2019, 34),
+                                    crawler.fetch_next_matches_async(),
+                                    crawler.fetch_avail_matchdays_async())
+    data, *_ = asyncio.run(refresh())
+    assert len(data) == 3 * 34 * 9
+    assert len(crawler.load_matchdata('next')) == 3 * 9
+    assert crawler.load_cache_index()['availMatchdays'].eq(34).all()
+
+
+# test recording responses and replaying them without server (offline)
+def test_recording(standin, tmp_path, monkeypatch):
+    recording = crawler.Recording(f'{tmp_path}/recording', 'record')
+    monkeypatch.setattr(crawler, 'g_recording', recording)
+    crawler.refresh_ui_cache()
+    recorded = crawler.get_data(2019, 1, 2019, 34)
+    replay = crawler.Recording(recording.path, 'replay')
+    monkeypatch.setattr(crawler, 'g_recording', replay)
+    monkeypatch.setattr(crawler, 'g_cache_path', f'{tmp_path}/replay')
+    monkeypatch.setattr(crawler, 'g_api_url', 'http://127.0.0.1:9')
+    standin.hits.clear()
+    crawler.refresh_ui_cache()
+    pd.testing.assert_frame_equal(crawler.get_data(2019, 1, 2019, 34),
+                                  recorded)
+    assert not standin.hits
+    # unrecorded queries fail without retries
+    response = crawler.fetch([{'action': 'getcurrentgroup', 'division': 'x'}])
+    assert response[0]['status'] == 404
+    assert response[0]['retries'] == 0
+
+
+# test that injected server errors are compensated by retries (offline)
+def test_error_injection(tmp_path, monkeypatch):
+    with StandInServer(seasons=[2020], errorRate=0.3, seed=0) as server:
+        monkeypatch.setattr(crawler, 'g_api_url', server.url)
+        monkeypatch.setattr(crawler, 'g_cache_path', str(tmp_path))
+        client = crawler.Client(retries=10, backoff=0.001)
+        monkeypatch.setattr(crawler, 'g_client', client)
+        data = crawler.get_data(2020, 1, 2020, 34)
+        client.close()
+    assert len(data) == 3 * 10 * 9
+    assert sum(server.hits.values()) > 4
+
+
+# test that repeated intervals are answered from memory (offline)
+def test_frame_cache(standin, monkeypatch):
+    monkeypatch.setattr(crawler, 'g_frame_cache', crawler.FrameCache())
+    data = crawler.get_data(2019, 1, 2019, 34)
+    data.drop(data.index, inplace=True)
+    assert len(crawler.get_data(2019, 1, 2019, 34)) == 3 * 34 * 9
+    assert crawler.g_frame_cache.stats()['hits'] == 1
+    # storing a season invalidates all intervals containing it
+    crawler.store_matchdata('2019', crawler.load_matchdata('2019')
+                            .assign(finished=True))
+    assert crawler.g_frame_cache.stats()['entries'] == 0
+    crawler.get_data(2019, 1, 2019, 34)
+    assert crawler.g_frame_cache.stats()['misses'] == 2
+    # least recently used intervals are evicted beyond the memory limit
+    size = crawler.g_frame_cache.stats()['bytes']
+    crawler.g_frame_cache.maxBytes = size
+    crawler.get_data(2019, 1, 2019, 20)
+    crawler.get_data(2019, 10, 2019, 34)
+    assert crawler.g_frame_cache.stats()['entries'] == 1
+
+
+# test prefetching of team icons and that icons are only read from disk (offline)
+def test_teamicons(standin):
+    for match in standin.leagues['bl1', 2019]:
+        for team in [match['team1'], match['team2']]:
+            team['teamIconUrl'] = f"{standin.url}/icons/{team['teamId']}.png"
+    data = crawler.get_data(2019, 1, 2019, 34)
+    data = data[data['division'] == 'bl1']
+    standin.fail('/icons/101.png', status=404)
+    standin.latency = 0.2
+    fetched = threading.Event()
+    teams = crawler.get_teams(data, fetched.set)
+    # icons that are not fetched yet are not waited for
+    assert crawler.load_teamicon(teams.ID[0], teams.icon[0]) is None
+    assert fetched.wait(5)
+    standin.latency = 0
+    assert standin.hits['icons'] == 18
+    for team in teams.itertuples():
+        path = crawler.load_teamicon(team.ID, team.icon)
+        if team.ID == 101:
+            assert path is None
+        else:
+            assert open(path, 'rb').read() == f'icon {team.ID}.png'.encode()
+    # cached and failed icons are not fetched again
+    crawler.get_teams(data)
+    crawler.g_icon_prefetch.result()
+    assert standin.hits['icons'] == 18
+
+
+# test compact fact table with team codes and its wide view (offline)
+def test_facts(standin):
+    wide = crawler.get_data(2019, 1, 2020, 34)
+    facts = crawler.get_data(2019, 1, 2020, 34, wide=False)
+    assert facts['division'].dtype == 'category'
+    assert facts['matchday'].dtype == 'int8'
+    assert facts['homeScore'].dtype == 'Int8'
+    assert 'homeTeamName' not in facts and 'locCity' not in facts
+    # teams are keyed by ID and have dense codes
+    teams = crawler.load_teams()
+    assert sorted(teams['code']) == list(range(3 * 18))
+    codes = teams.loc[facts['homeTeamID'], 'code'].to_numpy()
+    assert (facts['homeTeamCode'] == codes).all()
+    pd.testing.assert_frame_equal(crawler.to_wide(facts), wide)
+    assert facts.memory_usage(deep=True).sum() \
+        < wide.memory_usage(deep=True).sum() / 5
+
+
+# test reading only selected divisions and matchdays (offline)
+def test_get_data_divisions(standin):
+    data = crawler.get_data(2019, 30, 2020, 4, divisions=['bl1'])
+    assert standin.hits['getmatchdata'] == 2
+    assert len(data) == 5 * 9 + 4 * 9
+    assert (data['division'] == 'bl1').all()
+    full = crawler.get_data(2019, 30, 2020, 4)
+    pd.testing.assert_frame_equal(
+        full[full['division'] == 'bl1'].reset_index(drop=True), data)
+    # only the matching rows are read from the columnar cache
+    facts = crawler.load_facts('2019', ['bl2'], 3, 3)
+    assert len(facts) == 9
+    assert (facts['matchday'] == 3).all()
+
+
+# test streaming match data in chronological chunks (offline)
+def test_iter_matches(standin):
+    chunks = list(crawler.iter_matches(2019, 30, 2020, 4))
+    assert [len(chunk) for chunk in chunks] == [3 * 9] * 9
+    assert [chunk['matchday'].iloc[0] for chunk in chunks] \
+        == [30, 31, 32, 33, 34, 1, 2, 3, 4]
+    data = pd.concat(chunks, ignore_index=True)
+    assert data['datetimeUTC'].is_monotonic_increasing
+    assert len(data) == len(crawler.get_data(2019, 30, 2020, 4))
+    chunks = list(crawler.iter_matches(2019, 1, 2020, 34, chunk='season',
+                                       divisions=['bl2']))
+    assert [len(chunk) for chunk in chunks] == [34 * 9, 10 * 9]
+
+
+# test that chunks stay chronological with different calendars (offline)
+def test_iter_matches_calendars(standin):
+    # bl3 plays midweek rounds, a match of bl1 is postponed by three weeks
+    for match in standin.leagues['bl3', 2019]:
+        day = match['group']['groupOrderID']
+        kickoff = pd.Timestamp(match['matchDateTimeUTC']) \
+            - pd.Timedelta(days=3 * (day - 1))
+        match['matchDateTimeUTC'] = kickoff.strftime('%Y-%m-%dT%H:%M:%SZ')
+    postponed = standin.leagues['bl1', 2019][30 * 9]
+    kickoff = pd.Timestamp(postponed['matchDateTimeUTC']) + pd.Timedelta(days=21)
+    postponed['matchDateTimeUTC'] = kickoff.strftime('%Y-%m-%dT%H:%M:%SZ')
+    chunks = list(crawler.iter_matches(2019, 1, 2019, 34))
+    data = pd.concat(chunks, ignore_index=True)
+    assert data['datetimeUTC'].is_monotonic_increasing
+    assert len(data) == 3 * 34 * 9
+    for chunk in chunks:
+        kickoffs = chunk['datetimeUTC']
+        assert kickoffs.max() - kickoffs.min() < pd.Timedelta(days=7)
+    # the postponed match is yielded with the matches of its new week
+    week = next(chunk for chunk in chunks if (chunk['matchday'] == 31).any()
+                and chunk['datetimeUTC'].max() == kickoff)
+    assert (week.loc[week['division'] == 'bl1', 'matchday'] == 34).sum() == 9
+
+
+# test that an interrupted backfill resumes with the missing matchdays (offline)
+def test_backfill(standin, monkeypatch):
+    monkeypatch.setattr(crawler, 'g_client', crawler.Client(retries=0))
+    standin.fail('/getmatchdata/bl2/2019/17', status=503)
+    messages = []
+    stats = crawler.backfill(report=messages.append)
+    assert stats['units'] == 2 * 3 * 34 - 3 * (34 - 11)
+    assert stats['failed'] == 1
+    assert stats['matches'] == (stats['units'] - 1) * 9
+    assert messages[-1].startswith(f"{stats['units']}/{stats['units']} ")
+    leagues = crawler.load_leagues(2019).set_index('division')
+    assert leagues.loc['bl2', 'cachedMatchdays'] == 16
+    assert leagues.loc['bl1', 'cached']
+    # only the failed and the current matchdays are fetched again
+    stats = crawler.backfill(report=messages.append)
+    assert stats['units'] == 1 + 3
+    assert stats['failed'] == 0
+    assert crawler.load_leagues(2019)['cached'].all()
+    crawler.g_client.close()
+
+
+# test rebuilding match data from archived raw responses (offline)
+def test_reparse(standin, tmp_path, monkeypatch):
+    monkeypatch.setattr(crawler, 'g_archive', True)
+    crawler.get_data(2019, 1, 2020, 34)
+    standin.finish_matchday('bl1', 11)
+    crawler.get_data(2020, 1, 2020, 34)
+    expected = {season: crawler.load_matchdata(season)
+                for season in ['2019', '2020']}
+    for season in expected:
+        shutil.rmtree(tmp_path / f'matchdata_{season}')
+    standin.hits.clear()
+    assert crawler.reparse() == [2019, 2020]
+    assert not standin.hits
+    for season, data in expected.items():
+        pd.testing.assert_frame_equal(crawler.load_matchdata(season), data)
+
+
+# test that rebuilding keeps cached matchdays that were not archived (offline)
+def test_reparse_partial_archive(standin, monkeypatch):
+    crawler.get_data(2020, 1, 2020, 34)
+    monkeypatch.setattr(crawler, 'g_archive', True)
+    standin.finish_matchday('bl1', 11)
+    crawler.get_data(2020, 1, 2020, 34)
+    expected = crawler.load_matchdata('2020')
+    assert crawler.reparse() == [2020]
+    pd.testing.assert_frame_equal(crawler.load_matchdata('2020'), expected)
+
+
+# test that failures to archive responses do not fail the queries (offline)
+def test_archive_error(standin, tmp_path, monkeypatch):
+    metrics = Registry()
+    monkeypatch.setattr(crawler, 'g_metrics', metrics)
+    monkeypatch.setattr(crawler, 'g_archive', True)
+    (tmp_path / 'archive').write_text('not a directory')
+    data = crawler.get_data(2019, 1, 2019, 34)
+    assert len(data) == 3 * 34 * 9
+    assert metrics.get('crawler_archive_errors_total') == 3
+    assert metrics.get('crawler_requests_total', action='getmatchdata',
+                       status=200) == 3
+
+
+def hammer_cache(url: str, path: str, worker: int, rounds: int) -> list:
+    crawler.g_api_url = url
+    crawler.g_cache_path = path
+    lengths = []
+    for i in range(rounds):
+        forceUpdate = (worker + i) % 2 == 0
+        lengths.append(len(crawler.get_data(2019, 1, 2020, 34, forceUpdate)))
+        crawler.fetch_next_matches()
+        lengths.append(len(crawler.load_matchdata('next')))
+    return lengths
+
+
+# test several processes reading and writing the same cache (offline)
+def test_concurrent_processes(standin, tmp_path):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(4) as pool:
+        results = pool.starmap(hammer_cache, [
+            (standin.url, str(tmp_path), worker, 5) for worker in range(4)])
+    for lengths in results:
+        assert lengths == [3 * 34 * 9 + 3 * 10 * 9, 3 * 9] * 5
+    leagues = crawler.load_leagues()
+    assert leagues['cachedMatchdays'].tolist() == [34] * 3 + [10] * 3
+    assert len(crawler.get_data(2019, 1, 2020, 34)) == 3 * 34 * 9 + 3 * 10 * 9
+
+
+# test metrics of requests, the interval cache and parsing (offline)
+def test_metrics(standin, monkeypatch):
+    metrics = Registry()
+    monkeypatch.setattr(crawler, 'g_metrics', metrics)
+    monkeypatch.setattr(crawler, 'g_client', crawler.Client(backoff=0.01))
+    standin.fail('/getmatchdata/bl1/2019', status=503)
+    crawler.get_data(2019, 1, 2019, 34)
+    crawler.get_data(2019, 1, 2019, 34)
+    assert metrics.get('crawler_requests_total', action='getmatchdata',
+                       status=503) == 1
+    assert metrics.get('crawler_requests_total', action='getmatchdata',
+                       status=200) == 3
+    assert metrics.get('crawler_retries_total', action='getmatchdata') == 1
+    assert metrics.get('crawler_request_seconds', action='getmatchdata') == 4
+    assert metrics.get('crawler_response_bytes_total',
+                       action='getmatchdata') > 0
+    assert metrics.get('crawler_frame_cache_total', result='miss') == 1
+    assert metrics.get('crawler_frame_cache_total', result='hit') == 1
+    assert metrics.get('crawler_parsed_matches_total') == 3 * 34 * 9
+    assert metrics.get('crawler_rows_loaded_total') == 3 * 34 * 9
+    assert 'crawler_request_seconds_bucket' in metrics.render()
+    crawler.g_client.close()
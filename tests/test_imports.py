@@ -0,0 +1,42 @@
+import subprocess
+import sys
+import pytest
+
+# modules that must only be imported when a model or plot is used
+g_heavy = ['statsmodels', 'matplotlib', 'scipy.optimize', 'scipy.stats',
+           'patsy']
+# budget of the cumulative import time in seconds (measured <0.3 s)
+g_budget = 1.5
+
+
+def import_times(module: str) -> dict:
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+# test that heavy dependencies are imported lazily
+@pytest.mark.parametrize('module', ['teamproject.crawler',
+                                    'teamproject.models',
+                                    'teamproject.data_analytics'])
+def test_lazy_imports(module):
+    times = import_times(module)
+    assert not [name for name in times
+                if name.split('.')[0] in g_heavy or name in g_heavy]
+    assert times[module] < g_budget
+
+
+# test that the GUI starts without loading models and plotting
+def test_gui_imports():
+    pytest.importorskip('PyQt5')
+    times = import_times('teamproject.gui')
+    assert 'teamproject.models' not in times
+    assert 'teamproject.data_analytics' not in times
+    assert not [name for name in times if name.split('.')[0] in g_heavy]
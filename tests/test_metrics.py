@@ -0,0 +1,41 @@
+from teamproject.metrics import Registry
+
+
+# test counters, histograms and the Prometheus text format
+def test_registry(tmp_path):
+    registry = Registry(buckets=(0.1, 1))
+    registry.inc('requests_total', action='getmatchdata')
+    registry.inc('requests_total', 2, action='getmatchdata')
+    for value in [0.05, 0.5, 0.7, 3]:
+        registry.observe('request_seconds', value, action='a"b')
+    assert registry.get('requests_total', action='getmatchdata') == 3
+    assert registry.get('request_seconds', action='a"b') == 4
+    assert registry.quantile('request_seconds', 0.5, action='a"b') == 1
+    assert registry.quantile('request_seconds', 0.99, action='a"b') \
+        == float('inf')
+    registry.dump(f'{tmp_path}/metrics.prom')
+    with open(f'{tmp_path}/metrics.prom') as file:
+        lines = file.read().splitlines()
+    assert lines == [
+        '# TYPE requests_total counter',
+        'requests_total{action="getmatchdata"} 3',
+        '# TYPE request_seconds histogram',
+        'request_seconds_bucket{action="a\\"b",le="0.1"} 1',
+        'request_seconds_bucket{action="a\\"b",le="1"} 3',
+        'request_seconds_bucket{action="a\\"b",le="+Inf"} 4',
+        'request_seconds_sum{action="a\\"b"} 4.25',
+        'request_seconds_count{action="a\\"b"} 4']
+
+
+# test labels with values of different types, e.g. HTTP status and 'error'
+def test_registry_mixed_labels():
+    registry = Registry(buckets=(1,))
+    registry.inc('responses_total', status=200)
+    registry.inc('responses_total', status='error')
+    registry.observe('response_seconds', 0.5, status=200)
+    registry.observe('response_seconds', 0.5, status='error')
+    assert registry.get('responses_total', status=200) == 1
+    assert registry.quantile('response_seconds', 0.5, status='error') == 1
+    lines = registry.render().splitlines()
+    assert 'responses_total{status="200"} 1' in lines
+    assert 'responses_total{status="error"} 1' in lines
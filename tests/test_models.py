@@ -1,6 +1,7 @@
 from teamproject import models
 import pandas as pd
 import numpy as np
+import pytest
 
 
 # downloading the pd dataframe for the second test_dataset
@@ -135,3 +136,233 @@ def test_DixonColes():
                         0.2856030466160332,
                         0.26890220334843756],
                        rtol=0.001, atol=0.001)
+
+
+def test_DixonColes_likelihood():
+    model = models.DixonColes(epl_1718, 0.0018)
+    teams = np.sort(epl_1718['homeTeamName'].unique())
+    arrays = model.match_arrays(epl_1718, teams, model.xi)
+    params = np.random.default_rng(0).uniform(-0.5, 0.5, 2 * len(teams) + 2)
+    params[-2] = -0.1
+
+    # the vectorized likelihood equals the likelihood of scipy's poisson
+    # distribution with rho correction and time decay
+    from scipy.stats import poisson
+    attack = dict(zip(teams, params[:len(teams)]))
+    defence = dict(zip(teams, params[len(teams):-2]))
+    rho, gamma = params[-2:]
+    logLike = 0
+    for match in epl_1718.itertuples():
+        lambdaX = np.exp(attack[match.homeTeamName]
+                         + defence[match.guestTeamName] + gamma)
+        muY = np.exp(attack[match.guestTeamName] + defence[match.homeTeamName])
+        correction = model.rho_correction(match.homeScore, match.guestScore,
+                                          lambdaX, muY, rho)
+        logLike += np.exp(-model.xi * match.time_dif) * (
+            np.log(correction)
+            + poisson.logpmf(match.homeScore, lambdaX)
+            + poisson.logpmf(match.guestScore, muY))
+    assert np.isclose(model.estimate_paramters(params, len(teams), arrays),
+                      -logLike)
+
+
+def test_DixonColes_gradient():
+    model = models.DixonColes(epl_1718, 0.0018)
+    teams = np.sort(epl_1718['homeTeamName'].unique())
+    arrays = model.match_arrays(epl_1718, teams, model.xi)
+    params = np.random.default_rng(0).uniform(-0.5, 0.5, 2 * len(teams) + 2)
+    params[-2] = -0.1
+
+    # the analytic gradient equals the numerical gradient
+    from scipy.optimize import approx_fprime
+    _, grad = model.estimate_paramters(params, len(teams), arrays, True)
+    numGrad = approx_fprime(
+        params, lambda p: model.estimate_paramters(p, len(teams), arrays), 1e-6)
+    assert np.allclose(grad, numGrad, rtol=1e-4, atol=1e-3)
+
+    # the attack values sum up to the number of teams
+    attack = [model.params['attack_' + team] for team in teams]
+    assert np.isclose(sum(attack), len(teams))
+
+
+def test_DixonColes_update():
+    model = models.DixonColes(epl_1718.iloc[:-10].copy(), 0.0018)
+    model.update(epl_1718.iloc[-10:])
+    model_full = models.DixonColes(epl_1718.copy(), 0.0018)
+
+    # adding the last matches gives the same fit as fitting all matches
+    assert np.allclose(model.df.time_dif, model_full.df.time_dif)
+    assert np.allclose(model.arrays['weights'], model_full.arrays['weights'])
+    assert np.allclose(model.predict('Brighton', 'Man City'),
+                       model_full.predict('Brighton', 'Man City'),
+                       rtol=0.001, atol=0.001)
+
+    # teams entering the window start with average values
+    model.refit(epl_1617.assign(datetime=epl_1718.datetime.iloc[:len(epl_1617)]))
+    assert 'Hull' in model.teams and 'Brighton' not in model.teams
+    assert np.allclose(sum(model.predict('Hull', 'Chelsea')), 1, atol=0.001)
+
+
+def test_PoissonRegression_statsmodels():
+    import statsmodels.api as sm
+    import statsmodels.formula.api as smf
+
+    # the coefficients equal those of the formula in statsmodels
+    for df in [test_dataset, epl_1617]:
+        model = models.PoissonRegression(df)
+        goalModelData = pd.concat([
+            df[['homeTeamName', 'guestTeamName', 'homeScore']].assign(home=1)
+            .set_axis(['team', 'opponent', 'goals', 'home'], axis=1),
+            df[['guestTeamName', 'homeTeamName', 'guestScore']].assign(home=0)
+            .set_axis(['team', 'opponent', 'goals', 'home'], axis=1)])
+        params = smf.glm('goals ~ home + team + opponent', goalModelData,
+                         family=sm.families.Poisson()).fit().params
+        coefs = {'Intercept': model.intercept, 'home': model.homeAdv}
+        for team, index in model.teamIndex.items():
+            if index > 0:
+                coefs[f'team[T.{team}]'] = model.attack[index]
+                coefs[f'opponent[T.{team}]'] = model.defence[index]
+        assert sorted(coefs) == sorted(params.index)
+        assert np.allclose([coefs[name] for name in params.index], params)
+
+
+def test_predict_many():
+    homeTeams = ['A', 'B', 'C', 'A', 'AB']
+    guestTeams = ['B', 'A', 'B', 'C', 'A']
+    epl_teams = np.unique(epl_1718['homeTeamName'])
+    model_list = [(models.BaselineAlgo(test_dataset), homeTeams, guestTeams),
+                  (models.PoissonRegression(test_dataset), homeTeams, guestTeams),
+                  (models.DixonColes(epl_1718, 0.0018),
+                   np.repeat(epl_teams, len(epl_teams)),
+                   np.tile(epl_teams, len(epl_teams)))]
+
+    # predicting many matches at once gives the same result as predict
+    for model, home, guest in model_list:
+        predictions = model.predict_many(home, guest)
+        assert predictions.shape == (len(home), 3)
+        assert np.allclose(predictions,
+                           [model.predict(h, g) for h, g in zip(home, guest)])
+
+    # teams can be given by their index in model.teams
+    model = model_list[2][0]
+    assert np.allclose(model.predict_many([0, 1], [1, 0]),
+                       model.predict_many(model.teams[:2], model.teams[1::-1]))
+
+    # indices out of range (e.g. team codes of the crawler) are rejected
+    for model, _, _ in model_list:
+        with pytest.raises(ValueError):
+            model.predict_many([0, len(model.teams)], [1, 0])
+        with pytest.raises(ValueError):
+            model.predict_many([0, 1], [-1, 0])
+
+
+def test_pair_probabilities():
+    for model in [models.PoissonRegression(epl_1617),
+                  models.DixonColes(epl_1718.iloc[:-10].copy(), 0.0018)]:
+        teams = model.teams
+        pairs = model.pair_probabilities()
+
+        # one row per home team and column per guest team, as by predict
+        assert pairs.shape == (len(teams), len(teams), 3)
+        assert np.allclose(pairs[3, 5], model.predict(teams[3], teams[5]))
+        homeGoals, guestGoals = model.expected_goals()
+        assert homeGoals.shape == guestGoals.shape == (len(teams), len(teams))
+
+        # computed once, then looked up
+        assert model.pair_probabilities() is pairs
+
+    # discarded when the model is refit
+    model.update(epl_1718.iloc[-10:])
+    assert model.pair_probabilities() is not pairs
+
+    # scores as returned by the crawler, unfinished matches are left out
+    unfinished = epl_1718.astype({'homeScore': 'Int64', 'guestScore': 'Int64'})
+    unfinished.loc[unfinished.index[-1], ['homeScore', 'guestScore']] = pd.NA
+    teams = np.unique(epl_1718['homeTeamName'])
+    for model, finished in [(models.PoissonRegression(unfinished),
+                             models.PoissonRegression(epl_1718.iloc[:-1])),
+                            (models.DixonColes(unfinished.copy(), 0.0018),
+                             models.DixonColes(epl_1718.iloc[:-1].copy(), 0.0018))]:
+        assert np.allclose(model.predict_many(teams, teams[::-1]),
+                           finished.predict_many(teams, teams[::-1]), atol=0.001)
+        assert np.allclose(model.predict(teams[0], 'Unknown'), finished.predict(teams[0], 'Unknown'),
+                           atol=0.001)
+
+
+def test_outcome_probabilities(capsys):
+    from scipy.stats import poisson
+    rng = np.random.default_rng(0)
+    homeGoalsAvg = rng.uniform(0.2, 4, 100)
+    awayGoalsAvg = rng.uniform(0.2, 4, 100)
+
+    # equal to the sums over the matrix of all scores up to maxGoals
+    goals = np.arange(11)
+    scores = (poisson.pmf(goals, homeGoalsAvg[:, None])[:, :, None]
+              * poisson.pmf(goals, awayGoalsAvg[:, None])[:, None, :])
+    expected = np.stack([np.tril(scores, -1).sum(axis=(1, 2)),
+                         np.trace(scores, axis1=1, axis2=2),
+                         np.triu(scores, 1).sum(axis=(1, 2))], axis=1)
+    assert np.allclose(models.outcome_probabilities(homeGoalsAvg, awayGoalsAvg, 10),
+                       expected)
+
+    # without maxGoals the probabilities are exact and add up to one
+    for rho in [0, -0.1]:
+        exact = models.outcome_probabilities(homeGoalsAvg, awayGoalsAvg, None, rho)
+        assert np.allclose(exact.sum(axis=1), 1)
+        assert np.allclose(
+            exact, models.outcome_probabilities(homeGoalsAvg, awayGoalsAvg, 60, rho))
+
+    # predictions are not printed
+    models.PoissonRegression(test_dataset).predict('A', 'B')
+    assert capsys.readouterr().out == ''
+
+
+def test_BaselineAlgo_unfinished():
+    # scores as returned by the crawler, unfinished matches have no score
+    df = test_dataset.astype({'homeScore': 'Int64', 'guestScore': 'Int64'})
+    df = pd.concat([df, pd.DataFrame([
+        {'datetime': '2018-09-01 18:30:00', 'homeTeamName': 'C',
+         'guestTeamName': 'A', 'homeScore': pd.NA, 'guestScore': pd.NA}])
+        .astype({'homeScore': 'Int64', 'guestScore': 'Int64'})],
+        ignore_index=True)
+    model = models.BaselineAlgo(df)
+
+    # unfinished matches are left out
+    assert model.predict('A', 'B') == [0.25, 0.25, 0.5]
+    assert model.predict('C', 'A') == [0.6, 0.2, 0.2]
+    assert np.allclose(model.predict_many(['A', 'C'], ['B', 'A']),
+                       [[0.25, 0.25, 0.5], [0.6, 0.2, 0.2]])
+
+
+# a warm start with an infeasible rho (e.g. from parameters of other matches) is clipped
+def test_DixonColes_infeasible_start():
+    model = models.DixonColes(epl_1718.copy(), 0.0018)
+    nTeams = len(model.teams)
+    initVals = np.concatenate((np.ones(nTeams), np.zeros(nTeams), [5.0, 0.3]))
+    model_warm = models.DixonColes(epl_1718.copy(), 0.0018)
+    model_warm.fit(epl_1718.copy(), initVals)
+    lower, upper = model_warm.rho_bounds(initVals, nTeams, model_warm.arrays)
+    assert lower < 0 < upper < 5.0
+    assert model_warm.estimate_paramters(initVals, nTeams, model_warm.arrays) == np.inf
+
+    # the fitted rho is in the feasible interval of the fitted parameters
+    params = model_warm.initial_values(model_warm.teams)
+    lower, upper = model_warm.rho_bounds(params, nTeams, model_warm.arrays)
+    assert lower < model_warm.params['rho'] < upper
+    assert np.isclose(model_warm.params['rho'], model.params['rho'], atol=0.01)
+    assert np.allclose(model_warm.predict('Brighton', 'Man City'),
+                       model.predict('Brighton', 'Man City'),
+                       rtol=0.001, atol=0.001)
+
+
+# a failed update leaves the model as it was
+def test_DixonColes_failed_update():
+    model = models.DixonColes(epl_1718.iloc[:-10].copy(), 0.0018)
+    prediction = model.predict('West Ham', 'Watford')
+    newMatches = epl_1718.iloc[-10:].copy()
+    newMatches.loc[newMatches.index[0], 'guestTeamName'] = 'Unknown'
+    with pytest.raises(ValueError):
+        model.update(newMatches)
+    assert 'Unknown' not in model.teams
+    assert len(model.df) == len(epl_1718) - 10
+    assert model.predict('West Ham', 'Watford') == prediction